@@ -0,0 +1,199 @@
+# backend/allocation_index.py
+"""
+Вторичные индексы по аллокациям снимка для серверной фильтрации,
+сортировки и постраничной выдачи. Строятся один раз на снимок.
+"""
+import base64
+import json
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from allocation_table import AllocationTable
+from models import IPAllocation
+
+# Поля, по которым можно сортировать
+SORT_FIELDS = ("ip_address", "org_name", "cloud_name", "pool_name", "allocation_type", "entity_name")
+
+# Поля с фильтром на точное совпадение
+FILTER_FIELDS = ("cloud_name", "pool_name", "org_name", "allocation_type")
+
+
+# Типы элементов ключа сортировки (см. AllocationIndex.sort_key) после первого:
+# ip, облако, пул, тип, объект, организация, номер строки
+_KEY_TAIL_TYPES = (int, str, str, str, str, str, int)
+
+
+def encode_cursor(key: Tuple, sort: str, descending: bool) -> str:
+    """
+    Курсор — ключ сортировки последней строки страницы (не зависит от снимка)
+    вместе с полем и направлением сортировки, для которых он выдан
+    """
+    payload = {"sort": sort, "desc": descending, "key": list(key)}
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+def decode_cursor(cursor: str, sort: str, descending: bool) -> Tuple:
+    """
+    Разобрать курсор для запроса с сортировкой sort; ValueError, если значение
+    некорректно или курсор выдан для другой сортировки
+    """
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception as e:
+        raise ValueError(f"Invalid cursor: {e}")
+    if not isinstance(payload, dict) or not isinstance(payload.get("key"), list):
+        raise ValueError("Invalid cursor")
+    if payload.get("sort") != sort or payload.get("desc") is not descending:
+        raise ValueError("Cursor does not match the requested sort")
+
+    key = payload["key"]
+    types = (int if sort == "ip_address" else str,) + _KEY_TAIL_TYPES
+    # bool — подкласс int, но в ключе его быть не может
+    if len(key) != len(types) or any(
+        not isinstance(value, kind) or isinstance(value, bool) for value, kind in zip(key, types)
+    ):
+        raise ValueError("Invalid cursor")
+    return tuple(key)
+
+
+class AllocationIndex:
+    """
+    Индексы аллокаций:
+    - порядок строк для каждого поля сортировки и ранги строк в нём;
+    - списки строк по значению каждого поля фильтра.
+    Запрос идёт по самому короткому подходящему списку (отсортированному
+    в нужном порядке), ищет начало страницы бинарным поиском по курсору
+    и проверяет остальные условия только для просмотренных строк.
+    """
+
+    def __init__(self, table: AllocationTable):
+        self.table = table
+        self._key_columns = tuple(
+            table.columns[field]
+            for field in ("cloud_name", "pool_name", "allocation_type", "entity_name", "org_name")
+        )
+        size = len(table)
+        self._ips = [ip if (ip := table.ip_int(row)) is not None else -1 for row in range(size)]
+        # Строка для подстрочного поиска (те же поля, что искал фронтенд)
+        orgs, pools, entities = (table.columns[f] for f in ("org_name", "pool_name", "entity_name"))
+        self._haystack = [
+            "\0".join((
+                table.ip_address(row), orgs.get(row), pools.get(row), entities.get(row) or ""
+            )).lower()
+            for row in range(size)
+        ]
+
+        # Базовый порядок — по стабильной части ключа; порядок по полю получается
+        # устойчивой сортировкой базового только по значению поля
+        base_order = sorted(range(size), key=lambda row: self.sort_key("ip_address", row))
+        self._order: Dict[str, List[int]] = {}
+        self._rank: Dict[str, array] = {}
+        for field in SORT_FIELDS:
+            if field == "ip_address":
+                order = base_order
+            else:
+                # casefold считается один раз на значение словаря, а не на строку
+                column = table.columns[field]
+                folded = [(value or "").casefold() for value in column.values]
+                primary = [folded[code] for code in column.codes]
+                order = sorted(base_order, key=primary.__getitem__)
+            rank = array("I", bytes(4 * len(order)))
+            for position, row in enumerate(order):
+                rank[row] = position
+            self._order[field] = order
+            self._rank[field] = rank
+
+        # Списки строк по значению поля фильтра — отдельно под каждую сортировку.
+        # Раскладка строк порядка сортировки по кодам поля сразу даёт отсортированные
+        # списки: O(N) на пару (фильтр, сортировка), без сортировки каждого списка.
+        # Строятся вместе со снимком (в рабочем потоке), запрос только читает их.
+        self._postings: Dict[Tuple[str, str], Dict[str, array]] = {}
+        for field in FILTER_FIELDS:
+            column = table.columns[field]
+            codes = column.codes
+            for sort in SORT_FIELDS:
+                by_code = [array("I") for _ in column.values]
+                for row in self._order[sort]:
+                    by_code[codes[row]].append(row)
+                self._postings[(field, sort)] = {
+                    value: rows for value, rows in zip(column.values, by_code) if rows
+                }
+
+    def sort_key(self, field: str, row: int) -> Tuple:
+        """
+        Полный ключ сортировки строки: значение поля + стабильные поля для разрешения равенства.
+        Номер строки в конце различает полностью одинаковые аллокации.
+        """
+        cloud, pool, allocation_type, entity, org = self._key_columns
+        ip = self._ips[row]
+        primary = ip if field == "ip_address" else (self.table.get(field, row) or "").casefold()
+        return (
+            primary, ip, cloud.get(row), pool.get(row), allocation_type.get(row),
+            entity.get(row) or "", org.get(row), row
+        )
+
+    def _plan(self, filters: Dict[str, Optional[str]], sort: str) -> Tuple[Sequence[int], List[Tuple[array, int]]]:
+        """Ведущий список строк и оставшиеся условия для проверки"""
+        active = [(field, value) for field, value in filters.items() if value is not None]
+        if not active:
+            return self._order[sort], []
+
+        driving = min(active, key=lambda fv: len(self._postings[(fv[0], sort)].get(fv[1], ())))
+        # Остальные условия проверяются сравнением кодов колонок
+        checks = [
+            (self.table.columns[field].codes, self.table.columns[field].code_of(value))
+            for field, value in active if (field, value) != driving
+        ]
+        return self._postings[(driving[0], sort)].get(driving[1], ()), checks
+
+    def _matches(self, row: int, checks: List[Tuple[array, int]], q: Optional[str]) -> bool:
+        for codes, code in checks:
+            if codes[row] != code:
+                return False
+        return not q or q in self._haystack[row]
+
+    def query(
+        self,
+        filters: Dict[str, Optional[str]],
+        q: Optional[str] = None,
+        sort: str = "ip_address",
+        descending: bool = False,
+        after: Optional[Tuple] = None,
+        limit: int = 100
+    ) -> Tuple[List[IPAllocation], Optional[Tuple]]:
+        """
+        Страница аллокаций, удовлетворяющих фильтрам, после ключа after.
+        Возвращает: (строки, ключ для следующей страницы или None)
+        """
+        driving, checks = self._plan(filters, sort)
+        q = q.lower() if q else None
+
+        if descending:
+            start = len(driving) - 1 if after is None else (
+                bisect_left(driving, after, key=lambda row: self.sort_key(sort, row)) - 1
+            )
+            positions = range(start, -1, -1)
+        else:
+            start = 0 if after is None else (
+                bisect_right(driving, after, key=lambda row: self.sort_key(sort, row))
+            )
+            positions = range(start, len(driving))
+
+        page: List[int] = []
+        for position in positions:
+            row = driving[position]
+            if self._matches(row, checks, q):
+                if len(page) == limit:
+                    return self.table.to_models(page), self.sort_key(sort, page[-1])
+                page.append(row)
+
+        return self.table.to_models(page), None
+
+    def count(self, filters: Dict[str, Optional[str]], q: Optional[str] = None) -> int:
+        """Число строк, удовлетворяющих фильтрам (просмотр ведущего списка)"""
+        driving, checks = self._plan(filters, "ip_address")
+        q = q.lower() if q else None
+        if not checks and not q:
+            return len(driving)
+        return sum(1 for row in driving if self._matches(row, checks, q))
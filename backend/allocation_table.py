@@ -0,0 +1,422 @@
+# backend/allocation_table.py
+"""
+Компактная колоночная таблица аллокаций для внутренней обработки снимка.
+IPv4 адреса хранятся целыми в array('I'), повторяющиеся строки
+(облако, пул, организация, тип, ...) — словарным кодированием.
+Модели IPAllocation строятся только при отдаче наружу.
+"""
+import socket
+from array import array
+from datetime import datetime, timedelta, timezone
+from json.encoder import encode_basestring
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
+
+from ip_calculator import IPCalculator
+from models import IPAllocation
+
+# Дата хранится как локальное время (микросекунды от эпохи) + часовой пояс
+_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+# Значение колонки дат для аллокаций без даты
+_NO_DATE = -2 ** 63
+# Значения deployed по индексу deployed + 1
+_DEPLOYED = (None, False, True)
+_DEPLOYED_JSON = ("null", "false", "true")
+# Порядок полей IPAllocation (словари и JSON строк)
+_FIELDS = (
+    "ip_address", "org_name", "org_id", "entity_name", "allocation_type",
+    "cloud_name", "pool_name", "allocation_date", "vapp_name", "deployed"
+)
+
+
+def format_ipv4(value: int) -> str:
+    """Целое число в строку IPv4 (быстрее ipaddress для горячих циклов)"""
+    return f"{value >> 24}.{(value >> 16) & 255}.{(value >> 8) & 255}.{value & 255}"
+
+
+def format_datetime(value: datetime) -> str:
+    """datetime в строку так же, как его сериализует pydantic (UTC — суффикс Z)"""
+    text = value.isoformat()
+    return text[:-6] + "Z" if text.endswith("+00:00") else text
+
+
+def _json_str(value: Optional[str]) -> str:
+    return "null" if value is None else encode_basestring(value)
+
+
+_TIMEZONES: Dict[timedelta, timezone] = {}
+
+
+def _fixed_timezone(offset: Optional[timedelta]) -> Optional[timezone]:
+    """Часовой пояс с фиксированным смещением (один объект на смещение)"""
+    if offset is None:
+        return None
+    tz = _TIMEZONES.get(offset)
+    if tz is None:
+        tz = _TIMEZONES[offset] = timezone(offset)
+    return tz
+
+
+class DictColumn:
+    """
+    Колонка со словарным кодированием: значения хранятся один раз,
+    строки таблицы — кодами в array('I'). Код 0 всегда означает None.
+    """
+    __slots__ = ("values", "codes", "_lookup")
+
+    def __init__(self):
+        self.values: List[Any] = [None]
+        self.codes = array("I")
+        self._lookup: Dict[Hashable, int] = {None: 0}
+
+    def encode(self, value: Hashable) -> int:
+        """Код значения (новое значение добавляется в словарь)"""
+        code = self._lookup.get(value)
+        if code is None:
+            code = self._lookup[value] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def code_of(self, value: Hashable) -> Optional[int]:
+        """Код значения или None, если его нет в колонке"""
+        return self._lookup.get(value)
+
+    def append(self, value: Hashable):
+        code = self._lookup.get(value)
+        self.codes.append(code if code is not None else self.encode(value))
+
+    def get(self, row: int) -> Any:
+        return self.values[self.codes[row]]
+
+    @classmethod
+    def from_values(cls, values: List[Any], codes: Iterable[int]) -> "DictColumn":
+        """Колонка из сохранённого словаря и кодов (см. AllocationTable.to_columns)"""
+        column = cls()
+        column.codes = array("I", codes)
+        if not values or values[0] is not None or (column.codes and max(column.codes) >= len(values)):
+            raise ValueError("Invalid dictionary column")
+        column.values = list(values)
+        column._lookup = {value: code for code, value in enumerate(column.values)}
+        return column
+
+    def take(self, values: List[Any], rows: Optional[Iterable[int]] = None) -> List[Any]:
+        """Значения для строк по коду: values — словарь колонки или его преобразование"""
+        if rows is None:
+            return [values[code] for code in self.codes]
+        codes = self.codes
+        return [values[codes[row]] for row in rows]
+
+    def select(self, rows: Iterable[int]) -> "DictColumn":
+        """Новая колонка из указанных строк (словарь копируется как есть)"""
+        column = DictColumn()
+        column.values = list(self.values)
+        column._lookup = dict(self._lookup)
+        codes = self.codes
+        column.codes = array("I", [codes[row] for row in rows])
+        return column
+
+    def extend_from(self, other: "DictColumn"):
+        """Дописать коды другой колонки, перекодировав их в свой словарь"""
+        mapping = [self.encode(value) for value in other.values]
+        self.codes.extend(array("I", map(mapping.__getitem__, other.codes)))
+
+
+class AllocationTable:
+    """
+    Аллокации по колонкам. Строки добавляются append() с теми же полями,
+    что у IPAllocation; строки одного облака и пула выбираются через rows_in().
+    """
+
+    STRING_FIELDS = (
+        "org_name", "org_id", "entity_name", "allocation_type",
+        "cloud_name", "pool_name", "vapp_name"
+    )
+
+    def __init__(self):
+        # IPv4 — целым числом; прочие значения (IPv6, 'N/A') — строкой в _ip_text
+        self._ip = array("I")
+        self._ip_text: Dict[int, str] = {}
+        self.columns: Dict[str, DictColumn] = {field: DictColumn() for field in self.STRING_FIELDS}
+        # Дата — локальное время в микросекундах + смещение пояса (словарём, их единицы)
+        self._date = array("q")
+        self._date_tz = DictColumn()
+        # deployed: -1 = None, 0 = False, 1 = True
+        self._deployed = array("b")
+        self._groups: Optional[Dict[Tuple[int, int], array]] = None
+        # JSON значений словарных колонок (кодируются при первой сериализации)
+        self._json_values: Optional[Dict[str, List[str]]] = None
+
+    def __len__(self) -> int:
+        return len(self._ip)
+
+    def append(
+        self,
+        ip_address: str,
+        org_name: str,
+        allocation_type: str,
+        cloud_name: str,
+        pool_name: str,
+        org_id: Optional[str] = None,
+        entity_name: Optional[str] = None,
+        allocation_date: Optional[datetime] = None,
+        vapp_name: Optional[str] = None,
+        deployed: Optional[bool] = None
+    ):
+        """
+        Добавить аллокацию. Обязательные поля должны быть строками, как в IPAllocation:
+        некорректная строка отклоняется здесь, а не при построении ответа.
+        """
+        for value in (ip_address, org_name, allocation_type, cloud_name, pool_name):
+            if not isinstance(value, str):
+                raise TypeError(f"Invalid allocation field value: {value!r}")
+
+        # IPv4 в канонической записи — целым числом, остальное — как есть
+        try:
+            packed = socket.inet_pton(socket.AF_INET, ip_address)
+            canonical = socket.inet_ntop(socket.AF_INET, packed) == ip_address
+        except OSError:
+            canonical = False
+        if canonical:
+            self._ip.append(int.from_bytes(packed, "big"))
+        else:
+            self._ip_text[len(self._ip)] = ip_address
+            self._ip.append(0)
+
+        columns = self.columns
+        columns["org_name"].append(org_name)
+        columns["org_id"].append(org_id)
+        columns["entity_name"].append(entity_name)
+        columns["allocation_type"].append(allocation_type)
+        columns["cloud_name"].append(cloud_name)
+        columns["pool_name"].append(pool_name)
+        columns["vapp_name"].append(vapp_name)
+
+        if allocation_date is None:
+            self._date.append(_NO_DATE)
+            self._date_tz.append(None)
+        else:
+            self._date.append((allocation_date.replace(tzinfo=None) - _EPOCH) // _MICROSECOND)
+            self._date_tz.append(_fixed_timezone(allocation_date.utcoffset()))
+
+        self._deployed.append(-1 if deployed is None else int(deployed))
+        self._groups = None
+        self._json_values = None
+
+    def extend(self, other: "AllocationTable"):
+        """Дописать строки другой таблицы"""
+        offset = len(self._ip)
+        self._ip.extend(other._ip)
+        for row, text in other._ip_text.items():
+            self._ip_text[offset + row] = text
+        for field, column in self.columns.items():
+            column.extend_from(other.columns[field])
+        self._date.extend(other._date)
+        self._date_tz.extend_from(other._date_tz)
+        self._deployed.extend(other._deployed)
+        self._groups = None
+        self._json_values = None
+
+    def select(self, rows: Sequence[int]) -> "AllocationTable":
+        """Новая таблица из указанных строк (в порядке rows)"""
+        table = AllocationTable()
+        table._ip = array("I", [self._ip[row] for row in rows])
+        table._ip_text = {
+            position: self._ip_text[row] for position, row in enumerate(rows) if row in self._ip_text
+        }
+        table.columns = {field: column.select(rows) for field, column in self.columns.items()}
+        table._date = array("q", [self._date[row] for row in rows])
+        table._date_tz = self._date_tz.select(rows)
+        table._deployed = array("b", [self._deployed[row] for row in rows])
+        return table
+
+    @classmethod
+    def concat(cls, tables: Iterable["AllocationTable"]) -> "AllocationTable":
+        """Новая таблица из строк нескольких таблиц (в порядке следования)"""
+        result = cls()
+        for table in tables:
+            result.extend(table)
+        return result
+
+    @classmethod
+    def from_dicts(cls, allocations: Iterable[Dict[str, Any]]) -> "AllocationTable":
+        """
+        Таблица из словарей в форме IPAllocation (снимки, сохранённые до to_columns()).
+        Дата может быть datetime (msgpack) или ISO строкой (JSON).
+        """
+        table = cls()
+        for a in allocations:
+            allocation_date = a.get("allocation_date")
+            if isinstance(allocation_date, str):
+                allocation_date = datetime.fromisoformat(allocation_date)
+            table.append(
+                ip_address=a["ip_address"], org_name=a["org_name"], allocation_type=a["allocation_type"],
+                cloud_name=a["cloud_name"], pool_name=a["pool_name"], org_id=a.get("org_id"),
+                entity_name=a.get("entity_name"), allocation_date=allocation_date,
+                vapp_name=a.get("vapp_name"), deployed=a.get("deployed")
+            )
+        return table
+
+    # --- Чтение ---
+
+    def ip_address(self, row: int) -> str:
+        """IP адрес строки в исходном виде"""
+        text = self._ip_text.get(row)
+        return text if text is not None else format_ipv4(self._ip[row])
+
+    def ipv4(self, row: int) -> Optional[int]:
+        """IPv4 адрес строки целым числом (None для прочих значений)"""
+        return None if row in self._ip_text else self._ip[row]
+
+    def ip_int(self, row: int) -> Optional[int]:
+        """IP адрес строки целым числом, включая IPv6 (None для некорректных)"""
+        text = self._ip_text.get(row)
+        return self._ip[row] if text is None else IPCalculator.ip_to_int(text)
+
+    def ip_addresses(self, rows: Optional[Iterable[int]] = None) -> List[str]:
+        """IP адреса строк (всех, если rows не задан)"""
+        if rows is None:
+            rows = range(len(self._ip))
+        return [self.ip_address(row) for row in rows]
+
+    def get(self, field: str, row: int) -> Any:
+        """Значение строкового поля строки"""
+        return self.columns[field].get(row)
+
+    def allocation_date(self, row: int) -> Optional[datetime]:
+        """Дата аллокации строки (пояс — с фиксированным исходным смещением)"""
+        micros = self._date[row]
+        if micros == _NO_DATE:
+            return None
+        return (_EPOCH + timedelta(microseconds=micros)).replace(tzinfo=self._date_tz.get(row))
+
+    def deployed(self, row: int) -> Optional[bool]:
+        """Признак deployed строки"""
+        return _DEPLOYED[self._deployed[row] + 1]
+
+    def to_model(self, row: int) -> IPAllocation:
+        """Модель аллокации для ответа API"""
+        columns = self.columns
+        return IPAllocation(
+            ip_address=self.ip_address(row),
+            org_name=columns["org_name"].get(row),
+            org_id=columns["org_id"].get(row),
+            entity_name=columns["entity_name"].get(row),
+            allocation_type=columns["allocation_type"].get(row),
+            cloud_name=columns["cloud_name"].get(row),
+            pool_name=columns["pool_name"].get(row),
+            allocation_date=self.allocation_date(row),
+            vapp_name=columns["vapp_name"].get(row),
+            deployed=self.deployed(row)
+        )
+
+    def to_models(self, rows: Optional[Iterable[int]] = None) -> List[IPAllocation]:
+        """Модели строк (всех, если rows не задан)"""
+        return [self.to_model(row) for row in self._rows(rows)]
+
+    def _rows(self, rows: Optional[Iterable[int]]) -> Iterable[int]:
+        return range(len(self._ip)) if rows is None else rows
+
+    def to_columns(self) -> Dict[str, Any]:
+        """
+        Колонки таблицы простыми списками (сериализуются и msgpack, и JSON) —
+        для хранилища и кеша вместо словаря на каждую аллокацию.
+        """
+        return {
+            "ip": self._ip.tolist(),
+            "ip_text": [[row, text] for row, text in self._ip_text.items()],
+            "columns": {
+                field: {"values": column.values, "codes": column.codes.tolist()}
+                for field, column in self.columns.items()
+            },
+            "date": self._date.tolist(),
+            "date_tz": {
+                # смещение пояса в микросекундах
+                "values": [None if tz is None else tz.utcoffset(None) // _MICROSECOND for tz in self._date_tz.values],
+                "codes": self._date_tz.codes.tolist(),
+            },
+            "deployed": self._deployed.tolist(),
+        }
+
+    @classmethod
+    def from_columns(cls, data: Dict[str, Any]) -> "AllocationTable":
+        """Таблица из результата to_columns(); ValueError для несогласованных данных"""
+        table = cls()
+        table._ip = array("I", data["ip"])
+        table._ip_text = {row: text for row, text in data["ip_text"]}
+        table.columns = {
+            field: DictColumn.from_values(data["columns"][field]["values"], data["columns"][field]["codes"])
+            for field in cls.STRING_FIELDS
+        }
+        table._date = array("q", data["date"])
+        table._date_tz = DictColumn.from_values(
+            [None if offset is None else _fixed_timezone(offset * _MICROSECOND) for offset in data["date_tz"]["values"]],
+            data["date_tz"]["codes"]
+        )
+        table._deployed = array("b", data["deployed"])
+
+        size = len(table._ip)
+        lengths = [len(c.codes) for c in table.columns.values()]
+        lengths += [len(table._date), len(table._date_tz.codes), len(table._deployed)]
+        if any(length != size for length in lengths):
+            raise ValueError("Inconsistent allocation table columns")
+        return table
+
+    def json_rows(self, rows: Optional[Iterable[int]] = None) -> List[str]:
+        """
+        JSON объектов IPAllocation для строк, без построения моделей.
+        Значения словарных колонок кодируются в JSON один раз на значение.
+        """
+        if self._json_values is None:
+            self._json_values = {
+                field: [_json_str(value) for value in column.values]
+                for field, column in self.columns.items()
+            }
+        rows = list(self._rows(rows))
+        ip_text, dates, deployed = self._ip_text, self._date, self._deployed
+        ips = [
+            f'"{format_ipv4(self._ip[row])}"' if row not in ip_text else _json_str(ip_text[row])
+            for row in rows
+        ]
+        columns = [self.columns[field].take(self._json_values[field], rows) for field in _FIELDS[1:7]]
+        allocation_dates = [
+            f'"{format_datetime(self.allocation_date(row))}"' if dates[row] != _NO_DATE else "null"
+            for row in rows
+        ]
+        vapps = self.columns["vapp_name"].take(self._json_values["vapp_name"], rows)
+        deployed_json = [_DEPLOYED_JSON[deployed[row] + 1] for row in rows]
+
+        return [
+            f'{{"ip_address":{ip},"org_name":{org},"org_id":{org_id},"entity_name":{entity},'
+            f'"allocation_type":{allocation_type},"cloud_name":{cloud},"pool_name":{pool},'
+            f'"allocation_date":{allocation_date},"vapp_name":{vapp},"deployed":{deployed_value}}}'
+            for ip, org, org_id, entity, allocation_type, cloud, pool, allocation_date, vapp, deployed_value
+            in zip(ips, *columns, allocation_dates, vapps, deployed_json)
+        ]
+
+    # --- Выборки по облаку и пулу ---
+
+    def _build_groups(self) -> Dict[Tuple[int, int], array]:
+        groups: Dict[Tuple[int, int], array] = {}
+        clouds = self.columns["cloud_name"].codes
+        pools = self.columns["pool_name"].codes
+        for row, key in enumerate(zip(clouds, pools)):
+            rows = groups.get(key)
+            if rows is None:
+                rows = groups[key] = array("I")
+            rows.append(row)
+        return groups
+
+    def rows_in(self, cloud_name: str, pool_name: Optional[str] = None) -> Sequence[int]:
+        """Номера строк облака (и пула, если задан) в порядке добавления"""
+        if self._groups is None:
+            self._groups = self._build_groups()
+        cloud = self.columns["cloud_name"].code_of(cloud_name)
+        if cloud is None:
+            return ()
+        if pool_name is not None:
+            pool = self.columns["pool_name"].code_of(pool_name)
+            return self._groups.get((cloud, pool), ()) if pool is not None else ()
+        rows = [r for (c, _), group in self._groups.items() if c == cloud for r in group]
+        rows.sort()
+        return rows
+
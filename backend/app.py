@@ -1,12 +1,13 @@
 # backend/app.py
 import asyncio
-from fastapi import FastAPI, HTTPException, Depends, status, Query
+from fastapi import FastAPI, HTTPException, Depends, status, Query, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import FileResponse
+from fastapi.responses import FileResponse, Response
 from dotenv import load_dotenv
 import os
 import logging
-from typing import List, Dict, Set, Optional
+import time
+from typing import Callable, List, Dict, Set, Optional, Tuple
 from datetime import datetime, timedelta
 import pytz
 from pathlib import Path
@@ -15,23 +16,37 @@ import ipaddress
 from concurrent.futures import ThreadPoolExecutor
 import sqlite3
 import json
+from contextlib import asynccontextmanager
+from email.utils import formatdate
+from itertools import islice
 
 # Увеличиваем лимит заголовков для обработки больших ответов от VCD
 http.client._MAXHEADERS = 1000
 
 from vcd_client import VCDClient
 from ip_calculator import IPCalculator
-from models import DashboardData, CloudStats, IPPool, IPAllocation, IPConflict, Note, NoteCreate, NoteUpdate
+from models import (
+    DashboardData, DashboardSummary, CloudStats, IPPool, IPRange, IPConflict, Note, NoteCreate, NoteUpdate
+)
 from keycloak_auth import (
     get_current_active_user,
     login_user,
     refresh_token as refresh_keycloak_token,
     logout_user,
     KeycloakUser,
-    exchange_code_for_token
+    exchange_code_for_token,
+    jwks_store,
+    get_verified_token_stats
 )
-from redis_cache import cache
+from redis_cache import cache, CACHE_TTL
+from snapshot_poller import SnapshotPoller
+from dashboard_snapshot import DashboardSnapshot, PreparedJSON
+from allocation_index import SORT_FIELDS, encode_cursor, decode_cursor
+from allocation_table import AllocationTable
+from snapshot_store import snapshot_store
+from search_index import KINDS, SearchIndex, search_index, build_dashboard_index, index_note, remove_note
 from clouds_config import CLOUDS_CONFIG
+from pool_topology import get_topology, reload_topology
 from pydantic import BaseModel
 
 # Настройка логирования
@@ -44,14 +59,48 @@ logger = logging.getLogger(__name__)
 # Загружаем переменные окружения
 load_dotenv()
 
-app = FastAPI(title="VCD IP Manager", version="2.1.0")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Жизненный цикл приложения: фоновые обновления (снимок, ключи Keycloak, токены VCD) и закрытие соединений к VCD"""
+    await cache.connect()
+    index_all_notes()
+    await restore_dashboard_snapshot()
+    jwks_store.start()
+    for client in vcd_clients.values():
+        client.start()
+    dashboard_poller.start()
+    yield
+    await dashboard_poller.stop()
+    await jwks_store.stop()
+    for client in vcd_clients.values():
+        await client.aclose()
+    await cache.close()
+
+
+app = FastAPI(title="VCD IP Manager", version="2.1.0", lifespan=lifespan)
 
 # Настройка часового пояса (Астана/Алматы)
 LOCAL_TZ = pytz.timezone('Asia/Almaty')
 
-# Thread pool для блокирующих вызовов (Keycloak, VCD API)
+# Thread pool для блокирующих вызовов (Keycloak)
 executor = ThreadPoolExecutor(max_workers=4)
 
+# Дедлайн на сбор данных с одного облака (секунды)
+CLOUD_FETCH_TIMEOUT = float(os.getenv("VCD_CLOUD_TIMEOUT", "60"))
+
+# Фоновое обновление снимка дашборда
+DASHBOARD_REFRESH_INTERVAL = float(os.getenv("DASHBOARD_REFRESH_INTERVAL", str(CACHE_TTL)))
+DASHBOARD_CACHE_KEY = "dashboard_data"
+DASHBOARD_CACHE_TAG = "dashboard"
+
+
+def cloud_cache_tag(cloud_name: str) -> str:
+    """Тег записей кеша с данными облака (инвалидация по одному облаку)"""
+    return f"cloud:{cloud_name}"
+
+DASHBOARD_CACHE_TTL = int(os.getenv("DASHBOARD_CACHE_TTL", "3600"))
+
 # ================== NOTES DATABASE ==================
 NOTES_DB_PATH = Path(__file__).parent / "notes.db"
 
@@ -84,6 +133,33 @@ def get_notes_db():
     conn.row_factory = sqlite3.Row
     return conn
 
+
+def note_from_row(row: sqlite3.Row) -> Note:
+    """Заметка из строки таблицы notes"""
+    return Note(
+        id=row["id"],
+        ip_address=row["ip_address"],
+        title=row["title"],
+        content=row["content"],
+        author=row["author"],
+        cloud_name=row["cloud_name"],
+        pool_name=row["pool_name"],
+        created_at=row["created_at"],
+        updated_at=row["updated_at"]
+    )
+
+
+def index_all_notes():
+    """Загрузить все заметки в поисковый индекс (при старте)"""
+    conn = get_notes_db()
+    try:
+        rows = conn.execute("SELECT * FROM notes").fetchall()
+    finally:
+        conn.close()
+    for row in rows:
+        index_note(note_from_row(row))
+    logger.info(f"Search index: {len(rows)} notes indexed")
+
 # CORS — ограничиваем до фронтенд-домена
 ALLOWED_ORIGINS = os.getenv(
     "CORS_ORIGINS",
@@ -112,168 +188,418 @@ for cloud_name, config in CLOUDS_CONFIG.items():
     else:
         logger.warning(f"Missing configuration for {cloud_name}")
 
+# Топология пулов строится один раз; при перезагрузке конфигурации — reload_topology()
+reload_topology(CLOUDS_CONFIG)
+
 
 def get_local_time():
     """Получить текущее локальное время"""
     return datetime.now(LOCAL_TZ)
 
 
-def check_ip_conflicts(all_allocations: List[IPAllocation]) -> Dict[str, List[IPConflict]]:
+async def collect_all_allocations(progress: Optional[Dict] = None) -> AllocationTable:
+    """
+    Параллельно собрать аллокации со всех облаков и пулов.
+    Каждое облако ограничено дедлайном CLOUD_FETCH_TIMEOUT, поэтому общее время
+    сбора определяется самым медленным облаком, а не суммой.
+    В progress (если передан) пишется число загруженных пулов.
+    """
+    topology = get_topology()
+
+    if progress is not None:
+        progress["pools_done"] = 0
+        progress["pools_total"] = sum(
+            len(topology.cloud_pools.get(cloud_name, [])) for cloud_name in vcd_clients
+        )
+
+    def on_pool_done():
+        if progress is not None:
+            progress["pools_done"] += 1
+
+    async def fetch_cloud(cloud_name: str, client: VCDClient) -> AllocationTable:
+        try:
+            return await client.get_all_used_ips(
+                [pool.config for pool in topology.cloud_pools.get(cloud_name, [])],
+                timeout=CLOUD_FETCH_TIMEOUT,
+                on_pool_done=on_pool_done
+            )
+        except Exception as e:
+            logger.error(f"Error collecting allocations from {cloud_name}: {e}")
+            return AllocationTable()
+
+    results = await asyncio.gather(*(
+        fetch_cloud(cloud_name, client) for cloud_name, client in vcd_clients.items()
+    ))
+    return AllocationTable.concat(results)
+
+
+def check_ip_conflicts(table: AllocationTable) -> Dict[str, List[IPConflict]]:
     """
     Проверяет конфликты IP адресов:
     1) Дубликаты внутри одного облака (DUPLICATE_IN_CLOUD)
     2) Дубликаты между облаками в shared/overlapping пулах (CROSS_CLOUD_CONFLICT)
+    Один проход по аллокациям: группа общих сетей для IP ищется по интервальному
+    индексу топологии за O(log P).
     """
     conflicts = {}
+    topology = get_topology()
+
+    # (облако, IP) -> строки таблицы и (группа, IP) -> строки таблицы
+    cloud_usage: Dict[tuple, List[int]] = {}
+    group_usage: Dict[tuple, List[int]] = {}
+
+    for row in range(len(table)):
+        ip = table.ip_address(row)
+        cloud_name = table.get("cloud_name", row)
+        cloud_usage.setdefault((cloud_name, ip), []).append(row)
+
+        ip_int = table.ipv4(row)
+        if ip_int is None:
+            continue
+        group = topology.find_group(ip_int)
+        if group is not None and cloud_name in group.clouds:
+            group_usage.setdefault((group.key, ip), []).append(row)
+
+    def values(field: str, rows: List[int]) -> List[str]:
+        return list({table.get(field, row) for row in rows})
 
     # --- 1. Конфликты внутри одного облака ---
-    cloud_allocations: Dict[str, List[IPAllocation]] = {}
-    for allocation in all_allocations:
-        cloud_allocations.setdefault(allocation.cloud_name, []).append(allocation)
-
-    for cloud_name, allocations in cloud_allocations.items():
-        ip_usage: Dict[str, List[IPAllocation]] = {}
-        for allocation in allocations:
-            ip_usage.setdefault(allocation.ip_address, []).append(allocation)
-
-        for ip, allocs in ip_usage.items():
-            if len(allocs) > 1:
-                conflicts.setdefault(ip, []).append(
-                    IPConflict(
-                        ip_address=ip,
-                        clouds=[cloud_name],
-                        pools=list({a.pool_name for a in allocs}),
-                        organizations=list({a.org_name for a in allocs}),
-                        conflict_type="DUPLICATE_IN_CLOUD"
-                    )
+    for (cloud_name, ip), rows in cloud_usage.items():
+        if len(rows) > 1:
+            conflicts.setdefault(ip, []).append(
+                IPConflict(
+                    ip_address=ip,
+                    clouds=[cloud_name],
+                    pools=values("pool_name", rows),
+                    organizations=values("org_name", rows),
+                    conflict_type="DUPLICATE_IN_CLOUD"
                 )
+            )
 
     # --- 2. Кросс-облачные конфликты в shared/overlapping пулах ---
-    # Строим группы пересекающихся сетей
-    pool_network_map = []  # [(cloud_name, pool_config, ip_network)]
-    for cname, cfg in CLOUDS_CONFIG.items():
-        for pool in cfg["pools"]:
-            try:
-                pool_network_map.append((cname, pool, ipaddress.ip_network(pool["network"])))
-            except ValueError:
-                continue
-
-    # Собираем группы сетей, которые пересекаются или явно связаны через shared_with
-    shared_groups: List[Set[str]] = []  # каждый элемент — множество (cloud_name, network)
-    for i, (c1, p1, n1) in enumerate(pool_network_map):
-        for j, (c2, p2, n2) in enumerate(pool_network_map):
-            if i >= j or c1 == c2:
-                continue
-            is_shared = (c2 in p1.get("shared_with", []) or
-                         c1 in p2.get("shared_with", []) or
-                         n1.overlaps(n2))
-            if is_shared:
-                pair = {(c1, p1["network"]), (c2, p2["network"])}
-                # Пробуем добавить в существующую группу
-                merged = False
-                for group in shared_groups:
-                    if group & pair:
-                        group |= pair
-                        merged = True
-                        break
-                if not merged:
-                    shared_groups.append(pair)
-
-    # Для каждой группы проверяем кросс-облачные дубликаты
-    for group in shared_groups:
-        clouds_in_group = {cn for cn, _ in group}
-        networks_in_group = {net for _, net in group}
-
-        # Собираем аллокации из этих облаков и этих сетей
-        group_allocs: Dict[str, List[IPAllocation]] = {}
-        for alloc in all_allocations:
-            if alloc.cloud_name in clouds_in_group:
-                # Проверяем, что IP принадлежит одной из сетей группы
-                for net_str in networks_in_group:
-                    try:
-                        net = ipaddress.ip_network(net_str)
-                        if ipaddress.ip_address(alloc.ip_address) in net:
-                            group_allocs.setdefault(alloc.ip_address, []).append(alloc)
-                            break
-                    except ValueError:
-                        continue
-
-        for ip, allocs in group_allocs.items():
-            unique_clouds = {a.cloud_name for a in allocs}
-            if len(unique_clouds) > 1:
-                conflicts.setdefault(ip, []).append(
-                    IPConflict(
-                        ip_address=ip,
-                        clouds=sorted(unique_clouds),
-                        pools=list({a.pool_name for a in allocs}),
-                        organizations=list({a.org_name for a in allocs}),
-                        conflict_type="CROSS_CLOUD_CONFLICT"
-                    )
+    for (_, ip), rows in group_usage.items():
+        unique_clouds = set(values("cloud_name", rows))
+        if len(unique_clouds) > 1:
+            conflicts.setdefault(ip, []).append(
+                IPConflict(
+                    ip_address=ip,
+                    clouds=sorted(unique_clouds),
+                    pools=values("pool_name", rows),
+                    organizations=values("org_name", rows),
+                    conflict_type="CROSS_CLOUD_CONFLICT"
                 )
+            )
 
     return conflicts
 
 
-def get_globally_used_ips_for_shared_pools() -> Dict[str, Set[str]]:
+def get_globally_used_ips_for_shared_pools(table: AllocationTable) -> Dict[str, Set[str]]:
     """
     Получить ВСЕ занятые IP для общих пулов со всех облаков, включая пересекающиеся подсети.
+    Берутся из уже собранной таблицы: пулы, не успевшие загрузиться к дедлайну
+    облака, повторно не запрашиваются.
     """
     shared_pool_ips = {}
+    topology = get_topology()
 
-    # Собираем все networks из всех clouds
-    all_networks = {}
-    for cloud_name, config in CLOUDS_CONFIG.items():
-        for pool in config["pools"]:
-            network = pool["network"]
-            try:
-                all_networks[network] = {
-                    "cloud": cloud_name,
-                    "pool_config": pool,
-                    "ip_net": ipaddress.ip_network(network)
-                }
-            except ValueError as e:
-                logger.error(f"Invalid network {network}: {e}")
-
-    # Детектируем shared: explicit (shared_with) + overlaps
-    shared_networks: Dict[str, Set[str]] = {}
-    network_keys = list(all_networks.keys())
-    for i, net1 in enumerate(network_keys):
-        info1 = all_networks[net1]
-        for net2 in network_keys[i + 1:]:
-            info2 = all_networks[net2]
-            # Проверяем только реальные пересечения или явные shared_with
-            has_overlap = info1["ip_net"].overlaps(info2["ip_net"])
-            explicitly_shared = (
-                info2["cloud"] in info1["pool_config"].get("shared_with", []) or
-                info1["cloud"] in info2["pool_config"].get("shared_with", [])
-            )
-            if has_overlap or explicitly_shared:
-                # Группируем по наибольшей сети (детерминированно)
-                larger = max(info1["ip_net"], info2["ip_net"],
-                             key=lambda n: (n.num_addresses, int(n.network_address)))
-                group_key = str(larger)
-                shared_networks.setdefault(group_key, set()).update([net1, net2])
-
-    logger.info(f"Found {len(shared_networks)} shared/overlapping network groups")
-
-    # Для каждой группы собираем used_ips со всех clouds
-    for group_key, networks in shared_networks.items():
-        shared_pool_ips[group_key] = set()
-        for cloud_name, client in vcd_clients.items():
-            config = CLOUDS_CONFIG[cloud_name]
-            for pool_config in config["pools"]:
-                if pool_config["network"] in networks:
-                    allocations = client.get_pool_used_ips(pool_config)
-                    for alloc in allocations:
-                        shared_pool_ips[group_key].add(alloc.ip_address)
-                    logger.info(
-                        f"Added {len(allocations)} IPs from "
-                        f"{cloud_name}/{pool_config['name']} to group {group_key}"
-                    )
+    logger.info(f"Found {len(topology.groups)} shared/overlapping network groups")
+
+    for group in topology.groups:
+        shared_pool_ips[group.key] = set()
+        for pool in group.pools:
+            if pool.cloud_name not in vcd_clients:
+                continue
+            ips = table.ip_addresses(table.rows_in(pool.cloud_name, pool.name))
+            shared_pool_ips[group.key].update(ips)
+            logger.info(f"Added {len(ips)} IPs from {pool.cloud_name}/{pool.name} to group {group.key}")
 
     return shared_pool_ips
 
 
+async def build_dashboard_snapshot(progress: Dict) -> DashboardSnapshot:
+    """
+    Собрать снимок дашборда со всех облаков (вызывается из фонового обновления).
+    Аллокации остаются в колоночной таблице: пулы получают из неё номера
+    своих строк, модели строятся только при сериализации ответа.
+    """
+    all_clouds_stats = []
+    total_ips_count = 0
+    used_ips_count = 0
+    free_ips_count = 0
+
+    # Данные каждой сборки должны быть свежими — сбрасываем кэши клиентов
+    for client in vcd_clients.values():
+        client.cache.clear()
+
+    # Собираем все аллокации для проверки конфликтов (все облака параллельно)
+    progress["stage"] = "collecting"
+    table = await collect_all_allocations(progress)
+
+    # Собираем занятые IP для shared/overlapping пулов из уже загруженных аллокаций
+    logger.info("Collecting used IPs for shared pools across all clouds...")
+    shared_pool_used_ips = get_globally_used_ips_for_shared_pools(table)
+
+    progress["stage"] = "processing"
+
+    # Проверяем конфликты (внутри облака + кросс-облачные)
+    conflicts = check_ip_conflicts(table)
+    if conflicts:
+        logger.warning(f"Found {len(conflicts)} IP conflicts!")
+        for ip, conflict_list in conflicts.items():
+            for conflict in conflict_list:
+                logger.warning(
+                    f"Conflict [{conflict.conflict_type}]: IP {ip} "
+                    f"in clouds: {conflict.clouds}, pools: {conflict.pools}"
+                )
+
+    # Обрабатываем каждое облако
+    topology = get_topology()
+    for cloud_name, client in vcd_clients.items():
+        pools = topology.cloud_pools.get(cloud_name, [])
+
+        try:
+            cloud_pools = []
+            cloud_total_ips = 0
+            cloud_used_ips = 0
+            cloud_free_ips = 0
+
+            for topology_pool in pools:
+                pool_config = topology_pool.config
+                pool_rows = table.rows_in(cloud_name, topology_pool.name)
+
+                network = topology_pool.network
+                used_ips_set = {ip for row in pool_rows if (ip := table.ip_int(row)) is not None}
+
+                # Если пул shared/overlapping — берем глобальные used IPs его группы
+                group = topology_pool.group
+                if group is not None and group.key in shared_pool_used_ips:
+                    used_ips_set = shared_pool_used_ips[group.key]
+
+                free_ranges, total, used, free = IPCalculator.calculate_free_ranges(
+                    network, used_ips_set
+                )
+                ip_version = topology_pool.ip_network.version
+
+                # Конфликты для этого пула
+                pool_conflicts = []
+                for ip in table.ip_addresses(pool_rows):
+                    if ip in conflicts:
+                        pool_conflicts.extend(conflicts[ip])
+
+                pool = IPPool(
+                    name=pool_config["name"],
+                    network=network,
+                    cloud_name=cloud_name,
+                    total_ips=total,
+                    used_ips=used,
+                    free_ips=free,
+                    usage_percentage=round((used / total * 100) if total > 0 else 0, 2),
+                    used_addresses=[],
+                    free_addresses=list(islice(
+                        IPCalculator.iter_range_ips(free_ranges, ip_version), 100
+                    )),
+                    free_ranges=[
+                        IPRange(
+                            start=IPCalculator.int_to_ip(start, ip_version),
+                            end=IPCalculator.int_to_ip(end, ip_version),
+                            count=end - start + 1
+                        )
+                        for start, end in free_ranges
+                    ],
+                    has_overlaps=group is not None,
+                    overlapping_clouds=pool_config.get("shared_with", []),
+                    conflicts=pool_conflicts if pool_conflicts else None
+                )
+
+                cloud_pools.append(pool)
+                cloud_total_ips += total
+                cloud_used_ips += used
+                cloud_free_ips += free
+
+            cloud_stats = CloudStats(
+                cloud_name=cloud_name,
+                total_pools=len(pools),
+                total_ips=cloud_total_ips,
+                used_ips=cloud_used_ips,
+                free_ips=cloud_free_ips,
+                usage_percentage=round(
+                    (cloud_used_ips / cloud_total_ips * 100) if cloud_total_ips > 0 else 0, 2
+                ),
+                pools=cloud_pools
+            )
+
+            all_clouds_stats.append(cloud_stats)
+
+            # Считаем общую статистику (уникальные сети)
+            counted_networks = set()
+            for topology_pool, pool_stats in zip(pools, cloud_pools):
+                network = topology_pool.network
+                if network not in counted_networks:
+                    total_ips_count += pool_stats.total_ips
+                    used_ips_count += pool_stats.used_ips
+                    free_ips_count += pool_stats.free_ips
+                    counted_networks.add(network)
+
+        except Exception as e:
+            logger.error(f"Error processing cloud {cloud_name}: {e}")
+            continue
+
+    dashboard = DashboardData(
+        last_update=get_local_time(),
+        total_clouds=len(all_clouds_stats),
+        total_ips=total_ips_count,
+        used_ips=used_ips_count,
+        free_ips=free_ips_count,
+        usage_percentage=round(
+            (used_ips_count / total_ips_count * 100) if total_ips_count > 0 else 0, 2
+        ),
+        clouds=all_clouds_stats,
+        all_allocations=[],
+        conflicts=conflicts if conflicts else {}
+    )
+
+    # Сериализация снимка и индексация — в рабочем потоке, чтобы не останавливать запросы
+    snapshot, index = await asyncio.to_thread(
+        prepare_dashboard_snapshot, lambda: DashboardSnapshot(dashboard, table)
+    )
+
+    # Сохраняем снимок для тёплого старта после рестарта: локально и в Redis
+    payload = await asyncio.to_thread(snapshot.to_payload)
+    try:
+        size = await asyncio.to_thread(
+            snapshot_store.save, "dashboard", payload, snapshot.data.last_update.timestamp()
+        )
+        logger.info(f"Dashboard snapshot persisted locally ({size} bytes)")
+    except Exception as e:
+        logger.error(f"Error persisting dashboard snapshot: {e}")
+    # Снимок содержит данные всех облаков — он помечен и тегом каждого из них
+    await cache.set(
+        DASHBOARD_CACHE_KEY, payload, ttl=DASHBOARD_CACHE_TTL,
+        tags=(DASHBOARD_CACHE_TAG, *(cloud_cache_tag(cloud.cloud_name) for cloud in snapshot.data.clouds))
+    )
+
+    search_index.set_dashboard(index)
+    return snapshot
+
+
+def prepare_dashboard_snapshot(
+    make_snapshot: Callable[[], DashboardSnapshot]
+) -> Tuple[DashboardSnapshot, SearchIndex]:
+    """
+    Собрать снимок и поисковый индекс по нему. Вызывается в рабочем потоке:
+    текущие снимок и индекс не меняются, подменяются на event loop.
+    """
+    snapshot = make_snapshot()
+    return snapshot, build_dashboard_index(snapshot.table, snapshot.data.conflicts)
+
+
+dashboard_poller = SnapshotPoller("dashboard", build_dashboard_snapshot, DASHBOARD_REFRESH_INTERVAL)
+
+
+async def restore_dashboard_snapshot():
+    """
+    Поднять последний снимок, чтобы не ждать первой сборки после рестарта:
+    из локального хранилища, а если его нет — из Redis.
+    """
+    source = "local store"
+    try:
+        stored = await asyncio.to_thread(snapshot_store.load_latest, "dashboard")
+    except Exception as e:
+        logger.error(f"Error loading local dashboard snapshot: {e}")
+        stored = None
+    cached_data = stored[0] if stored else None
+
+    if not cached_data:
+        source = "cache"
+        cached_data = await cache.get(DASHBOARD_CACHE_KEY)
+    if not cached_data:
+        return
+    try:
+        snapshot, index = await asyncio.to_thread(
+            prepare_dashboard_snapshot, lambda: DashboardSnapshot.from_payload(cached_data)
+        )
+        last_update = snapshot.data.last_update
+        search_index.set_dashboard(index)
+        dashboard_poller.set_snapshot(snapshot, updated_at=last_update.timestamp())
+        logger.info(f"Dashboard snapshot restored from {source} (last update: {last_update})")
+    except Exception as e:
+        logger.warning(f"Invalid stored dashboard snapshot from {source}, ignoring: {e}")
+
+
+def get_dashboard_snapshot() -> DashboardSnapshot:
+    """Текущий снимок дашборда; 503, пока первая сборка не завершилась"""
+    snapshot = dashboard_poller.snapshot
+    if snapshot is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail=dashboard_poller.get_status(),
+            headers={"Retry-After": "5"}
+        )
+    return snapshot
+
+
+def etag_matches(request: Request, etag: str) -> bool:
+    """Совпадает ли ETag с одним из значений заголовка If-None-Match"""
+    header = request.headers.get("if-none-match")
+    if not header:
+        return False
+    candidates = {value.strip().removeprefix("W/") for value in header.split(",")}
+    return "*" in candidates or etag in candidates
+
+
+def accepts_gzip(request: Request) -> bool:
+    """
+    Принимает ли клиент gzip по Accept-Encoding с учётом q-значений:
+    явное gzip;q=0 запрещает сжатие, '*' разрешает его, если gzip не указан.
+    """
+    weights: Dict[str, float] = {}
+    for part in request.headers.get("accept-encoding", "").split(","):
+        coding, _, params = part.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        weight = 1.0
+        for param in params.split(";"):
+            name, _, value = param.partition("=")
+            if name.strip().lower() == "q":
+                try:
+                    weight = float(value)
+                except ValueError:
+                    weight = 0.0
+        weights[coding] = weight
+    return weights.get("gzip", weights.get("x-gzip", weights.get("*", 0.0))) > 0
+
+
+def prepared_json_response(request: Request, prepared: PreparedJSON,
+                           headers: Optional[Dict[str, str]] = None) -> Response:
+    """
+    Ответ из заранее сериализованного JSON: готовые байты (сжатые, если клиент
+    принимает gzip) или 304, если ETag выбранного представления совпал.
+    """
+    use_gzip = accepts_gzip(request)
+    etag = prepared.gzip_etag if use_gzip else prepared.etag
+    response_headers = {
+        "ETag": etag,
+        "Age": str(int(dashboard_poller.age())),
+        **({"Last-Modified": formatdate(prepared.last_modified.timestamp(), usegmt=True)}
+           if prepared.last_modified is not None else {}),
+        "X-Snapshot-State": "refreshing" if dashboard_poller.running else "fresh",
+        "Cache-Control": "private, no-cache",
+        "Vary": "Accept-Encoding",
+        **(headers or {})
+    }
+
+    if etag_matches(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=response_headers)
+
+    if use_gzip:
+        response_headers["Content-Encoding"] = "gzip"
+        return Response(content=prepared.gzip_body, media_type="application/json",
+                        headers=response_headers)
+
+    return Response(content=prepared.body, media_type="application/json", headers=response_headers)
+
+
 # Модели для API
 class UserLogin(BaseModel):
     username: str
@@ -378,13 +704,21 @@ async def root():
 @app.get("/api/health")
 async def health_check():
     """Проверка состояния API (публичный)"""
-    redis_stats = cache.get_stats()
+    redis_stats = await cache.get_stats()
+    topology = get_topology()
 
     return {
-        "status": "healthy",
+        # Ошибки конфигурации пулов искажают учёт общих сетей
+        "status": "degraded" if topology.config_errors else "healthy",
         "timestamp": get_local_time().isoformat(),
         "timezone": str(LOCAL_TZ),
         "clouds_configured": list(vcd_clients.keys()),
+        "vcd_fetches": {name: client.get_stats() for name, client in vcd_clients.items()},
+        "dashboard_snapshot": dashboard_poller.get_status(),
+        "auth_keys": jwks_store.get_stats(),
+        "auth_tokens": get_verified_token_stats(),
+        "search_index": search_index.get_stats(),
+        "pool_topology": topology.get_stats(),
         "redis": redis_stats
     }
 
@@ -392,204 +726,237 @@ async def health_check():
 # ================== ЗАЩИЩЕННЫЕ ЭНДПОИНТЫ ==================
 
 @app.get("/api/dashboard", response_model=DashboardData)
-async def get_dashboard_data(current_user: KeycloakUser = Depends(get_current_active_user)):
-    """Получить все данные для дашборда (требует авторизации)"""
-
-    # Пытаемся получить из кеша и валидировать как Pydantic-модель
-    cache_key = "dashboard_data"
-    cached_data = cache.get(cache_key)
+async def get_dashboard_data(
+    request: Request,
+    current_user: KeycloakUser = Depends(get_current_active_user)
+):
+    """
+    Получить все данные для дашборда (требует авторизации).
+    Всегда отдаётся последний готовый снимок; обновление идёт в фоне.
+    Тело ответа сериализовано заранее, при совпадении If-None-Match — 304.
+    """
+    return prepared_json_response(request, get_dashboard_snapshot().full)
 
-    if cached_data:
-        try:
-            dashboard = DashboardData(**cached_data)
-            logger.info(f"Dashboard data loaded from cache for user {current_user.username}")
-            return dashboard
-        except Exception as e:
-            logger.warning(f"Invalid cached data, refreshing: {e}")
 
-    try:
-        all_clouds_stats = []
-        all_allocations = []
-        total_ips_count = 0
-        used_ips_count = 0
-        free_ips_count = 0
-
-        # Собираем занятые IP для shared/overlapping пулов
-        logger.info("Collecting used IPs for shared pools across all clouds...")
-        loop = asyncio.get_event_loop()
-        shared_pool_used_ips = await loop.run_in_executor(
-            executor, get_globally_used_ips_for_shared_pools
-        )
+@app.get("/api/dashboard/summary", response_model=DashboardSummary)
+async def get_dashboard_summary(
+    request: Request,
+    current_user: KeycloakUser = Depends(get_current_active_user)
+):
+    """
+    Сводка дашборда без списков адресов (требует авторизации).
+    Итоги по облакам и пулам и число конфликтов — для первой отрисовки.
+    """
+    return prepared_json_response(request, get_dashboard_snapshot().summary)
 
-        # Собираем все аллокации для проверки конфликтов
-        for cloud_name, client in vcd_clients.items():
-            config = CLOUDS_CONFIG[cloud_name]
-            pools = config["pools"]
-
-            try:
-                cloud_allocations = client.get_all_used_ips(pools)
-                all_allocations.extend(cloud_allocations)
-            except Exception as e:
-                logger.error(f"Error collecting allocations from {cloud_name}: {e}")
-
-        # Проверяем конфликты (внутри облака + кросс-облачные)
-        conflicts = check_ip_conflicts(all_allocations)
-        if conflicts:
-            logger.warning(f"Found {len(conflicts)} IP conflicts!")
-            for ip, conflict_list in conflicts.items():
-                for conflict in conflict_list:
-                    logger.warning(
-                        f"Conflict [{conflict.conflict_type}]: IP {ip} "
-                        f"in clouds: {conflict.clouds}, pools: {conflict.pools}"
-                    )
-
-        # Обрабатываем каждое облако
-        for cloud_name, client in vcd_clients.items():
-            config = CLOUDS_CONFIG[cloud_name]
-            pools = config["pools"]
-
-            try:
-                cloud_allocs = [a for a in all_allocations if a.cloud_name == cloud_name]
-
-                cloud_pools = []
-                cloud_total_ips = 0
-                cloud_used_ips = 0
-                cloud_free_ips = 0
-
-                for pool_config in pools:
-                    pool_allocations = [a for a in cloud_allocs if a.pool_name == pool_config["name"]]
-
-                    network = pool_config["network"]
-                    used_ips_set = set(a.ip_address for a in pool_allocations)
-
-                    # Если пул shared/overlapping — берем глобальные used IPs
-                    for group_key, ips in shared_pool_used_ips.items():
-                        try:
-                            pool_net = ipaddress.ip_network(network)
-                            group_net = ipaddress.ip_network(group_key)
-                            if pool_net.subnet_of(group_net) or network == group_key:
-                                used_ips_set = ips
-                                break
-                        except ValueError:
-                            continue
-
-                    free_ips_list, total, used, free = IPCalculator.calculate_free_ips(
-                        network, used_ips_set
-                    )
-
-                    # Конфликты для этого пула
-                    pool_conflicts = []
-                    for allocation in pool_allocations:
-                        if allocation.ip_address in conflicts:
-                            pool_conflicts.extend(conflicts[allocation.ip_address])
-
-                    pool = IPPool(
-                        name=pool_config["name"],
-                        network=network,
-                        cloud_name=cloud_name,
-                        total_ips=total,
-                        used_ips=used,
-                        free_ips=free,
-                        usage_percentage=round((used / total * 100) if total > 0 else 0, 2),
-                        used_addresses=pool_allocations,
-                        free_addresses=free_ips_list[:100],
-                        has_overlaps=any(
-                            network in nets for nets in shared_pool_used_ips.values()
-                        ),
-                        overlapping_clouds=pool_config.get("shared_with", []),
-                        conflicts=pool_conflicts if pool_conflicts else None
-                    )
-
-                    cloud_pools.append(pool)
-                    cloud_total_ips += total
-                    cloud_used_ips += used
-                    cloud_free_ips += free
-
-                cloud_stats = CloudStats(
-                    cloud_name=cloud_name,
-                    total_pools=len(pools),
-                    total_ips=cloud_total_ips,
-                    used_ips=cloud_used_ips,
-                    free_ips=cloud_free_ips,
-                    usage_percentage=round(
-                        (cloud_used_ips / cloud_total_ips * 100) if cloud_total_ips > 0 else 0, 2
-                    ),
-                    pools=cloud_pools
-                )
 
-                all_clouds_stats.append(cloud_stats)
-
-                # Считаем общую статистику (уникальные сети)
-                counted_networks = set()
-                for pool_config in pools:
-                    network = pool_config["network"]
-                    if network not in counted_networks:
-                        pool_stats = next(p for p in cloud_pools if p.name == pool_config["name"])
-                        total_ips_count += pool_stats.total_ips
-                        used_ips_count += pool_stats.used_ips
-                        free_ips_count += pool_stats.free_ips
-                        counted_networks.add(network)
-
-            except Exception as e:
-                logger.error(f"Error processing cloud {cloud_name}: {e}")
-                continue
+@app.get("/api/clouds/{cloud_name}", response_model=CloudStats)
+async def get_cloud_details(
+    cloud_name: str,
+    request: Request,
+    current_user: KeycloakUser = Depends(get_current_active_user)
+):
+    """Полные данные облака со всеми пулами из текущего снимка (требует авторизации)"""
+    prepared = get_dashboard_snapshot().get_cloud_json(cloud_name)
+    if prepared is None:
+        raise HTTPException(status_code=404, detail="Cloud not found")
+    return prepared_json_response(request, prepared)
 
-        dashboard = DashboardData(
-            last_update=get_local_time(),
-            total_clouds=len(all_clouds_stats),
-            total_ips=total_ips_count,
-            used_ips=used_ips_count,
-            free_ips=free_ips_count,
-            usage_percentage=round(
-                (used_ips_count / total_ips_count * 100) if total_ips_count > 0 else 0, 2
-            ),
-            clouds=all_clouds_stats,
-            all_allocations=all_allocations,
-            conflicts=conflicts if conflicts else {}
-        )
 
-        # Кешируем JSON-сериализованные данные через Pydantic
-        cache.set(cache_key, dashboard.dict(), ttl=300)
-        logger.info(f"Dashboard data cached for user {current_user.username}")
+@app.get("/api/dashboard/status")
+async def get_dashboard_status(current_user: KeycloakUser = Depends(get_current_active_user)):
+    """Состояние снимка дашборда и ход текущего обновления (требует авторизации)"""
+    return dashboard_poller.get_status()
 
-        return dashboard
 
-    except Exception as e:
-        logger.error(f"Error getting dashboard data: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+@app.post("/api/dashboard/refresh", status_code=status.HTTP_202_ACCEPTED)
+async def refresh_dashboard(current_user: KeycloakUser = Depends(get_current_active_user)):
+    """Поставить пересборку снимка дашборда в очередь (требует авторизации)"""
+    logger.info(f"Dashboard refresh requested by user {current_user.username}")
+    return dashboard_poller.request_refresh()
 
 
 @app.get("/api/conflicts")
 async def get_ip_conflicts(current_user: KeycloakUser = Depends(get_current_active_user)):
-    """Получить список конфликтующих IP адресов (требует авторизации)"""
-    try:
-        all_allocations = []
+    """Получить список конфликтующих IP адресов из текущего снимка (требует авторизации)"""
+    dashboard = get_dashboard_snapshot().data
 
-        for cloud_name, client in vcd_clients.items():
-            config = CLOUDS_CONFIG[cloud_name]
-            allocations = client.get_all_used_ips(config["pools"])
-            all_allocations.extend(allocations)
+    return {
+        "total_conflicts": len(dashboard.conflicts),
+        "conflicts": dashboard.conflicts,
+        "timestamp": dashboard.last_update
+    }
 
-        conflicts = check_ip_conflicts(all_allocations)
 
-        return {
-            "total_conflicts": len(conflicts),
-            "conflicts": conflicts,
-            "timestamp": get_local_time()
-        }
+@app.get("/api/allocations")
+async def query_allocations(
+    cloud: Optional[str] = Query(None),
+    pool: Optional[str] = Query(None),
+    org: Optional[str] = Query(None),
+    type: Optional[str] = Query(None, description="allocation_type"),
+    q: Optional[str] = Query(None, description="Подстрока в IP, организации, пуле или имени объекта"),
+    sort: str = Query("ip_address", description="Поле сортировки, '-' в начале — по убыванию"),
+    cursor: Optional[str] = Query(None),
+    limit: int = Query(100, ge=1, le=1000),
+    count: bool = Query(False, description="Посчитать общее число совпадений"),
+    current_user: KeycloakUser = Depends(get_current_active_user)
+):
+    """
+    Аллокации текущего снимка с фильтрами, сортировкой и курсорной пагинацией
+    (требует авторизации). Страница строится по индексам снимка — O(log N + limit).
+    """
+    descending = sort.startswith("-")
+    sort_field = sort.lstrip("-")
+    if sort_field not in SORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"Unsupported sort field: {sort_field}")
 
-    except Exception as e:
-        logger.error(f"Error checking conflicts: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
+    after = None
+    if cursor:
+        try:
+            after = decode_cursor(cursor, sort_field, descending)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+
+    index = get_dashboard_snapshot().allocations
+    filters = {"cloud_name": cloud, "pool_name": pool, "org_name": org, "allocation_type": type}
+    items, last_key = index.query(filters, q, sort_field, descending, after, limit)
+
+    result = {
+        "items": items,
+        "next_cursor": encode_cursor(last_key, sort_field, descending) if last_key is not None else None,
+        "snapshot_updated_at": dashboard_poller.get_status()["updated_at"]
+    }
+    if count:
+        result["total"] = index.count(filters, q)
+    return result
+
+
+@app.get("/api/search")
+async def search_everything(
+    q: str = Query(..., min_length=2),
+    kind: Optional[List[str]] = Query(None, description="allocation, conflict, note"),
+    limit: int = Query(50, ge=1, le=500),
+    current_user: KeycloakUser = Depends(get_current_active_user)
+):
+    """
+    Поиск по подстроке в аллокациях, конфликтах и заметках (требует авторизации).
+    Кандидаты берутся из триграммного индекса, результаты ранжируются по точности совпадения.
+    """
+    kinds = set(kind) if kind else None
+    if kinds and not kinds <= set(KINDS):
+        raise HTTPException(status_code=400, detail=f"Unsupported kind: {', '.join(kinds - set(KINDS))}")
+
+    started = time.perf_counter()
+    total, hits = search_index.search(q, kinds, limit)
+
+    return {
+        "query": q,
+        "total": total,
+        "hits": hits,
+        "took_ms": round((time.perf_counter() - started) * 1000, 2)
+    }
+
+
+@app.get("/api/pools/{cloud_name}/{pool_name:path}/free")
+async def get_pool_free_addresses(
+    cloud_name: str,
+    pool_name: str,
+    cursor: Optional[str] = Query(None, description="Последний адрес предыдущей страницы"),
+    limit: int = Query(256, ge=1, le=4096),
+    ranges: bool = Query(False, description="Отдавать диапазоны вместо отдельных адресов"),
+    current_user: KeycloakUser = Depends(get_current_active_user)
+):
+    """
+    Постраничный список свободных адресов пула (требует авторизации).
+    Страница вычисляется из свободных диапазонов текущего снимка — O(log R + limit).
+    """
+    snapshot = get_dashboard_snapshot()
+    pool = snapshot.get_pool(cloud_name, pool_name)
+    if pool is None:
+        raise HTTPException(status_code=404, detail="Pool not found")
+
+    after = None
+    if cursor:
+        after = IPCalculator.ip_to_int(cursor)
+        if after is None:
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+
+    free_ranges = snapshot.get_free_ranges(cloud_name, pool_name)
+    ip_version = ipaddress.ip_network(pool.network).version
+
+    if ranges:
+        page = IPCalculator.page_free_ranges(free_ranges, after, limit)
+        items = [
+            IPRange(
+                start=IPCalculator.int_to_ip(start, ip_version),
+                end=IPCalculator.int_to_ip(end, ip_version),
+                count=end - start + 1
+            )
+            for start, end in page
+        ]
+        last = page[-1][1] if page else None
+    else:
+        page = IPCalculator.page_free_ips(free_ranges, after, limit)
+        items = [IPCalculator.int_to_ip(ip, ip_version) for ip in page]
+        last = page[-1] if page else None
+
+    has_more = (
+        last is not None and
+        next(IPCalculator.iter_ranges_after(free_ranges, last), None) is not None
+    )
+
+    return {
+        "cloud_name": cloud_name,
+        "pool_name": pool_name,
+        "network": pool.network,
+        "free_ips": pool.free_ips,
+        "items": items,
+        "next_cursor": IPCalculator.int_to_ip(last, ip_version) if has_more else None,
+        "snapshot_updated_at": dashboard_poller.get_status()["updated_at"]
+    }
+
+
+@app.get("/api/pools/{cloud_name}/{pool_name:path}", response_model=IPPool)
+async def get_pool_details(
+    cloud_name: str,
+    pool_name: str,
+    request: Request,
+    current_user: KeycloakUser = Depends(get_current_active_user)
+):
+    """
+    Полные данные пула из текущего снимка (требует авторизации).
+    Объявлен после /free: имя пула может содержать '/'.
+    """
+    prepared = get_dashboard_snapshot().get_pool_json(cloud_name, pool_name)
+    if prepared is None:
+        raise HTTPException(status_code=404, detail="Pool not found")
+    return prepared_json_response(request, prepared)
 
 
 @app.post("/api/cache/clear")
-async def clear_cache(current_user: KeycloakUser = Depends(get_current_active_user)):
-    """Очистить кеш (требует авторизации)"""
+async def clear_cache(
+    cloud: Optional[str] = Query(None, description="Сбросить только данные этого облака"),
+    current_user: KeycloakUser = Depends(get_current_active_user)
+):
+    """
+    Очистить кеш и поставить пересборку снимка в очередь (требует авторизации).
+    С cloud удаляются записи с тегом облака, а его пулы при пересборке
+    загружаются из VCD целиком, без инкрементальной синхронизации.
+    """
+    if cloud is not None and cloud not in vcd_clients:
+        raise HTTPException(status_code=404, detail="Cloud not found")
     try:
-        cache.clear_pattern("dashboard_data*")
-        logger.info(f"Cache cleared by user {current_user.username}")
-        return {"message": "Cache cleared successfully"}
+        if cloud is not None:
+            vcd_clients[cloud].reset()
+            invalidation = await cache.invalidate_tags(cloud_cache_tag(cloud))
+        else:
+            invalidation = await cache.invalidate_tags(DASHBOARD_CACHE_TAG)
+        logger.info(f"Cache cleared by user {current_user.username}" + (f" for cloud {cloud}" if cloud else ""))
+        return {
+            "message": "Cache cleared successfully",
+            "invalidation": invalidation,
+            "refresh": dashboard_poller.request_refresh()
+        }
     except Exception as e:
         logger.error(f"Error clearing cache: {e}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -668,7 +1035,7 @@ async def create_note(
 
         logger.info(f"Note #{note_id} created by {current_user.username}")
 
-        return Note(
+        created = Note(
             id=note_id,
             ip_address=note.ip_address,
             title=note.title,
@@ -679,6 +1046,8 @@ async def create_note(
             created_at=now,
             updated_at=now
         )
+        index_note(created)
+        return created
     finally:
         conn.close()
 
@@ -733,17 +1102,9 @@ async def update_note(
 
         logger.info(f"Note #{note_id} updated by {current_user.username}")
 
-        return Note(
-            id=row["id"],
-            ip_address=row["ip_address"],
-            title=row["title"],
-            content=row["content"],
-            author=row["author"],
-            cloud_name=row["cloud_name"],
-            pool_name=row["pool_name"],
-            created_at=row["created_at"],
-            updated_at=row["updated_at"]
-        )
+        updated = note_from_row(row)
+        index_note(updated)
+        return updated
     finally:
         conn.close()
 
@@ -763,6 +1124,7 @@ async def delete_note(
 
         conn.execute("DELETE FROM notes WHERE id = ?", (note_id,))
         conn.commit()
+        remove_note(note_id)
 
         logger.info(f"Note #{note_id} deleted by {current_user.username}")
 
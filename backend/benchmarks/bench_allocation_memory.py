@@ -0,0 +1,117 @@
+# backend/benchmarks/bench_allocation_memory.py
+"""
+Память на одну аллокацию: список моделей IPAllocation против колоночной
+AllocationTable. Строки разбираются из JSON в форме ответов VCD
+(IP Space с датами и External Network с VM), поэтому учитываются и сами строки.
+
+Запуск (из каталога backend):
+    python -m benchmarks.bench_allocation_memory [число аллокаций]
+"""
+import gc
+import json
+import random
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+from allocation_table import AllocationTable
+from models import IPAllocation
+from vcd_client import _parse_allocation_date
+
+ALLOCATIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+
+
+def make_items(total: int) -> bytes:
+    """JSON со строками пулов: половина IP Space, половина External Network"""
+    rng = random.Random(42)
+    now = datetime(2026, 1, 1)
+    items = []
+    for i in range(total):
+        org = {"name": f"org-{rng.randint(1, 400)}", "id": f"urn:vcloud:org:{rng.randint(1, 400):08x}"}
+        ip = f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}"
+        if i % 2:
+            date = now - timedelta(days=rng.randint(0, 900), seconds=rng.randint(0, 86400))
+            items.append({
+                "cloud": "vcd", "pool": f"ipspace-{i % 4}", "value": ip, "type": "FLOATING_IP",
+                "orgRef": org, "allocationDate": date.strftime("%Y-%m-%dT%H:%M:%S.000+0500"),
+            })
+        else:
+            vm = f"vm-{rng.randint(1, 99999)}"
+            items.append({
+                "cloud": rng.choice(("vcd01", "vcd02")), "pool": f"extnet-{i % 8}", "ipAddress": ip,
+                "allocationType": rng.choice(("VM_ALLOCATED", "VM_ALLOCATED", "EDGE", "NAT")),
+                "orgRef": org, "entityName": vm, "vappName": f"vapp-{rng.randint(1, 20000)}",
+                "deployed": rng.random() < 0.9,
+            })
+    return json.dumps(items).encode()
+
+
+def row_fields(item: dict) -> dict:
+    """Поля аллокации так же, как их собирает VCDClient"""
+    org = item["orgRef"]
+    if "value" in item:
+        return dict(
+            ip_address=item["value"], org_name=org["name"], org_id=org["id"],
+            allocation_type="FLOATING_IP", cloud_name=item["cloud"], pool_name=item["pool"],
+            allocation_date=_parse_allocation_date(item["allocationDate"]),
+        )
+    return dict(
+        ip_address=item["ipAddress"], org_name=org["name"], org_id=org["id"],
+        entity_name=item["entityName"], allocation_type=item["allocationType"],
+        cloud_name=item["cloud"], pool_name=item["pool"],
+        vapp_name=item["vappName"], deployed=item["deployed"],
+    )
+
+
+def build_models(items):
+    return [IPAllocation(**row_fields(item)) for item in items]
+
+
+def build_table(items):
+    table = AllocationTable()
+    for item in items:
+        table.append(**row_fields(item))
+    return table
+
+
+def measure(build, body: bytes):
+    """
+    Удерживаемая память результата (байты) и время построения (мс).
+    Время — отдельным прогоном без tracemalloc, он замедляет каждое выделение.
+    """
+    items = json.loads(body)
+    start = time.perf_counter()
+    build(items)
+    elapsed = (time.perf_counter() - start) * 1000
+    del items
+
+    gc.collect()
+    tracemalloc.start()
+    items = json.loads(body)
+    result = build(items)
+    del items
+    gc.collect()
+    retained, _peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, retained, elapsed
+
+
+def main():
+    body = make_items(ALLOCATIONS)
+    print(f"allocations: {ALLOCATIONS}")
+    print(f"{'storage':<24}{'bytes':>14}{'bytes/alloc':>14}{'build ms':>12}")
+
+    models, models_bytes, models_ms = measure(build_models, body)
+    table, table_bytes, table_ms = measure(build_table, body)
+    assert table.to_models() == models
+
+    for name, size, elapsed in (
+        ("List[IPAllocation]", models_bytes, models_ms),
+        ("AllocationTable", table_bytes, table_ms),
+    ):
+        print(f"{name:<24}{size:>14,}{size / ALLOCATIONS:>14.1f}{elapsed:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
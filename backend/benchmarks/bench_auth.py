@@ -0,0 +1,71 @@
+# backend/benchmarks/bench_auth.py
+"""
+Стоимость авторизации одного запроса: полная проверка RS256 против кеша проверенных токенов.
+Keycloak не нужен: ключ генерируется локально и кладётся в JWKSKeyStore напрямую.
+
+Запуск (из каталога backend):
+    python -m benchmarks.bench_auth
+"""
+import asyncio
+import os
+import time
+
+os.environ.setdefault("KEYCLOAK_SERVER_URL", "https://keycloak.invalid")
+os.environ.setdefault("KEYCLOAK_REALM", "bench")
+os.environ.setdefault("KEYCLOAK_CLIENT_ID", "bench")
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from fastapi.security import HTTPAuthorizationCredentials
+from jose import jwk, jwt
+
+import keycloak_auth
+
+ITERATIONS = 2000
+
+
+def make_token() -> str:
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = private_key.private_bytes(
+        serialization.Encoding.PEM,
+        serialization.PrivateFormat.PKCS8,
+        serialization.NoEncryption()
+    ).decode()
+    keycloak_auth.jwks_store.keys = {"bench": jwk.construct(pem, "RS256").public_key()}
+    claims = {
+        "preferred_username": "bench",
+        "email": "bench@example.com",
+        "sub": "00000000-0000-0000-0000-000000000000",
+        "exp": int(time.time()) + 3600,
+        "realm_access": {"roles": ["offline_access", "uma_authorization", "default-roles"]},
+    }
+    return jwt.encode(claims, pem, algorithm="RS256", headers={"kid": "bench"})
+
+
+async def measure(credentials: HTTPAuthorizationCredentials, use_cache: bool) -> float:
+    """Среднее время get_current_user в микросекундах"""
+    start = time.perf_counter()
+    for _ in range(ITERATIONS):
+        if not use_cache:
+            keycloak_auth.verified_tokens.clear()
+        await keycloak_auth.get_current_user(credentials)
+    return (time.perf_counter() - start) / ITERATIONS * 1e6
+
+
+async def main():
+    credentials = HTTPAuthorizationCredentials(scheme="Bearer", credentials=make_token())
+    await keycloak_auth.get_current_user(credentials)
+
+    full = await measure(credentials, use_cache=False)
+    cached = await measure(credentials, use_cache=True)
+
+    print(f"iterations: {ITERATIONS}")
+    print(f"full RS256 verification: {full:8.1f} us/request")
+    print(f"verified-token cache:    {cached:8.1f} us/request")
+    print(f"speedup:                 {full / cached:8.1f}x")
+
+
+if __name__ == "__main__":
+    import logging
+    logging.disable(logging.INFO)
+    asyncio.run(main())
@@ -0,0 +1,129 @@
+# backend/benchmarks/bench_cache_codecs.py
+"""
+Кодеки кеша на снимке дашборда: размер в Redis, время кодирования и разбора.
+Снимок генерируется синтетически с формой реальных данных
+(облака, пулы, аллокации с датами, свободные диапазоны, конфликты).
+
+Запуск (из каталога backend):
+    python -m benchmarks.bench_cache_codecs [число аллокаций]
+"""
+import ipaddress
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+import pytz
+
+from cache_codecs import CODECS, decode_value
+from models import CloudStats, DashboardData, IPAllocation, IPConflict, IPPool, IPRange
+
+ALLOCATIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+REPEAT = 5
+TZ = pytz.timezone("Asia/Almaty")
+
+
+def make_dashboard(total: int) -> DashboardData:
+    rng = random.Random(42)
+    now = datetime.now(TZ)
+    clouds = []
+    all_allocations = []
+    conflicts = {}
+    pools_per_cloud = 4
+    per_pool = total // (3 * pools_per_cloud)
+
+    for c, cloud_name in enumerate(("vcd", "vcd01", "vcd02")):
+        pools = []
+        for p in range(pools_per_cloud):
+            network = ipaddress.ip_network(f"10.{c * 16 + p * 4}.0.0/18")
+            hosts = list(network.hosts())[1:per_pool + 1]
+            used = [
+                IPAllocation(
+                    ip_address=str(ip),
+                    org_name=f"org-{rng.randint(1, 400)}",
+                    org_id=f"urn:vcloud:org:{rng.getrandbits(64):016x}",
+                    entity_name=f"vm-{rng.randint(1, 99999)}",
+                    allocation_type=rng.choice(("VM_ALLOCATED", "FLOATING_IP", "EDGE", "NAT")),
+                    cloud_name=cloud_name,
+                    pool_name=f"pool-{c}-{p}",
+                    allocation_date=now - timedelta(days=rng.randint(0, 900)),
+                    vapp_name=f"vapp-{rng.randint(1, 20000)}",
+                    deployed=rng.random() < 0.9,
+                )
+                for ip in hosts
+            ]
+            last_used = int(hosts[-1]) if hosts else int(network.network_address)
+            free_ranges = [IPRange(
+                start=str(ipaddress.IPv4Address(last_used + 1)),
+                end=str(network.broadcast_address - 1),
+                count=int(network.broadcast_address) - 1 - last_used,
+            )]
+            pools.append(IPPool(
+                name=f"pool-{c}-{p}", network=str(network), cloud_name=cloud_name,
+                total_ips=network.num_addresses - 3, used_ips=len(used),
+                free_ips=network.num_addresses - 3 - len(used),
+                usage_percentage=round(len(used) / network.num_addresses * 100, 2),
+                used_addresses=used,
+                free_addresses=[str(ipaddress.IPv4Address(last_used + 1 + i)) for i in range(100)],
+                free_ranges=free_ranges,
+            ))
+            all_allocations.extend(used)
+        clouds.append(CloudStats(
+            cloud_name=cloud_name, total_pools=len(pools),
+            total_ips=sum(p.total_ips for p in pools), used_ips=sum(p.used_ips for p in pools),
+            free_ips=sum(p.free_ips for p in pools), usage_percentage=0.0, pools=pools,
+        ))
+
+    for allocation in rng.sample(all_allocations, len(all_allocations) // 50):
+        conflicts[allocation.ip_address] = [IPConflict(
+            ip_address=allocation.ip_address, clouds=["vcd", "vcd01"],
+            pools=[allocation.pool_name], organizations=[allocation.org_name],
+            conflict_type="CROSS_CLOUD_CONFLICT",
+        )]
+
+    return DashboardData(
+        last_update=now, total_clouds=len(clouds),
+        total_ips=sum(c.total_ips for c in clouds), used_ips=sum(c.used_ips for c in clouds),
+        free_ips=sum(c.free_ips for c in clouds), usage_percentage=0.0,
+        clouds=clouds, all_allocations=all_allocations, conflicts=conflicts,
+    )
+
+
+def best_of(func) -> float:
+    """Лучшее время из REPEAT запусков, мс"""
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return min(timings)
+
+
+def main():
+    dashboard = make_dashboard(ALLOCATIONS)
+    print(f"allocations: {len(dashboard.all_allocations)}, repeat: {REPEAT} (best)")
+    print(f"{'format':<28}{'bytes':>12}{'encode ms':>12}{'decode ms':>12}{'restore ms':>12}")
+
+    # JSON снимка через model_dump_json — прежний формат кеша, для сравнения
+    body = dashboard.model_dump_json().encode()
+    rows = [(
+        "model_dump_json (raw)", len(body),
+        best_of(dashboard.model_dump_json), 0.0,
+        best_of(lambda: DashboardData.model_validate_json(body)),
+    )]
+
+    for name, codec in CODECS.items():
+        data = codec.encode(dashboard.model_dump())
+        rows.append((
+            f"model_dump + {name}", len(data),
+            best_of(lambda: codec.encode(dashboard.model_dump())),
+            best_of(lambda: decode_value(data)),
+            best_of(lambda: DashboardData.model_validate(decode_value(data))),
+        ))
+
+    for name, size, encode_ms, decode_ms, restore_ms in rows:
+        print(f"{name:<28}{size:>12,}{encode_ms:>12.1f}{decode_ms:>12.1f}{restore_ms:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+# backend/benchmarks/bench_dashboard_build.py
+"""
+CPU-стоимость сборки снимка дашборда без учёта I/O: построение аллокаций,
+JSON ответа, словарь для кеша и подъём снимка из кеша.
+Сравниваются валидирующие модели pydantic и доверенный путь
+(колоночная таблица, JSON из колонок, колонки в кеше вместо словарей).
+
+Запуск (из каталога backend):
+    python -m benchmarks.bench_dashboard_build [число аллокаций]
+"""
+import sys
+import time
+
+from allocation_table import AllocationTable
+from benchmarks.bench_cache_codecs import make_dashboard
+from dashboard_snapshot import DashboardSnapshot
+from models import DashboardData, IPAllocation
+
+ALLOCATIONS = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+REPEAT = 3
+
+
+def best_of(func) -> float:
+    """Лучшее время из REPEAT запусков, мс"""
+    timings = []
+    for _ in range(REPEAT):
+        start = time.perf_counter()
+        func()
+        timings.append((time.perf_counter() - start) * 1000)
+    return min(timings)
+
+
+def main():
+    dashboard = make_dashboard(ALLOCATIONS)
+    payload = dashboard.model_dump()
+    rows = payload["all_allocations"]
+    snapshot = DashboardSnapshot.from_payload(payload)
+    stored = snapshot.to_payload()
+    assert DashboardSnapshot.from_payload(stored).table.to_models() == dashboard.all_allocations
+
+    def fill_table():
+        table = AllocationTable()
+        for row in rows:
+            table.append(**row)
+
+    stages = (
+        ("build allocations",
+         lambda: [IPAllocation(**row) for row in rows],
+         fill_table),
+        ("response JSON",
+         lambda: DashboardData.model_validate(payload).model_dump_json(),
+         snapshot._serialize_dashboard),
+        ("cache payload",
+         dashboard.model_dump,
+         snapshot.to_payload),
+        ("restore from cache",
+         lambda: DashboardData.model_validate(payload),
+         lambda: (DashboardData.model_validate(stored), AllocationTable.from_columns(stored["allocation_table"]))),
+    )
+
+    print(f"allocations: {len(rows)}, repeat: {REPEAT} (best)")
+    print(f"{'stage':<22}{'validated ms':>14}{'trusted ms':>12}{'speedup':>10}")
+    total_validated = total_trusted = 0.0
+    for name, validated, trusted in stages:
+        validated_ms, trusted_ms = best_of(validated), best_of(trusted)
+        total_validated += validated_ms
+        total_trusted += trusted_ms
+        print(f"{name:<22}{validated_ms:>14.1f}{trusted_ms:>12.1f}{validated_ms / trusted_ms:>9.1f}x")
+    print(f"{'total':<22}{total_validated:>14.1f}{total_trusted:>12.1f}{total_validated / total_trusted:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
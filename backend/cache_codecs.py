@@ -0,0 +1,109 @@
+# backend/cache_codecs.py
+"""
+Кодеки значений для Redis кеша. Кодек выбирается по префиксу ключа при записи;
+бинарные форматы помечаются первым байтом, поэтому чтение определяет кодек
+по самим данным, а старые JSON-значения читаются как раньше.
+"""
+import json
+import os
+from datetime import datetime
+from typing import Any, Dict
+
+import msgpack
+import zstandard
+
+# Уровень сжатия zstd (1..22); 3 — быстрый режим по умолчанию
+ZSTD_LEVEL = int(os.getenv("CACHE_ZSTD_LEVEL", "3"))
+
+
+class JSONCodec:
+    """JSON как раньше (datetime -> строка), без метки формата"""
+    name = "json"
+    marker = None
+
+    def encode(self, value: Any) -> bytes:
+        return json.dumps(value, default=str).encode()
+
+    def decode(self, data: bytes) -> Any:
+        return json.loads(data)
+
+
+def _msgpack_default(value: Any) -> Any:
+    if isinstance(value, datetime):
+        # Время с часовым поясом — нативный timestamp msgpack, без пояса — ISO строка
+        if value.tzinfo is not None:
+            return msgpack.Timestamp.from_datetime(value)
+        return value.isoformat()
+    return str(value)
+
+
+class MsgpackCodec:
+    """msgpack: компактнее JSON, datetime хранится как timestamp"""
+    name = "msgpack"
+    marker = b"\x01"
+
+    def encode(self, value: Any) -> bytes:
+        return self.marker + msgpack.packb(value, default=_msgpack_default)
+
+    def decode(self, data: bytes) -> Any:
+        return msgpack.unpackb(data[1:], timestamp=3)
+
+
+class MsgpackZstdCodec:
+    """msgpack со сжатием zstd — для больших снимков"""
+    name = "msgpack-zstd"
+    marker = b"\x02"
+
+    def __init__(self, level: int = ZSTD_LEVEL):
+        self.level = level
+
+    def encode(self, value: Any) -> bytes:
+        packed = msgpack.packb(value, default=_msgpack_default)
+        return self.marker + zstandard.ZstdCompressor(level=self.level).compress(packed)
+
+    def decode(self, data: bytes) -> Any:
+        return msgpack.unpackb(zstandard.ZstdDecompressor().decompress(data[1:]), timestamp=3)
+
+
+CODECS: Dict[str, Any] = {
+    codec.name: codec for codec in (JSONCodec(), MsgpackCodec(), MsgpackZstdCodec())
+}
+_BY_MARKER = {codec.marker: codec for codec in CODECS.values() if codec.marker}
+
+
+def parse_codec_rules(spec: str) -> Dict[str, str]:
+    """Правила 'prefix=codec,prefix=codec' из переменной окружения"""
+    rules = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        prefix, _, name = item.partition("=")
+        if name not in CODECS:
+            raise ValueError(f"Unknown cache codec '{name}' for prefix '{prefix}'")
+        rules[prefix] = name
+    return rules
+
+
+# Префикс ключа -> кодек; побеждает самый длинный подходящий префикс
+CODEC_RULES = parse_codec_rules(os.getenv("CACHE_CODEC_RULES", "dashboard_data=msgpack-zstd"))
+DEFAULT_CODEC = os.getenv("CACHE_DEFAULT_CODEC", "json")
+if DEFAULT_CODEC not in CODECS:
+    raise ValueError(f"Unknown cache codec '{DEFAULT_CODEC}'")
+
+
+def codec_for_key(key: str):
+    """Кодек для записи ключа"""
+    best = ""
+    for prefix in CODEC_RULES:
+        if key.startswith(prefix) and len(prefix) > len(best):
+            best = prefix
+    return CODECS[CODEC_RULES[best] if best else DEFAULT_CODEC]
+
+
+def encode_value(key: str, value: Any) -> bytes:
+    """Сериализовать значение кодеком, назначенным префиксу ключа"""
+    return codec_for_key(key).encode(value)
+
+
+def decode_value(data: bytes) -> Any:
+    """Разобрать значение: кодек определяется по первому байту"""
+    codec = _BY_MARKER.get(data[:1])
+    return codec.decode(data) if codec else json.loads(data)
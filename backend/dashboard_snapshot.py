@@ -0,0 +1,203 @@
+# backend/dashboard_snapshot.py
+"""
+Снимок данных дашборда и производные структуры для быстрых запросов к нему.
+Снимок неизменяем: при обновлении создаётся новый объект целиком.
+"""
+import gzip
+import hashlib
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple, Union
+
+from pydantic import BaseModel
+
+from allocation_index import AllocationIndex
+from allocation_table import AllocationTable, format_datetime
+from ip_calculator import IPCalculator, IntRange
+from models import (
+    CloudStats, CloudSummary, DashboardData, DashboardSummary, IPPool, PoolSummary
+)
+
+
+class PreparedJSON:
+    """
+    Ответ, сериализованный в JSON один раз: тело, gzip-копия, их ETag
+    (у каждого представления свой) и время снимка
+    """
+    __slots__ = ("body", "gzip_body", "etag", "gzip_etag", "last_modified")
+
+    def __init__(self, content: Union[BaseModel, bytes], last_modified: Optional[datetime] = None):
+        """
+        content — модель или уже готовое тело JSON; last_modified — время снимка.
+        ETag считается по содержимому без поля last_update: пересобранный снимок
+        с теми же данными сохраняет ETag, время отдаётся заголовком Last-Modified.
+        """
+        self.body: bytes = content if isinstance(content, bytes) else content.model_dump_json().encode()
+        self.gzip_body: bytes = gzip.compress(self.body, compresslevel=6, mtime=0)
+        self.last_modified = last_modified
+        digest_source = self.body
+        if last_modified is not None:
+            digest_source = digest_source.replace(
+                f'"last_update":"{format_datetime(last_modified)}"'.encode(), b"", 1
+            )
+        digest = hashlib.sha256(digest_source).hexdigest()[:32]
+        self.etag = f'"{digest}"'
+        self.gzip_etag = f'"{digest}-gzip"'
+
+
+def build_pool_summary(pool: IPPool) -> PoolSummary:
+    """Счётчики пула без списков адресов"""
+    return PoolSummary(
+        name=pool.name,
+        network=pool.network,
+        cloud_name=pool.cloud_name,
+        total_ips=pool.total_ips,
+        used_ips=pool.used_ips,
+        free_ips=pool.free_ips,
+        usage_percentage=pool.usage_percentage,
+        free_ranges_count=len(pool.free_ranges),
+        has_overlaps=pool.has_overlaps,
+        overlapping_clouds=pool.overlapping_clouds,
+        conflicts_count=len(pool.conflicts or [])
+    )
+
+
+def build_dashboard_summary(data: DashboardData, total_allocations: int) -> DashboardSummary:
+    """Сводка дашборда: только итоги по облакам и пулам"""
+    return DashboardSummary(
+        last_update=data.last_update,
+        total_clouds=data.total_clouds,
+        total_ips=data.total_ips,
+        used_ips=data.used_ips,
+        free_ips=data.free_ips,
+        usage_percentage=data.usage_percentage,
+        total_allocations=total_allocations,
+        total_conflicts=len(data.conflicts),
+        clouds=[
+            CloudSummary(
+                cloud_name=cloud.cloud_name,
+                total_pools=cloud.total_pools,
+                total_ips=cloud.total_ips,
+                used_ips=cloud.used_ips,
+                free_ips=cloud.free_ips,
+                usage_percentage=cloud.usage_percentage,
+                pools=[build_pool_summary(pool) for pool in cloud.pools]
+            )
+            for cloud in data.clouds
+        ]
+    )
+
+
+def _with_list(model_json: str, field: str, items: Iterable[str]) -> str:
+    """Дописать в JSON модели (сериализованной без field) поле-список из готовых JSON элементов"""
+    return f'{{"{field}":[{",".join(items)}],{model_json[1:]}'
+
+
+class DashboardSnapshot:
+    """
+    Готовый снимок дашборда вместе с индексами по пулам.
+    data — итоги, пулы и конфликты без списков аллокаций (all_allocations
+    и used_addresses пусты); сами аллокации хранятся в колоночной table.
+    JSON ответов собирается прямо из колонок, модели IPAllocation не строятся.
+    """
+
+    def __init__(self, data: DashboardData, table: AllocationTable):
+        self.data = data
+        self.table = table
+
+        self.clouds: Dict[str, CloudStats] = {cloud.cloud_name: cloud for cloud in data.clouds}
+        self.pools: Dict[Tuple[str, str], IPPool] = {
+            (cloud.cloud_name, pool.name): pool
+            for cloud in data.clouds
+            for pool in cloud.pools
+        }
+        self._free_ranges: Dict[Tuple[str, str], List[IntRange]] = {}
+        self.allocations = AllocationIndex(table)
+
+        # Полный дашборд, сводка и детализация по облакам и пулам сериализуются
+        # и сжимаются один раз, при сборке снимка (вне event loop)
+        self._cloud_json: Dict[str, PreparedJSON] = {}
+        self._pool_json: Dict[Tuple[str, str], PreparedJSON] = {}
+        self.full = PreparedJSON(self._serialize_dashboard(), data.last_update)
+        self.summary = PreparedJSON(build_dashboard_summary(data, len(table)), data.last_update)
+
+    @classmethod
+    def from_payload(cls, payload: Dict[str, Any]) -> "DashboardSnapshot":
+        """
+        Снимок из словаря to_payload() (хранилище или кеш).
+        Итоги и пулы проверяются моделью, аллокации поднимаются колонками без
+        разбора по строкам. Словарь в форме DashboardData.model_dump() (снимки
+        прежнего формата) тоже принимается.
+        """
+        if "allocation_table" in payload:
+            return cls(DashboardData.model_validate(payload), AllocationTable.from_columns(payload["allocation_table"]))
+
+        table = AllocationTable.from_dicts(payload.get("all_allocations", []))
+        data = DashboardData.model_validate({
+            **payload,
+            "all_allocations": [],
+            "clouds": [
+                {**cloud, "pools": [{**pool, "used_addresses": []} for pool in cloud.get("pools", [])]}
+                for cloud in payload.get("clouds", [])
+            ]
+        })
+        return cls(data, table)
+
+    def to_payload(self) -> Dict[str, Any]:
+        """
+        Снимок словарём для хранилища и кеша: итоги и пулы в форме DashboardData
+        (без списков аллокаций) и колонки таблицы в allocation_table.
+        """
+        payload = self.data.model_dump()
+        payload["allocation_table"] = self.table.to_columns()
+        return payload
+
+    def _serialize_pool(self, pool: IPPool, rows_json: List[str]) -> str:
+        used = [rows_json[row] for row in self.table.rows_in(pool.cloud_name, pool.name)]
+        return _with_list(pool.model_dump_json(exclude={"used_addresses"}), "used_addresses", used)
+
+    def _serialize_dashboard(self) -> bytes:
+        """
+        JSON полного дашборда. JSON аллокаций строится один раз, JSON каждого
+        пула — тоже: из него собираются и облака, и детализация пулов и облаков.
+        """
+        rows_json = self.table.json_rows()
+        clouds_json = []
+        for cloud in self.data.clouds:
+            pools_json = []
+            for pool in cloud.pools:
+                pool_json = self._serialize_pool(pool, rows_json)
+                pools_json.append(pool_json)
+                self._pool_json.setdefault(
+                    (cloud.cloud_name, pool.name), PreparedJSON(pool_json.encode(), self.data.last_update)
+                )
+            cloud_json = _with_list(cloud.model_dump_json(exclude={"pools"}), "pools", pools_json)
+            clouds_json.append(cloud_json)
+            self._cloud_json.setdefault(cloud.cloud_name, PreparedJSON(cloud_json.encode(), self.data.last_update))
+
+        body = _with_list(
+            self.data.model_dump_json(exclude={"clouds", "all_allocations"}), "all_allocations", rows_json
+        )
+        return _with_list(body, "clouds", clouds_json).encode()
+
+    def get_cloud_json(self, cloud_name: str) -> Optional[PreparedJSON]:
+        """Сериализованная детализация облака (None, если облака нет в снимке)"""
+        return self._cloud_json.get(cloud_name)
+
+    def get_pool_json(self, cloud_name: str, pool_name: str) -> Optional[PreparedJSON]:
+        """Сериализованная детализация пула (None, если пула нет в снимке)"""
+        return self._pool_json.get((cloud_name, pool_name))
+
+    def get_pool(self, cloud_name: str, pool_name: str) -> Optional[IPPool]:
+        """Пул по имени облака и имени пула (без списка used_addresses)"""
+        return self.pools.get((cloud_name, pool_name))
+
+    def get_free_ranges(self, cloud_name: str, pool_name: str) -> List[IntRange]:
+        """Свободные диапазоны пула в виде целых чисел (разбираются один раз на снимок)"""
+        key = (cloud_name, pool_name)
+        if key not in self._free_ranges:
+            pool = self.pools[key]
+            self._free_ranges[key] = [
+                (IPCalculator.ip_to_int(r.start), IPCalculator.ip_to_int(r.end))
+                for r in pool.free_ranges
+            ]
+        return self._free_ranges[key]
@@ -1,9 +1,15 @@
 import ipaddress
 import logging
-from typing import List, Set, Tuple
+import socket
+from bisect import bisect_right
+from itertools import islice
+from typing import Iterable, Iterator, List, Optional, Set, Tuple, Union
 
 logger = logging.getLogger(__name__)
 
+# Диапазон адресов [first, last] в виде целых чисел (включительно)
+IntRange = Tuple[int, int]
+
 
 class IPCalculator:
     """Класс для расчета свободных IP адресов в пуле"""
@@ -18,52 +24,165 @@ class IPCalculator:
             logger.error(f"Error parsing network {network}: {e}")
             return []
 
+    @staticmethod
+    def get_usable_range(network: str) -> Optional[IntRange]:
+        """
+        Диапазон доступных IP в виде целых чисел: хосты сети минус gateway.
+        /31 — point-to-point, оба IP usable (RFC 3021); /32 — единственный хост.
+        """
+        try:
+            net = ipaddress.ip_network(network, strict=False)
+        except Exception as e:
+            logger.error(f"Error parsing network {network}: {e}")
+            return None
+
+        first = int(net.network_address)
+        last = int(net.broadcast_address)
+        if net.prefixlen >= net.max_prefixlen - 1:
+            return first, last
+
+        # network (или Subnet-Router anycast для IPv6) + gateway
+        first += 2
+        if net.version == 4:
+            last -= 1  # broadcast
+        return first, last
+
     @staticmethod
     def get_reserved_ips(network: str) -> List[str]:
         """Получить зарезервированные IP адреса (gateway = первый IP)."""
         try:
             net = ipaddress.ip_network(network, strict=False)
-            hosts = list(net.hosts())
-
-            if not hosts:
-                return []
 
             # /31 — point-to-point, оба IP usable (RFC 3021)
             # /32 — единственный хост, нет gateway
-            if net.prefixlen >= 31:
+            if net.prefixlen >= net.max_prefixlen - 1:
                 return []
 
             # Для всех остальных сетей (включая /30) — резервируем gateway
-            return [str(hosts[0])]
+            return [str(net.network_address + 1)]
 
         except Exception as e:
             logger.error(f"Error getting reserved IPs for {network}: {e}")
             return []
 
     @staticmethod
-    def calculate_free_ips(network: str, used_ips: Set[str]) -> Tuple[List[str], int, int, int]:
+    def ipv4_to_int(ip: str) -> Optional[int]:
+        """IPv4 адрес в целое число (None, если это не IPv4)."""
+        try:
+            return int.from_bytes(socket.inet_pton(socket.AF_INET, ip), 'big')
+        except (OSError, TypeError):
+            return None
+
+    @staticmethod
+    def ip_to_int(ip: Union[str, int]) -> Optional[int]:
+        """IP адрес в целое число (None для некорректных значений вроде 'N/A')."""
+        if isinstance(ip, int):
+            return ip
+        value = IPCalculator.ipv4_to_int(ip)
+        if value is not None:
+            return value
+        try:
+            return int(ipaddress.ip_address(ip))
+        except ValueError:
+            return None
+
+    @staticmethod
+    def int_to_ip(value: int, version: int = 4) -> str:
+        """Целое число в строковый IP адрес."""
+        if version == 6:
+            return str(ipaddress.IPv6Address(value))
+        return str(ipaddress.IPv4Address(value))
+
+    @staticmethod
+    def sorted_used_in_range(used_ips: Iterable[Union[str, int]], usable: IntRange) -> List[int]:
+        """Отсортированные уникальные занятые IP (целые), попадающие в диапазон."""
+        first, last = usable
+        used = set()
+        for ip in used_ips:
+            value = IPCalculator.ip_to_int(ip)
+            if value is not None and first <= value <= last:
+                used.add(value)
+        return sorted(used)
+
+    @staticmethod
+    def calculate_free_ranges(
+        network: str, used_ips: Iterable[Union[str, int]]
+    ) -> Tuple[List[IntRange], int, int, int]:
         """
-        Рассчитать свободные IP адреса.
-        Возвращает: (free_ips, total_count, used_count, free_count)
+        Рассчитать свободное пространство пула в виде диапазонов.
+        Стоимость O(U log U) по числу занятых адресов, независимо от размера сети.
+        Возвращает: (free_ranges, total_count, used_count, free_count)
         """
-        all_ips = IPCalculator.get_all_ips_in_network(network)
-        reserved_ips = IPCalculator.get_reserved_ips(network)
+        usable = IPCalculator.get_usable_range(network)
+        if usable is None:
+            return [], 0, 0, 0
+
+        first, last = usable
+        used_sorted = IPCalculator.sorted_used_in_range(used_ips, usable)
+
+        free_ranges = []
+        cursor = first
+        for ip in used_sorted:
+            if ip > cursor:
+                free_ranges.append((cursor, ip - 1))
+            cursor = ip + 1
+        if cursor <= last:
+            free_ranges.append((cursor, last))
+
+        total_count = last - first + 1
+        used_count = len(used_sorted)
+        return free_ranges, total_count, used_count, total_count - used_count
 
-        all_ips_set = set(all_ips)
-        reserved_ips_set = set(reserved_ips)
+    @staticmethod
+    def iter_range_ips(free_ranges: Iterable[IntRange], version: int = 4) -> Iterator[str]:
+        """Последовательно перечислить адреса из диапазонов (лениво)."""
+        for start, end in free_ranges:
+            for value in range(start, end + 1):
+                yield IPCalculator.int_to_ip(value, version)
 
-        # Доступные IP = все хосты минус зарезервированные
-        usable_ips = all_ips_set - reserved_ips_set
+    @staticmethod
+    def iter_ranges_after(free_ranges: List[IntRange], after: Optional[int] = None) -> Iterator[IntRange]:
+        """
+        Диапазоны (отсортированные) начиная с первого адреса строго после after.
+        Поиск начальной позиции — бинарный, поэтому страница стоит O(log R + limit).
+        """
+        if after is None:
+            yield from free_ranges
+            return
 
-        # Используемые IP = пересечение used_ips с usable_ips (только IP из этой сети)
-        used_in_network = used_ips.intersection(usable_ips)
+        index = bisect_right(free_ranges, after, key=lambda r: r[1])
+        for start, end in islice(free_ranges, index, None):
+            yield max(start, after + 1), end
 
-        # Свободные IP
-        free_ips = sorted(list(usable_ips - used_in_network))
+    @staticmethod
+    def page_free_ips(free_ranges: List[IntRange], after: Optional[int], limit: int) -> List[int]:
+        """Страница свободных адресов (целые) после адреса after."""
+        page = []
+        for start, end in IPCalculator.iter_ranges_after(free_ranges, after):
+            page.extend(range(start, min(end, start + limit - len(page) - 1) + 1))
+            if len(page) >= limit:
+                break
+        return page
 
-        total_count = len(usable_ips)
-        used_count = len(used_in_network)
-        free_count = len(free_ips)
+    @staticmethod
+    def page_free_ranges(free_ranges: List[IntRange], after: Optional[int], limit: int) -> List[IntRange]:
+        """Страница свободных диапазонов после адреса after."""
+        return list(islice(IPCalculator.iter_ranges_after(free_ranges, after), limit))
+
+    @staticmethod
+    def calculate_free_ips(
+        network: str, used_ips: Set[str], limit: Optional[int] = None
+    ) -> Tuple[List[str], int, int, int]:
+        """
+        Рассчитать свободные IP адреса.
+        limit ограничивает длину списка free_ips (счётчики считаются полностью).
+        Возвращает: (free_ips, total_count, used_count, free_count)
+        """
+        free_ranges, total_count, used_count, free_count = IPCalculator.calculate_free_ranges(
+            network, used_ips
+        )
+        version = 6 if ':' in network else 4
+        free_ips = list(islice(IPCalculator.iter_range_ips(free_ranges, version), limit))
 
         return free_ips, total_count, used_count, free_count
 
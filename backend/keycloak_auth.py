@@ -1,10 +1,14 @@
 # backend/keycloak_auth.py
 import os
-from typing import Optional
+import time
+import asyncio
+import hashlib
+from typing import Optional, Dict
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
+from cachetools import TLRUCache
 from keycloak import KeycloakOpenID
-from jose import JWTError, jwt
+from jose import JWTError, jwt, jwk
 from dotenv import load_dotenv
 import logging
 import urllib3
@@ -22,6 +26,13 @@ KEYCLOAK_REALM = os.getenv("KEYCLOAK_REALM")
 KEYCLOAK_CLIENT_ID = os.getenv("KEYCLOAK_CLIENT_ID")
 KEYCLOAK_CLIENT_SECRET = os.getenv("KEYCLOAK_CLIENT_SECRET")
 
+# Ключи подписи realm (JWKS): фоновое обновление и минимальный интервал внепланового запроса
+JWKS_REFRESH_INTERVAL = int(os.getenv("JWKS_REFRESH_INTERVAL", "3600"))
+JWKS_MIN_REFETCH_INTERVAL = int(os.getenv("JWKS_MIN_REFETCH_INTERVAL", "30"))
+
+# Кеш проверенных токенов: размер LRU (запись живёт до exp токена)
+VERIFIED_TOKEN_CACHE_SIZE = int(os.getenv("VERIFIED_TOKEN_CACHE_SIZE", "1024"))
+
 if not all([KEYCLOAK_SERVER_URL, KEYCLOAK_REALM, KEYCLOAK_CLIENT_ID]):
     logger.error("Missing required Keycloak configuration!")
     logger.error(f"KEYCLOAK_SERVER_URL: {KEYCLOAK_SERVER_URL}")
@@ -46,6 +57,125 @@ except Exception as e:
 security = HTTPBearer()
 
 
+class JWKSKeyStore:
+    """
+    Локальный кеш ключей подписи realm по kid.
+    Токены проверяются офлайн. Запрос JWKS всегда один на всех: промах по kid,
+    пока ключи загружаются (например, при старте), ждёт эту загрузку; иначе
+    неизвестный kid вызывает не более одного повторного запроса за
+    JWKS_MIN_REFETCH_INTERVAL секунд после завершения предыдущего.
+    """
+
+    def __init__(self):
+        self.keys: Dict[str, object] = {}
+        # Время завершения последнего запроса JWKS (None — ещё не было)
+        self.last_fetch: Optional[float] = None
+        self.stats = {
+            "hits": 0, "misses": 0, "fetches": 0, "fetch_errors": 0, "rate_limited": 0, "joined_fetches": 0
+        }
+        self._fetch_task: Optional[asyncio.Task] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def _fetch(self) -> Dict[str, object]:
+        """Загрузить JWKS из Keycloak (блокирующий вызов, выполняется в потоке)"""
+        keys = {}
+        for key_data in keycloak_openid.certs().get("keys", []):
+            if key_data.get("use", "sig") != "sig" or key_data.get("kty") != "RSA":
+                continue
+            keys[key_data.get("kid")] = jwk.construct(key_data, algorithm=key_data.get("alg", "RS256"))
+        return keys
+
+    def _fetch_in_flight(self) -> bool:
+        return self._fetch_task is not None and not self._fetch_task.done()
+
+    async def refresh(self) -> bool:
+        """Обновить ключи; если запрос уже идёт, вызов ждёт его результата"""
+        if not self._fetch_in_flight():
+            self._fetch_task = asyncio.create_task(self._refresh())
+        # shield: отмена одного ожидающего не прерывает загрузку для остальных
+        return await asyncio.shield(self._fetch_task)
+
+    async def _refresh(self) -> bool:
+        """Загрузить ключи; при ошибке старые ключи сохраняются"""
+        self.stats["fetches"] += 1
+        try:
+            keys = await asyncio.to_thread(self._fetch)
+        except Exception as e:
+            self.stats["fetch_errors"] += 1
+            logger.error(f"Failed to fetch Keycloak JWKS: {e}")
+            return False
+        finally:
+            self.last_fetch = time.monotonic()
+        self.keys = keys
+        logger.info(f"Keycloak JWKS loaded: {len(keys)} signing key(s)")
+        return True
+
+    async def get_key(self, kid: Optional[str]):
+        """Ключ по kid; при промахе — общий и ограниченный по частоте запрос JWKS"""
+        key = self._lookup(kid)
+        if key is not None:
+            self.stats["hits"] += 1
+            return key
+
+        self.stats["misses"] += 1
+        if self._fetch_in_flight():
+            # Ключи как раз загружаются — ждём этот запрос, а не отказываем
+            self.stats["joined_fetches"] += 1
+            await self.refresh()
+            return self._lookup(kid)
+        if self.last_fetch is not None and time.monotonic() - self.last_fetch < JWKS_MIN_REFETCH_INTERVAL:
+            self.stats["rate_limited"] += 1
+            return None
+        logger.info(f"Unknown signing key id '{kid}', refetching JWKS")
+        await self.refresh()
+        return self._lookup(kid)
+
+    def _lookup(self, kid: Optional[str]):
+        if kid is None and len(self.keys) == 1:
+            return next(iter(self.keys.values()))
+        return self.keys.get(kid)
+
+    def start(self):
+        """Запустить фоновое обновление ключей"""
+        if keycloak_openid and (self._task is None or self._task.done()):
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Остановить фоновое обновление ключей"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        while True:
+            await self.refresh()
+            await asyncio.sleep(JWKS_REFRESH_INTERVAL)
+
+    def get_stats(self) -> dict:
+        """Статистика кеша ключей (для /api/health)"""
+        return {**self.stats, "keys": len(self.keys)}
+
+
+jwks_store = JWKSKeyStore()
+
+# sha256(token) -> (exp, KeycloakUser); запись удаляется в момент exp токена
+verified_tokens = TLRUCache(
+    maxsize=VERIFIED_TOKEN_CACHE_SIZE,
+    ttu=lambda _digest, entry, _now: entry[0],
+    timer=time.time
+)
+verified_token_stats = {"hits": 0, "misses": 0}
+
+
+def get_verified_token_stats() -> dict:
+    """Статистика кеша проверенных токенов (для /api/health)"""
+    return {**verified_token_stats, "size": len(verified_tokens)}
+
+
 class KeycloakUser:
     """Модель пользователя из Keycloak"""
     def __init__(self, username: str, email: str, roles: list, user_id: str):
@@ -69,8 +199,8 @@ def _extract_token_fields(token: dict) -> dict:
     }
 
 
-def verify_token(token: str) -> dict:
-    """Проверка токена через Keycloak"""
+async def verify_token(token: str) -> dict:
+    """Проверка токена офлайн по закешированным ключам realm"""
     if not keycloak_openid:
         raise HTTPException(
             status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
@@ -78,11 +208,13 @@ def verify_token(token: str) -> dict:
         )
 
     try:
-        KEYCLOAK_PUBLIC_KEY = (
-            "-----BEGIN PUBLIC KEY-----\n"
-            + keycloak_openid.public_key()
-            + "\n-----END PUBLIC KEY-----"
-        )
+        kid = jwt.get_unverified_header(token).get("kid")
+        public_key = await jwks_store.get_key(kid)
+        if public_key is None:
+            if not jwks_store.keys:
+                # Ключей нет вообще — проблема с Keycloak, а не с токеном
+                raise RuntimeError("No signing keys available")
+            raise JWTError(f"Unknown signing key id '{kid}'")
 
         options = {
             "verify_signature": True,
@@ -92,7 +224,7 @@ def verify_token(token: str) -> dict:
 
         token_info = jwt.decode(
             token,
-            KEYCLOAK_PUBLIC_KEY,
+            public_key,
             algorithms=["RS256"],
             options=options
         )
@@ -120,11 +252,21 @@ def verify_token(token: str) -> dict:
 async def get_current_user(
     credentials: HTTPAuthorizationCredentials = Depends(security)
 ) -> KeycloakUser:
-    """Получение текущего пользователя из токена"""
+    """
+    Получение текущего пользователя из токена.
+    Повторные запросы с тем же токеном берут пользователя из кеша без проверки подписи.
+    """
     token = credentials.credentials
+    digest = hashlib.sha256(token.encode()).digest()
+
+    cached = verified_tokens.get(digest)
+    if cached is not None:
+        verified_token_stats["hits"] += 1
+        return cached[1]
+    verified_token_stats["misses"] += 1
 
     try:
-        token_info = verify_token(token)
+        token_info = await verify_token(token)
 
         username = token_info.get("preferred_username", "unknown")
         email = token_info.get("email", "")
@@ -141,6 +283,9 @@ async def get_current_user(
             user_id=user_id
         )
 
+        if token_info.get("exp"):
+            verified_tokens[digest] = (token_info["exp"], user)
+
         logger.info(f"User authenticated: {username} (roles: {roles})")
         return user
 
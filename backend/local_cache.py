@@ -0,0 +1,122 @@
+# backend/local_cache.py
+"""
+In-process L1 кеш перед Redis: LRU с ограничением по суммарному размеру
+значений в байтах и TTL на запись.
+"""
+import fnmatch
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+# Признак промаха (None — допустимое значение)
+MISS = object()
+
+
+class _Entry:
+    __slots__ = ("raw", "value", "size", "expires_at")
+
+    def __init__(self, raw: bytes, size: int, expires_at: float):
+        self.raw = raw
+        # Десериализованное значение — заполняется при первом чтении через get()
+        self.value: Any = MISS
+        self.size = size
+        self.expires_at = expires_at
+
+
+class LocalLRUCache:
+    """
+    LRU по байтам. Хранит байты из Redis и, лениво, её разобранное значение,
+    поэтому повторные чтения не десериализуют JSON заново.
+    generation увеличивается при каждой инвалидации: чтение из L2,
+    начатое до инвалидации, не должно класть устаревшее значение в L1.
+    Операции под блокировкой: синхронный путь кеша вызывается и из потоков.
+    """
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.generation = 0
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "invalidations": 0}
+
+    def _get_entry(self, key: str) -> Optional[_Entry]:
+        entry = self._entries.get(key)
+        if entry is None:
+            self.stats["misses"] += 1
+            return None
+        if entry.expires_at <= time.monotonic():
+            self._drop(key)
+            self.stats["misses"] += 1
+            return None
+        self._entries.move_to_end(key)
+        self.stats["hits"] += 1
+        return entry
+
+    def get(self, key: str, decode) -> Any:
+        """Разобранное значение из L1 (decode применяется один раз) или MISS"""
+        with self._lock:
+            entry = self._get_entry(key)
+        if entry is None:
+            return MISS
+        # Разбор вне блокировки: в худшем случае значение разберут дважды
+        if entry.value is MISS:
+            entry.value = decode(entry.raw)
+        return entry.value
+
+    def set(self, key: str, raw: bytes, ttl: float, generation: Optional[int] = None):
+        """
+        Положить байты в L1. Если передан generation и с тех пор была
+        инвалидация — значение могло устареть, и оно не кешируется.
+        """
+        size = len(raw)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if generation is not None and generation != self.generation:
+                return
+            if key in self._entries:
+                self._drop(key)
+            self._entries[key] = _Entry(raw, size, time.monotonic() + ttl)
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._drop(oldest)
+                self.stats["evictions"] += 1
+
+    def _drop(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry.size
+
+    def invalidate(self, keys: List[str]):
+        """Удалить ключи из L1"""
+        with self._lock:
+            self.generation += 1
+            self.stats["invalidations"] += 1
+            for key in keys:
+                self._drop(key)
+
+    def invalidate_pattern(self, pattern: str) -> int:
+        """Удалить ключи по glob-паттерну (как KEYS/SCAN в Redis)"""
+        with self._lock:
+            self.generation += 1
+            self.stats["invalidations"] += 1
+            keys = [key for key in self._entries if fnmatch.fnmatchcase(key, pattern)]
+            for key in keys:
+                self._drop(key)
+        return len(keys)
+
+    def get_stats(self) -> Dict:
+        """Статистика L1"""
+        with self._lock:
+            stats, entries, size = dict(self.stats), len(self._entries), self.bytes
+        total = stats["hits"] + stats["misses"]
+        return {
+            **stats,
+            "entries": entries,
+            "bytes": size,
+            "max_bytes": self.max_bytes,
+            "hit_rate": round(stats["hits"] / total * 100, 2) if total else 0.0,
+        }
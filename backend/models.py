@@ -24,6 +24,12 @@ class IPConflict(BaseModel):
     organizations: List[str]  # Список организаций
     conflict_type: str  # DUPLICATE_ALLOCATION, OVERLAPPING_SUBNET
 
+class IPRange(BaseModel):
+    """Непрерывный диапазон IP адресов"""
+    start: str
+    end: str
+    count: int
+
 class IPPool(BaseModel):
     """Модель для пула IP адресов"""
     name: str
@@ -35,6 +41,7 @@ class IPPool(BaseModel):
     usage_percentage: float
     used_addresses: List[IPAllocation]
     free_addresses: List[str]
+    free_ranges: List[IPRange] = []  # всё свободное пространство пула диапазонами
     # Новые поля для конфликтов
     has_overlaps: bool = False
     overlapping_clouds: List[str] = []
@@ -50,6 +57,42 @@ class CloudStats(BaseModel):
     usage_percentage: float
     pools: List[IPPool]
 
+class PoolSummary(BaseModel):
+    """Счётчики пула без списков адресов"""
+    name: str
+    network: str
+    cloud_name: str
+    total_ips: int
+    used_ips: int
+    free_ips: int
+    usage_percentage: float
+    free_ranges_count: int
+    has_overlaps: bool = False
+    overlapping_clouds: List[str] = []
+    conflicts_count: int = 0
+
+class CloudSummary(BaseModel):
+    """Счётчики облака и его пулов"""
+    cloud_name: str
+    total_pools: int
+    total_ips: int
+    used_ips: int
+    free_ips: int
+    usage_percentage: float
+    pools: List[PoolSummary]
+
+class DashboardSummary(BaseModel):
+    """Лёгкая сводка дашборда для первой отрисовки"""
+    last_update: datetime
+    total_clouds: int
+    total_ips: int
+    used_ips: int
+    free_ips: int
+    usage_percentage: float
+    total_allocations: int
+    total_conflicts: int
+    clouds: List[CloudSummary]
+
 class DashboardData(BaseModel):
     """Общие данные для дашборда"""
     last_update: datetime
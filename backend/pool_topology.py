@@ -0,0 +1,201 @@
+# backend/pool_topology.py
+"""
+Топология IP-пулов: разобранные сети, группы общих/пересекающихся пулов
+и индексы cloud -> pools, pool -> group.
+Строится один раз из clouds_config.py и подменяется целиком при перезагрузке конфигурации.
+"""
+import ipaddress
+import logging
+from bisect import bisect_right
+from typing import Dict, List, Optional, Set, Tuple
+
+from clouds_config import CLOUDS_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+class TopologyPool:
+    """Пул из конфигурации с заранее разобранной сетью"""
+    __slots__ = ("cloud_name", "name", "config", "network", "ip_network",
+                 "first", "last", "group")
+
+    def __init__(self, cloud_name: str, config: Dict, ip_network):
+        self.cloud_name = cloud_name
+        self.name = config["name"]
+        self.config = config
+        self.network = config["network"]
+        self.ip_network = ip_network
+        self.first = int(ip_network.network_address)
+        self.last = int(ip_network.broadcast_address)
+        self.group: Optional["SharedGroup"] = None
+
+
+class SharedGroup:
+    """Группа пулов с общим адресным пространством (пересекающиеся сети)"""
+
+    def __init__(self, pools: List[TopologyPool]):
+        self.pools = pools
+        self.clouds: Set[str] = {p.cloud_name for p in pools}
+        self.networks: Set[str] = {p.network for p in pools}
+        # Ключ группы — наибольшая сеть (детерминированно)
+        largest = max(pools, key=lambda p: (p.ip_network.num_addresses, p.first))
+        self.key = str(largest.ip_network)
+
+
+class _UnionFind:
+    """Система непересекающихся множеств по индексам"""
+
+    def __init__(self, size: int):
+        self.parent = list(range(size))
+
+    def find(self, i: int) -> int:
+        while self.parent[i] != i:
+            self.parent[i] = self.parent[self.parent[i]]
+            i = self.parent[i]
+        return i
+
+    def union(self, a: int, b: int):
+        root_a, root_b = self.find(a), self.find(b)
+        if root_a != root_b:
+            self.parent[max(root_a, root_b)] = min(root_a, root_b)
+
+
+def _overlaps(p1: TopologyPool, p2: TopologyPool) -> bool:
+    """Сети пулов пересекаются"""
+    return p1.first <= p2.last and p2.first <= p1.last
+
+
+class PoolTopology:
+    """Неизменяемый индекс пулов и групп общих сетей"""
+
+    def __init__(self, clouds_config: Dict):
+        self.pools: List[TopologyPool] = []
+        self.cloud_pools: Dict[str, List[TopologyPool]] = {}
+        self._by_name: Dict[Tuple[str, str], TopologyPool] = {}
+        # Ошибки конфигурации (видны в /api/health, а не только в логе старта)
+        self.config_errors: List[str] = []
+
+        for cloud_name, cloud_config in clouds_config.items():
+            cloud_pools = self.cloud_pools.setdefault(cloud_name, [])
+            for pool_config in cloud_config["pools"]:
+                try:
+                    ip_network = ipaddress.ip_network(pool_config["network"])
+                except ValueError as e:
+                    self._config_error(f"Invalid network {pool_config['network']}: {e}")
+                    continue
+                pool = TopologyPool(cloud_name, pool_config, ip_network)
+                self.pools.append(pool)
+                cloud_pools.append(pool)
+                self._by_name[(cloud_name, pool.name)] = pool
+
+        # Объединяем пересекающиеся пулы транзитивно (union-find)
+        uf = _UnionFind(len(self.pools))
+        for i, p1 in enumerate(self.pools):
+            for j in range(i + 1, len(self.pools)):
+                if _overlaps(p1, self.pools[j]):
+                    uf.union(i, j)
+
+        # shared_with описывает ту же сеть в другом облаке — проверяем, что она там есть.
+        # Без пересечения сетей пулы не попадут в одну группу и общий учёт между
+        # облаками пропадёт, поэтому это ошибка конфигурации
+        for pool in self.pools:
+            for other_cloud in pool.config.get("shared_with", []):
+                if not any(_overlaps(pool, other) for other in self.cloud_pools.get(other_cloud, [])):
+                    self._config_error(
+                        f"Pool {pool.cloud_name}/{pool.name} is shared_with {other_cloud}, "
+                        f"but no pool there overlaps {pool.network}"
+                    )
+
+        components: Dict[int, List[TopologyPool]] = {}
+        for i, pool in enumerate(self.pools):
+            components.setdefault(uf.find(i), []).append(pool)
+
+        self.groups: List[SharedGroup] = []
+        for members in components.values():
+            if len(members) < 2:
+                continue
+            group = SharedGroup(members)
+            for pool in members:
+                pool.group = group
+            self.groups.append(group)
+
+        self._build_interval_index()
+
+        logger.info(
+            f"Pool topology built: {len(self.pools)} pools, "
+            f"{len(self.groups)} shared/overlapping network groups"
+        )
+
+    def _config_error(self, message: str):
+        logger.error(message)
+        self.config_errors.append(message)
+
+    def get_stats(self) -> Dict:
+        """Состояние топологии (для /api/health)"""
+        return {
+            "pools": len(self.pools),
+            "groups": len(self.groups),
+            "config_errors": self.config_errors,
+        }
+
+    def _build_interval_index(self):
+        """
+        Разбить адресное пространство IPv4-пулов на элементарные отрезки
+        с одинаковым набором владельцев: IP -> пулы ищется бинарным поиском.
+        """
+        ipv4_pools = [p for p in self.pools if p.ip_network.version == 4]
+        boundaries = sorted({p.first for p in ipv4_pools} | {p.last + 1 for p in ipv4_pools})
+
+        self._segment_starts: List[int] = boundaries
+        self._segment_pools: List[Tuple[TopologyPool, ...]] = []
+        self._segment_groups: List[Optional[SharedGroup]] = []
+        for start in boundaries:
+            owners = tuple(p for p in ipv4_pools if p.first <= start <= p.last)
+            self._segment_pools.append(owners)
+            # Пересекающиеся пулы всегда в одной группе
+            self._segment_groups.append(owners[0].group if owners else None)
+
+    def _segment(self, ip: int) -> int:
+        """Индекс отрезка, содержащего IPv4 адрес (-1, если адрес левее всех пулов)"""
+        return bisect_right(self._segment_starts, ip) - 1
+
+    def find_pools(self, ip: int) -> Tuple[TopologyPool, ...]:
+        """Пулы, в сети которых лежит IPv4 адрес (целое число)"""
+        index = self._segment(ip)
+        return self._segment_pools[index] if index >= 0 else ()
+
+    def find_group(self, ip: int) -> Optional[SharedGroup]:
+        """Группа общих сетей, которой принадлежит IPv4 адрес (целое число)"""
+        index = self._segment(ip)
+        return self._segment_groups[index] if index >= 0 else None
+
+    def get_pool(self, cloud_name: str, pool_name: str) -> Optional[TopologyPool]:
+        """Пул по имени облака и имени пула"""
+        return self._by_name.get((cloud_name, pool_name))
+
+    def get_group(self, cloud_name: str, pool_name: str) -> Optional[SharedGroup]:
+        """Группа общих сетей, в которую входит пул (None, если пул ни с кем не связан)"""
+        pool = self._by_name.get((cloud_name, pool_name))
+        return pool.group if pool else None
+
+
+_topology: Optional[PoolTopology] = None
+
+
+def get_topology() -> PoolTopology:
+    """Текущая топология (читайте ссылку один раз на запрос)"""
+    if _topology is None:
+        reload_topology(CLOUDS_CONFIG)
+    return _topology
+
+
+def reload_topology(clouds_config: Dict) -> PoolTopology:
+    """
+    Перестроить топологию из конфигурации.
+    Новый индекс строится полностью и только затем подменяет старый,
+    поэтому запросы видят либо старую, либо новую топологию целиком.
+    """
+    global _topology
+    topology = PoolTopology(clouds_config)
+    _topology = topology
+    return topology
@@ -0,0 +1,126 @@
+# backend/rate_control.py
+"""
+Ограничение нагрузки на внешний API: token bucket по частоте запросов
+и адаптивный лимит параллельных запросов (AIMD).
+"""
+import asyncio
+import time
+from typing import Dict, Optional
+
+
+class TokenBucket:
+    """
+    Token bucket: в среднем не больше rate запросов в секунду,
+    всплеск — до burst подряд. rate <= 0 — без ограничения.
+    """
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.burst
+        self.updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.stats = {"acquired": 0, "waited": 0, "wait_seconds": 0.0}
+
+    def _refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self):
+        """Дождаться токена (ожидающие обслуживаются по очереди)"""
+        self.stats["acquired"] += 1
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            if self.tokens < 1:
+                delay = (1 - self.tokens) / self.rate
+                self.stats["waited"] += 1
+                self.stats["wait_seconds"] += delay
+                await asyncio.sleep(delay)
+                self._refill(time.monotonic())
+            self.tokens -= 1
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            "wait_seconds": round(self.stats["wait_seconds"], 3),
+            "rate": self.rate,
+            "burst": self.burst,
+        }
+
+
+class AdaptiveConcurrency:
+    """
+    Лимит параллельных запросов по схеме AIMD: каждый быстрый ответ
+    увеличивает лимит на 1/limit (около +1 за «раунд» запросов), перегрузка
+    (429, 5xx, таймаут) уменьшает его вдвое, медленный ответ — на decrease_factor.
+    Уменьшения не чаще раза за среднее время ответа: запросы, ушедшие до
+    снижения лимита, не должны обрушить его до минимума.
+
+    Используется как async context manager вокруг одного запроса.
+    """
+
+    def __init__(self, max_limit: int, min_limit: int = 1, initial: Optional[int] = None,
+                 latency_target: float = 2.0, decrease_factor: float = 0.9):
+        self.min_limit = min_limit
+        self.max_limit = max(min_limit, max_limit)
+        self.limit = float(initial if initial is not None else max(min_limit, self.max_limit // 2))
+        self.latency_target = latency_target
+        self.decrease_factor = decrease_factor
+
+        self.in_flight = 0
+        self.latency_ewma: Optional[float] = None
+        self._last_decrease = 0.0
+        self._condition = asyncio.Condition()
+        self.stats = {"completed": 0, "overloaded": 0, "slow": 0, "decreases": 0}
+
+    @property
+    def current_limit(self) -> int:
+        return max(self.min_limit, int(self.limit))
+
+    async def __aenter__(self):
+        async with self._condition:
+            await self._condition.wait_for(lambda: self.in_flight < self.current_limit)
+            self.in_flight += 1
+        return self
+
+    async def __aexit__(self, *exc_info):
+        async with self._condition:
+            self.in_flight -= 1
+            self._condition.notify_all()
+
+    def _decrease(self, factor: float):
+        now = time.monotonic()
+        # Пока времени ответа не знаем — окно в latency_target
+        window = self.latency_ewma if self.latency_ewma is not None else self.latency_target
+        if now - self._last_decrease < window:
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.min_limit), self.limit * factor)
+        self.stats["decreases"] += 1
+
+    def on_success(self, latency: float):
+        """Учесть успешный ответ и его время"""
+        self.stats["completed"] += 1
+        self.latency_ewma = latency if self.latency_ewma is None else 0.8 * self.latency_ewma + 0.2 * latency
+        if latency > self.latency_target:
+            self.stats["slow"] += 1
+            self._decrease(self.decrease_factor)
+        else:
+            self.limit = min(float(self.max_limit), self.limit + 1 / self.limit)
+
+    def on_overload(self):
+        """Учесть признак перегрузки сервера (429, 5xx, таймаут)"""
+        self.stats["overloaded"] += 1
+        self._decrease(0.5)
+
+    def get_stats(self) -> Dict:
+        return {
+            **self.stats,
+            "limit": self.current_limit,
+            "max_limit": self.max_limit,
+            "in_flight": self.in_flight,
+            "latency_ewma_ms": round(self.latency_ewma * 1000, 1) if self.latency_ewma is not None else None,
+        }
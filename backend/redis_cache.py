@@ -1,12 +1,22 @@
 # backend/redis_cache.py
 import os
 import json
+import uuid
+import asyncio
+import functools
+import inspect
+import time
+import random
 import redis
-from typing import Optional, Any
+import redis.asyncio as aioredis
+from typing import Optional, Any, Dict, Iterable, List
 from datetime import timedelta
 import logging
 from dotenv import load_dotenv
 
+from local_cache import LocalLRUCache, MISS
+from cache_codecs import encode_value, decode_value
+
 load_dotenv()
 
 logger = logging.getLogger(__name__)
@@ -18,46 +28,197 @@ REDIS_DB = int(os.getenv("REDIS_DB", "0"))
 REDIS_PASSWORD = os.getenv("REDIS_PASSWORD", None)
 REDIS_ENABLED = os.getenv("REDIS_ENABLED", "true").lower() == "true"
 
+# Размер общего пула соединений
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "32"))
+
 # Время жизни кеша (в секундах)
 CACHE_TTL = int(os.getenv("CACHE_TTL", "300"))  # 5 минут по умолчанию
 
+# L1 кеш в памяти процесса: лимит по размеру и максимальный срок жизни записи
+# (срок ограничивает устаревание, если сообщение об инвалидации потерялось)
+L1_CACHE_MAX_BYTES = int(os.getenv("L1_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+L1_CACHE_MAX_TTL = int(os.getenv("L1_CACHE_MAX_TTL", "60"))
+
+# Канал pub/sub для инвалидации L1 во всех воркерах
+INVALIDATION_CHANNEL = os.getenv("CACHE_INVALIDATION_CHANNEL", "cache:invalidate")
+
+# Теги: множество ключей под тегом хранится в "cache:tag:<tag>"
+TAG_KEY_PREFIX = "cache:tag:"
+# Размер пачки ключей для SCAN/SSCAN и UNLINK при инвалидации
+INVALIDATION_BATCH_SIZE = int(os.getenv("CACHE_INVALIDATION_BATCH_SIZE", "500"))
+
+# Блокировки пересчёта: "cache:lock:<key>", снимаются только владельцем токена
+LOCK_KEY_PREFIX = "cache:lock:"
+RELEASE_LOCK_SCRIPT = """
+if redis.call("get", KEYS[1]) == ARGV[1] then
+    return redis.call("del", KEYS[1])
+end
+return 0
+"""
+
+CONNECTION_KWARGS = dict(
+    host=REDIS_HOST,
+    port=REDIS_PORT,
+    db=REDIS_DB,
+    password=REDIS_PASSWORD,
+    # Значения — байты (бинарные кодеки, без лишнего UTF-8 декодирования больших строк)
+    decode_responses=False,
+    socket_connect_timeout=5,
+    socket_timeout=5
+)
+
 class RedisCache:
-    """Класс для работы с Redis кешем"""
+    """
+    Двухуровневый кеш: L1 в памяти процесса (LRU по байтам) поверх
+    асинхронного Redis (redis.asyncio) с общим пулом соединений.
+    Любая запись или удаление публикуется в INVALIDATION_CHANNEL,
+    и остальные воркеры сбрасывают свои копии в L1.
+    Подключение — connect() при старте приложения, закрытие — close().
+    """
     
     def __init__(self):
         self.enabled = REDIS_ENABLED
+        self.client: Optional[aioredis.Redis] = None
+        self.pool: Optional[aioredis.ConnectionPool] = None
+        # Синхронный клиент — только для декоратора cached на обычных функциях
+        self._sync_client: Optional[redis.Redis] = None
+
+        self.l1 = LocalLRUCache(L1_CACHE_MAX_BYTES)
+        self.instance_id = uuid.uuid4().hex
+        self._listener: Optional[asyncio.Task] = None
+
+    async def connect(self):
+        """Создать пул соединений и проверить подключение"""
+        if not self.enabled or self.client:
+            return
+
+        try:
+            self.pool = aioredis.ConnectionPool(max_connections=REDIS_MAX_CONNECTIONS, **CONNECTION_KWARGS)
+            self.client = aioredis.Redis(connection_pool=self.pool)
+            # Проверяем подключение
+            await self.client.ping()
+            logger.info(f"Redis connected: {REDIS_HOST}:{REDIS_PORT} (pool: {REDIS_MAX_CONNECTIONS})")
+            self._listener = asyncio.create_task(self._listen_invalidations())
+        except Exception as e:
+            logger.error(f"Failed to connect to Redis: {e}")
+            logger.warning("Redis cache disabled, falling back to no-cache mode")
+            self.enabled = False
+            await self.close()
+
+    async def close(self):
+        """Остановить подписку на инвалидации и закрыть пул соединений"""
+        if self._listener:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+            self._listener = None
+        if self.client:
+            await self.client.aclose()
+        if self.pool:
+            await self.pool.disconnect()
+        if self._sync_client:
+            self._sync_client.close()
         self.client = None
-        
-        if self.enabled:
+        self.pool = None
+        self._sync_client = None
+
+    async def _listen_invalidations(self):
+        """Применять к L1 инвалидации, опубликованные другими воркерами"""
+        while True:
             try:
-                self.client = redis.Redis(
-                    host=REDIS_HOST,
-                    port=REDIS_PORT,
-                    db=REDIS_DB,
-                    password=REDIS_PASSWORD,
-                    decode_responses=True,
-                    socket_connect_timeout=5,
-                    socket_timeout=5
-                )
-                # Проверяем подключение
-                self.client.ping()
-                logger.info(f"Redis connected: {REDIS_HOST}:{REDIS_PORT}")
+                pubsub = self.client.pubsub()
+                await pubsub.subscribe(INVALIDATION_CHANNEL)
+                # Пока подписки не было, сообщения могли потеряться — начинаем с пустого L1
+                self.l1.invalidate_pattern("*")
+                try:
+                    while True:
+                        message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                        if message:
+                            self._apply_invalidation(message["data"])
+                finally:
+                    await pubsub.aclose()
+            except asyncio.CancelledError:
+                raise
             except Exception as e:
-                logger.error(f"Failed to connect to Redis: {e}")
-                logger.warning("Redis cache disabled, falling back to no-cache mode")
-                self.enabled = False
-                self.client = None
+                logger.error(f"Cache invalidation subscription failed, retrying: {e}")
+                await asyncio.sleep(5)
+
+    def _apply_invalidation(self, data: str):
+        try:
+            message = json.loads(data)
+        except ValueError:
+            logger.warning(f"Malformed cache invalidation message: {data!r}")
+            return
+        if message.get("origin") == self.instance_id:
+            return
+        if "pattern" in message:
+            self.l1.invalidate_pattern(message["pattern"])
+        else:
+            self.l1.invalidate(message.get("keys", []))
+
+    async def _publish_invalidation(self, **message):
+        try:
+            await self.client.publish(
+                INVALIDATION_CHANNEL, json.dumps({"origin": self.instance_id, **message})
+            )
+        except Exception as e:
+            logger.error(f"Error publishing cache invalidation: {e}")
+
+    async def _get_l2(self, key: str) -> Optional[bytes]:
+        """Прочитать значение из Redis и положить его в L1 на оставшийся срок жизни ключа"""
+        generation = self.l1.generation
+        async with self.client.pipeline(transaction=False) as pipe:
+            value, pttl = await pipe.get(key).pttl(key).execute()
+        if value is not None:
+            ttl = pttl / 1000 if pttl > 0 else CACHE_TTL
+            self.l1.set(key, value, min(ttl, L1_CACHE_MAX_TTL), generation)
+        return value
+
+    async def _set_l2(self, key: str, value: bytes, ttl: int, tags: Iterable[str] = ()):
+        """
+        Записать значение в Redis и в L1, остальным воркерам — инвалидация.
+        Ключ добавляется в множества своих тегов; срок жизни множества
+        продлевается до срока жизни самого долгоживущего ключа в нём.
+        """
+        tag_keys = [TAG_KEY_PREFIX + tag for tag in tags]
+        async with self.client.pipeline(transaction=False) as pipe:
+            pipe.setex(key, ttl, value)
+            for tag_key in tag_keys:
+                pipe.sadd(tag_key, key)
+                pipe.ttl(tag_key)
+            results = await pipe.execute()
+
+        tag_ttls = results[2::2]
+        extend = [tag_key for tag_key, tag_ttl in zip(tag_keys, tag_ttls) if tag_ttl < ttl]
+        if extend:
+            async with self.client.pipeline(transaction=False) as pipe:
+                for tag_key in extend:
+                    pipe.expire(tag_key, ttl)
+                await pipe.execute()
+
+        self.l1.invalidate([key])
+        self.l1.set(key, value, min(ttl, L1_CACHE_MAX_TTL))
+        await self._publish_invalidation(keys=[key])
     
-    def get(self, key: str) -> Optional[Any]:
-        """Получить значение из кеша"""
+    async def get(self, key: str) -> Optional[Any]:
+        """
+        Получить значение из кеша.
+        Из L1 возвращается общий для всех вызовов объект — его нельзя изменять.
+        """
         if not self.enabled or not self.client:
             return None
+
+        value = self.l1.get(key, decode_value)
+        if value is not MISS:
+            return value
         
         try:
-            value = self.client.get(key)
+            value = await self._get_l2(key)
             if value:
                 logger.debug(f"Cache HIT: {key}")
-                return json.loads(value)
+                return decode_value(value)
             else:
                 logger.debug(f"Cache MISS: {key}")
                 return None
@@ -65,85 +226,161 @@ class RedisCache:
             logger.error(f"Error getting from cache: {e}")
             return None
     
-    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
-        """Сохранить значение в кеш"""
+    async def set(self, key: str, value: Any, ttl: Optional[int] = None,
+                  tags: Iterable[str] = ()) -> bool:
+        """
+        Сохранить значение в кеш (tags — теги для группового удаления).
+        Формат задаётся кодеком, назначенным префиксу ключа (cache_codecs).
+        """
         if not self.enabled or not self.client:
             return False
         
         try:
             ttl = ttl or CACHE_TTL
-            serialized = json.dumps(value, default=str)
-            self.client.setex(key, ttl, serialized)
+            await self._set_l2(key, encode_value(key, value), ttl, tags)
             logger.debug(f"Cache SET: {key} (TTL: {ttl}s)")
             return True
         except Exception as e:
             logger.error(f"Error setting cache: {e}")
             return False
     
-    def delete(self, key: str) -> bool:
+    async def delete(self, key: str) -> bool:
         """Удалить значение из кеша"""
         if not self.enabled or not self.client:
             return False
         
         try:
-            self.client.delete(key)
+            await self.client.delete(key)
+            await self._publish_invalidation(keys=[key])
             logger.debug(f"Cache DELETE: {key}")
             return True
         except Exception as e:
             logger.error(f"Error deleting from cache: {e}")
             return False
+        finally:
+            # После удаления в Redis: чтение, начатое раньше, не вернёт старое значение в L1
+            self.l1.invalidate([key])
     
-    def clear_pattern(self, pattern: str) -> int:
-        """Удалить все ключи по паттерну"""
-        if not self.enabled or not self.client:
+    async def _unlink_batch(self, keys: List[bytes]) -> int:
+        """Удалить пачку ключей (UNLINK освобождает память вне основного потока Redis)"""
+        if not keys:
             return 0
-        
+        deleted = await self.client.unlink(*keys)
+        keys = [key.decode() for key in keys]
+        self.l1.invalidate(keys)
+        await self._publish_invalidation(keys=keys)
+        return deleted
+
+    async def invalidate_tags(self, *tags: str) -> Dict:
+        """
+        Удалить все ключи, записанные под любым из тегов.
+        Множество тега сначала переименовывается во временный ключ: ключи,
+        записанные под тегом во время удаления, попадают в новое множество
+        и не теряют тег. Ключи читаются из временного множества через SSCAN
+        и удаляются пачками.
+        Возвращает: число удалённых ключей и длительность
+        """
+        started = time.perf_counter()
+        result = {"tags": list(tags), "deleted": 0}
+        if not self.enabled or not self.client:
+            return {**result, "duration_ms": 0.0}
+
         try:
-            keys = self.client.keys(pattern)
-            if keys:
-                deleted = self.client.delete(*keys)
-                logger.info(f"Cache CLEAR: {pattern} ({deleted} keys)")
-                return deleted
-            return 0
+            for tag in tags:
+                tag_key = TAG_KEY_PREFIX + tag
+                snapshot_key = f"{tag_key}:invalidating:{uuid.uuid4().hex}"
+                try:
+                    await self.client.rename(tag_key, snapshot_key)
+                except redis.ResponseError:
+                    # Множества нет — под тегом ничего не записано
+                    continue
+                batch: List[bytes] = []
+                async for key in self.client.sscan_iter(snapshot_key, count=INVALIDATION_BATCH_SIZE):
+                    batch.append(key)
+                    if len(batch) >= INVALIDATION_BATCH_SIZE:
+                        result["deleted"] += await self._unlink_batch(batch)
+                        batch = []
+                result["deleted"] += await self._unlink_batch(batch)
+                await self.client.unlink(snapshot_key)
+        except Exception as e:
+            logger.error(f"Error invalidating cache tags {tags}: {e}")
+            result["error"] = str(e)
+
+        result["duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        logger.info(f"Cache INVALIDATE tags {list(tags)}: {result['deleted']} keys in {result['duration_ms']} ms")
+        return result
+
+    async def clear_pattern(self, pattern: str) -> Dict:
+        """
+        Удалить все ключи по паттерну. Ключи перечисляются через SCAN
+        (без блокировки Redis, в отличие от KEYS) и удаляются пачками.
+        Возвращает: число удалённых ключей и длительность
+        """
+        started = time.perf_counter()
+        result = {"pattern": pattern, "deleted": 0}
+        if not self.enabled or not self.client:
+            return {**result, "duration_ms": 0.0}
+
+        try:
+            batch: List[bytes] = []
+            async for key in self.client.scan_iter(match=pattern, count=INVALIDATION_BATCH_SIZE):
+                batch.append(key)
+                if len(batch) >= INVALIDATION_BATCH_SIZE:
+                    result["deleted"] += await self._unlink_batch(batch)
+                    batch = []
+            result["deleted"] += await self._unlink_batch(batch)
+            await self._publish_invalidation(pattern=pattern)
         except Exception as e:
             logger.error(f"Error clearing cache pattern: {e}")
-            return 0
+            result["error"] = str(e)
+        finally:
+            self.l1.invalidate_pattern(pattern)
+
+        result["duration_ms"] = round((time.perf_counter() - started) * 1000, 2)
+        logger.info(f"Cache CLEAR: {pattern} ({result['deleted']} keys in {result['duration_ms']} ms)")
+        return result
     
-    def flush_all(self) -> bool:
+    async def flush_all(self) -> bool:
         """Очистить весь кеш"""
         if not self.enabled or not self.client:
             return False
         
         try:
-            self.client.flushdb()
+            await self.client.flushdb()
+            await self._publish_invalidation(pattern="*")
             logger.info("Cache FLUSH: all keys deleted")
             return True
         except Exception as e:
             logger.error(f"Error flushing cache: {e}")
             return False
+        finally:
+            self.l1.invalidate_pattern("*")
     
-    def get_stats(self) -> dict:
-        """Получить статистику Redis"""
+    async def get_stats(self) -> dict:
+        """Получить статистику Redis (INFO и DBSIZE одним запросом)"""
         if not self.enabled or not self.client:
             return {"enabled": False}
-        
+
+        l1_stats = self.l1.get_stats()
         try:
-            info = self.client.info()
+            async with self.client.pipeline(transaction=False) as pipe:
+                info, total_keys = await pipe.info().dbsize().execute()
             return {
                 "enabled": True,
                 "connected": True,
                 "used_memory_human": info.get("used_memory_human"),
-                "total_keys": self.client.dbsize(),
+                "total_keys": total_keys,
                 "hits": info.get("keyspace_hits", 0),
                 "misses": info.get("keyspace_misses", 0),
                 "hit_rate": self._calculate_hit_rate(
                     info.get("keyspace_hits", 0),
                     info.get("keyspace_misses", 0)
-                )
+                ),
+                "l1": l1_stats
             }
         except Exception as e:
             logger.error(f"Error getting Redis stats: {e}")
-            return {"enabled": True, "connected": False, "error": str(e)}
+            return {"enabled": True, "connected": False, "error": str(e), "l1": l1_stats}
     
     def _calculate_hit_rate(self, hits: int, misses: int) -> float:
         """Рассчитать процент попаданий в кеш"""
@@ -152,51 +389,331 @@ class RedisCache:
             return 0.0
         return round((hits / total) * 100, 2)
     
-    def is_healthy(self) -> bool:
+    async def is_healthy(self) -> bool:
         """Проверка работоспособности Redis"""
         if not self.enabled or not self.client:
             return False
         
         try:
-            self.client.ping()
+            await self.client.ping()
             return True
         except Exception:
             return False
 
+    async def acquire_lock(self, key: str, ttl_ms: int) -> Optional[str]:
+        """
+        Взять блокировку на ключ (SET NX PX). Возвращает токен владельца или None,
+        если блокировку держит кто-то другой. Без Redis блокировка всегда своя.
+        """
+        token = uuid.uuid4().hex
+        if not self.enabled or not self.client:
+            return token
+        try:
+            acquired = await self.client.set(LOCK_KEY_PREFIX + key, token, nx=True, px=ttl_ms)
+            return token if acquired else None
+        except Exception as e:
+            logger.error(f"Error acquiring cache lock: {e}")
+            return token
+
+    async def release_lock(self, key: str, token: str):
+        """Снять блокировку, если она всё ещё принадлежит токену"""
+        if not self.enabled or not self.client:
+            return
+        try:
+            await self.client.eval(RELEASE_LOCK_SCRIPT, 1, LOCK_KEY_PREFIX + key, token)
+        except Exception as e:
+            logger.error(f"Error releasing cache lock: {e}")
+
+    def acquire_lock_sync(self, key: str, ttl_ms: int) -> Optional[str]:
+        """Синхронный вариант acquire_lock (для cached на обычных функциях)"""
+        token = uuid.uuid4().hex
+        if not self.enabled or not self.client:
+            return token
+        try:
+            acquired = self._get_sync_client().set(LOCK_KEY_PREFIX + key, token, nx=True, px=ttl_ms)
+            return token if acquired else None
+        except Exception as e:
+            logger.error(f"Error acquiring cache lock: {e}")
+            return token
+
+    def release_lock_sync(self, key: str, token: str):
+        """Синхронный вариант release_lock"""
+        if not self.enabled or not self.client:
+            return
+        try:
+            self._get_sync_client().eval(RELEASE_LOCK_SCRIPT, 1, LOCK_KEY_PREFIX + key, token)
+        except Exception as e:
+            logger.error(f"Error releasing cache lock: {e}")
+
+    def _publish_invalidation_sync(self, **message):
+        try:
+            self._get_sync_client().publish(
+                INVALIDATION_CHANNEL, json.dumps({"origin": self.instance_id, **message})
+            )
+        except Exception as e:
+            logger.error(f"Error publishing cache invalidation: {e}")
+
+    def get_sync(self, key: str) -> Optional[Any]:
+        """
+        Синхронное чтение (для cached на обычных функциях): через тот же L1,
+        что и асинхронный get
+        """
+        if not self.enabled or not self.client:
+            return None
+
+        value = self.l1.get(key, decode_value)
+        if value is not MISS:
+            return value
+
+        try:
+            generation = self.l1.generation
+            with self._get_sync_client().pipeline(transaction=False) as pipe:
+                value, pttl = pipe.get(key).pttl(key).execute()
+            if not value:
+                return None
+            ttl = pttl / 1000 if pttl > 0 else CACHE_TTL
+            self.l1.set(key, value, min(ttl, L1_CACHE_MAX_TTL), generation)
+            return decode_value(value)
+        except Exception as e:
+            logger.error(f"Error getting from cache: {e}")
+            return None
+
+    def set_sync(self, key: str, value: Any, ttl: Optional[int] = None,
+                 tags: Iterable[str] = ()) -> bool:
+        """
+        Синхронная запись (для cached на обычных функциях). Как и set:
+        обновляет L1 и публикует инвалидацию для остальных воркеров.
+        """
+        if not self.enabled or not self.client:
+            return False
+
+        try:
+            ttl = ttl or CACHE_TTL
+            raw = encode_value(key, value)
+            tag_keys = [TAG_KEY_PREFIX + tag for tag in tags]
+            client = self._get_sync_client()
+            with client.pipeline(transaction=False) as pipe:
+                pipe.setex(key, ttl, raw)
+                for tag_key in tag_keys:
+                    pipe.sadd(tag_key, key)
+                    pipe.ttl(tag_key)
+                results = pipe.execute()
+
+            extend = [tag_key for tag_key, tag_ttl in zip(tag_keys, results[2::2]) if tag_ttl < ttl]
+            if extend:
+                with client.pipeline(transaction=False) as pipe:
+                    for tag_key in extend:
+                        pipe.expire(tag_key, ttl)
+                    pipe.execute()
+
+            self.l1.invalidate([key])
+            self.l1.set(key, raw, min(ttl, L1_CACHE_MAX_TTL))
+            self._publish_invalidation_sync(keys=[key])
+            return True
+        except Exception as e:
+            logger.error(f"Error setting cache: {e}")
+            return False
+
+    def _get_sync_client(self) -> redis.Redis:
+        if self._sync_client is None:
+            self._sync_client = redis.Redis(**CONNECTION_KWARGS)
+        return self._sync_client
+
 
 # Глобальный экземпляр кеша
 cache = RedisCache()
 
 
 # Декоратор для кеширования функций
-def cached(key_prefix: str, ttl: Optional[int] = None):
+def _make_cache_key(key_prefix: str, args: tuple, kwargs: dict) -> str:
+    """Ключ кеша из префикса и аргументов вызова"""
+    cache_key = f"{key_prefix}:{':'.join(map(str, args))}"
+    if kwargs:
+        cache_key += f":{':'.join(f'{k}={v}' for k, v in sorted(kwargs.items()))}"
+    return cache_key
+
+
+class CachedFailure(Exception):
+    """Ошибка функции, закешированная негативным кешированием"""
+
+
+class _CachePolicy:
+    """
+    Параметры cached и формат записи в кеше:
+    {"value": ..., "fresh_until": epoch} или {"error": "...", "fresh_until": epoch}.
+    Запись свежая до fresh_until (ttl ± jitter), затем ещё stale_ttl секунд
+    отдаётся как устаревшая, пока один вызов пересчитывает её.
+    """
+
+    def __init__(self, ttl: Optional[int], stale_ttl: Optional[int], jitter: float,
+                 negative_ttl: int, lock_timeout: float, wait_timeout: float, tags: Iterable[str]):
+        self.ttl = ttl or CACHE_TTL
+        self.stale_ttl = self.ttl if stale_ttl is None else stale_ttl
+        self.jitter = jitter
+        self.negative_ttl = negative_ttl
+        self.lock_ms = int(lock_timeout * 1000)
+        self.wait_timeout = wait_timeout
+        self.tags = tuple(tags)
+
+    def value_entry(self, value: Any):
+        """Запись для значения и её срок жизни в Redis (жёсткий TTL)"""
+        fresh_for = self.ttl * (1 + random.uniform(-self.jitter, self.jitter))
+        entry = {"value": value, "fresh_until": time.time() + fresh_for}
+        return entry, int(fresh_for + self.stale_ttl) + 1
+
+    def error_entry(self, error: Exception):
+        """Запись для негативного кеширования ошибки"""
+        return {"error": f"{type(error).__name__}: {error}", "fresh_until": time.time() + self.negative_ttl}
+
+    @staticmethod
+    def parse(entry: Any):
+        """(есть запись, свежая ли) для значения из кеша"""
+        if not isinstance(entry, dict) or "fresh_until" not in entry:
+            return False, False
+        return True, time.time() < entry["fresh_until"]
+
+    @staticmethod
+    def unwrap(entry: Dict) -> Any:
+        if "error" in entry:
+            raise CachedFailure(entry["error"])
+        return entry["value"]
+
+
+def _log_refresh_failure(task: asyncio.Task):
+    if not task.cancelled() and task.exception() is not None:
+        logger.error(f"Background cache refresh failed: {task.exception()}")
+
+
+# Фоновые пересчёты устаревших значений (ссылки, чтобы задачи не собрал GC)
+_background_refreshes = set()
+# Вычисления в этом процессе: ключ -> задача (повторные вызовы ждут её)
+_inflight: Dict[str, asyncio.Task] = {}
+
+
+def cached(key_prefix: str, ttl: Optional[int] = None, tags: Iterable[str] = (),
+           stale_ttl: Optional[int] = None, jitter: float = 0.1, negative_ttl: int = 0,
+           lock_timeout: float = 30.0, wait_timeout: float = 5.0):
     """
-    Декоратор для кеширования результатов функций
+    Декоратор для кеширования результатов функций (обычных и корутин)
+    с защитой от «набега» на пересчёт:
+    - пересчитывает один вызывающий — владелец блокировки Redis (SET NX PX);
+    - пока значение устарело, но не истекло (stale_ttl), остальные получают старое,
+      а для корутин пересчёт идёт в фоне;
+    - при промахе остальные ждут до wait_timeout появления значения;
+    - ttl случайно сдвигается на ±jitter, чтобы ключи не истекали одновременно;
+    - negative_ttl > 0 кеширует ошибку: повторные вызовы получают CachedFailure.
     
     Usage:
-        @cached(key_prefix="dashboard_data", ttl=300)
-        def get_dashboard_data():
+        @cached(key_prefix="dashboard_data", ttl=300, tags=("dashboard",))
+        async def get_dashboard_data():
             ...
     """
+    policy = _CachePolicy(ttl, stale_ttl, jitter, negative_ttl, lock_timeout, wait_timeout, tags)
+
     def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            async def compute(cache_key: str, token: str, args, kwargs):
+                try:
+                    result = await func(*args, **kwargs)
+                except Exception as e:
+                    if policy.negative_ttl:
+                        await cache.set(cache_key, policy.error_entry(e), policy.negative_ttl, policy.tags)
+                    raise
+                else:
+                    entry, hard_ttl = policy.value_entry(result)
+                    await cache.set(cache_key, entry, hard_ttl, policy.tags)
+                    return result
+                finally:
+                    await cache.release_lock(cache_key, token)
+
+            def start_compute(cache_key: str, token: str, args, kwargs) -> asyncio.Task:
+                task = asyncio.create_task(compute(cache_key, token, args, kwargs))
+                _inflight[cache_key] = task
+                task.add_done_callback(lambda _t: _inflight.pop(cache_key, None))
+                return task
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                cache_key = _make_cache_key(key_prefix, args, kwargs)
+
+                entry = await cache.get(cache_key)
+                found, fresh = policy.parse(entry)
+                if fresh:
+                    return policy.unwrap(entry)
+
+                if cache_key in _inflight:
+                    if found and "error" not in entry:
+                        return entry["value"]
+                    return await asyncio.shield(_inflight[cache_key])
+
+                token = await cache.acquire_lock(cache_key, policy.lock_ms)
+
+                # Устаревшее значение: отдаём его, пересчёт — в фоне у владельца блокировки
+                if found and "error" not in entry:
+                    if token:
+                        task = start_compute(cache_key, token, args, kwargs)
+                        _background_refreshes.add(task)
+                        task.add_done_callback(_background_refreshes.discard)
+                        task.add_done_callback(_log_refresh_failure)
+                    return entry["value"]
+
+                if token:
+                    return await asyncio.shield(start_compute(cache_key, token, args, kwargs))
+
+                # Пересчитывает другой процесс: ждём его результат
+                deadline = time.monotonic() + policy.wait_timeout
+                while time.monotonic() < deadline:
+                    await asyncio.sleep(0.05)
+                    entry = await cache.get(cache_key)
+                    found, _fresh = policy.parse(entry)
+                    if found:
+                        return policy.unwrap(entry)
+
+                logger.warning(f"Cache lock wait timed out for {cache_key}, computing locally")
+                return await func(*args, **kwargs)
+
+            return async_wrapper
+
+        def compute_sync(cache_key: str, token: str, args, kwargs):
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                if policy.negative_ttl:
+                    cache.set_sync(cache_key, policy.error_entry(e), policy.negative_ttl, policy.tags)
+                raise
+            else:
+                entry, hard_ttl = policy.value_entry(result)
+                cache.set_sync(cache_key, entry, hard_ttl, policy.tags)
+                return result
+            finally:
+                cache.release_lock_sync(cache_key, token)
+
+        @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            # Формируем ключ кеша
-            cache_key = f"{key_prefix}:{':'.join(map(str, args))}"
-            if kwargs:
-                cache_key += f":{':'.join(f'{k}={v}' for k, v in sorted(kwargs.items()))}"
-            
-            # Пытаемся получить из кеша
-            cached_value = cache.get(cache_key)
-            if cached_value is not None:
-                return cached_value
-            
-            # Вычисляем значение
-            result = func(*args, **kwargs)
-            
-            # Сохраняем в кеш
-            cache.set(cache_key, result, ttl)
+            cache_key = _make_cache_key(key_prefix, args, kwargs)
             
-            return result
+            entry = cache.get_sync(cache_key)
+            found, fresh = policy.parse(entry)
+            if fresh:
+                return policy.unwrap(entry)
+
+            token = cache.acquire_lock_sync(cache_key, policy.lock_ms)
+            if token:
+                return compute_sync(cache_key, token, args, kwargs)
+
+            # Пересчитывает другой вызов: отдаём устаревшее значение или ждём новое
+            if found and "error" not in entry:
+                return entry["value"]
+            deadline = time.monotonic() + policy.wait_timeout
+            while time.monotonic() < deadline:
+                time.sleep(0.05)
+                entry = cache.get_sync(cache_key)
+                found, _fresh = policy.parse(entry)
+                if found:
+                    return policy.unwrap(entry)
+
+            logger.warning(f"Cache lock wait timed out for {cache_key}, computing locally")
+            return func(*args, **kwargs)
         
         return wrapper
     return decorator
@@ -0,0 +1,290 @@
+# backend/search_index.py
+"""
+Триграммный инвертированный индекс для поиска по подстроке
+в аллокациях, конфликтах и заметках.
+Индекс обновляется инкрементально: при новом снимке переиндексируются
+только изменившиеся документы, заметки — при каждой записи.
+Документы снимка и заметки лежат в разных индексах: индекс снимка
+обновляется в рабочем потоке на копии и подменяется ссылкой на event loop,
+заметки меняются прямо на event loop.
+"""
+import heapq
+import logging
+from array import array
+from functools import partial
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+from allocation_table import AllocationTable
+from models import IPConflict, Note
+
+logger = logging.getLogger(__name__)
+
+# Виды документов в порядке показа при равной релевантности
+KINDS = ("allocation", "conflict", "note")
+
+
+def trigrams(text: str) -> Set[str]:
+    """Множество триграмм строки (в нижнем регистре)"""
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+def match_score(query: str, field: str) -> int:
+    """Релевантность поля: точное совпадение > префикс > начало слова > подстрока"""
+    if field == query:
+        return 4
+    position = field.find(query)
+    if position == 0:
+        return 3
+    if position > 0:
+        return 2 if not field[position - 1].isalnum() else 1
+    return 0
+
+
+class _Document:
+    __slots__ = ("kind", "key", "fields", "text", "payload")
+
+    def __init__(self, kind: str, key: Hashable, fields: Tuple[str, ...], payload: Any,
+                 text: Optional[str] = None):
+        self.kind = kind
+        self.key = key
+        self.fields = fields
+        # Поля через перевод строки: одна проверка подстроки на документ
+        self.text = "\n".join(fields) if text is None else text
+        self.payload = payload
+
+
+class SearchIndex:
+    """
+    Триграммы -> номера документов. Кандидаты берутся из самого короткого
+    списка триграмм запроса и проверяются поиском подстроки.
+    Удаление ленивое: номер удалённого документа остаётся в списках
+    и отбрасывается при поиске; списки пересобираются, когда мёртвых записей
+    становится больше, чем живых документов.
+
+    Документы и списки триграмм не меняются на месте, если они общие с копией
+    (copy()): копию можно обновлять в другом потоке, пока исходный индекс читают.
+    """
+
+    def __init__(self):
+        self._docs: Dict[int, _Document] = {}
+        self._ids: Dict[Tuple[str, Hashable], int] = {}
+        self._postings: Dict[str, array] = {}
+        # Триграммы, чьи списки принадлежат только этому индексу
+        self._owned: Set[str] = set()
+        self._next_id = 0
+        self._dead = 0
+
+    def copy(self) -> "SearchIndex":
+        """Копия индекса; списки триграмм копируются при первой записи в них"""
+        clone = SearchIndex()
+        clone._docs = dict(self._docs)
+        clone._ids = dict(self._ids)
+        clone._postings = dict(self._postings)
+        clone._next_id = self._next_id
+        clone._dead = self._dead
+        return clone
+
+    def _index(self, doc_id: int, doc: _Document):
+        postings_by_gram, owned = self._postings, self._owned
+        for gram in trigrams(doc.text):
+            postings = postings_by_gram.get(gram)
+            if postings is None:
+                postings = postings_by_gram[gram] = array("I")
+                owned.add(gram)
+            elif gram not in owned:
+                postings = postings_by_gram[gram] = array("I", postings)
+                owned.add(gram)
+            postings.append(doc_id)
+
+    def _compact(self):
+        """Пересобрать списки триграмм только из живых документов"""
+        self._postings = {}
+        self._owned = set()
+        for doc_id, doc in self._docs.items():
+            self._index(doc_id, doc)
+        self._dead = 0
+
+    def remove(self, kind: str, key: Hashable):
+        """Удалить документ из индекса (если он есть)"""
+        doc_id = self._ids.pop((kind, key), None)
+        if doc_id is None:
+            return
+        del self._docs[doc_id]
+        self._dead += 1
+        if self._dead > max(len(self._docs), 1024):
+            self._compact()
+
+    def upsert(self, kind: str, key: Hashable, fields: Iterable[Optional[str]], payload: Any):
+        """
+        Добавить или обновить документ; при неизменном тексте обновляется только payload.
+        payload может быть функцией без аргументов — тогда объект результата
+        строится только для документов, попавших в выдачу.
+        """
+        fields = tuple(f.lower() for f in fields if f)
+        doc_id = self._ids.get((kind, key))
+        if doc_id is not None:
+            doc = self._docs[doc_id]
+            if doc.fields == fields:
+                self._docs[doc_id] = _Document(kind, key, fields, payload, doc.text)
+                return
+            self.remove(kind, key)
+
+        doc_id = self._next_id
+        self._next_id += 1
+        doc = _Document(kind, key, fields, payload)
+        self._docs[doc_id] = doc
+        self._ids[(kind, key)] = doc_id
+        self._index(doc_id, doc)
+
+    def sync(self, kind: str, documents: Dict[Hashable, Tuple[Iterable[Optional[str]], Any]]) -> Tuple[int, int]:
+        """
+        Привести документы вида kind к переданному набору.
+        Возвращает: (добавлено или изменено, удалено)
+        """
+        stale = [key for (doc_kind, key) in self._ids if doc_kind == kind and key not in documents]
+        for key in stale:
+            self.remove(kind, key)
+
+        changed = 0
+        for key, (fields, payload) in documents.items():
+            before = self._ids.get((kind, key))
+            self.upsert(kind, key, fields, payload)
+            if self._ids[(kind, key)] != before:
+                changed += 1
+        return changed, len(stale)
+
+    def _candidates(self, query: str) -> Iterable[int]:
+        if len(query) >= 3:
+            postings = [self._postings.get(g) for g in trigrams(query)]
+            if any(p is None for p in postings):
+                return ()
+            return min(postings, key=len)
+        # Короткий запрос: объединение списков триграмм, содержащих его
+        result: Set[int] = set()
+        for gram, postings in self._postings.items():
+            if query in gram:
+                result.update(postings)
+        return result
+
+    def _matches(self, query: str, kinds: Optional[Set[str]]) -> List[Tuple[Tuple[int, ...], _Document]]:
+        """Документы с подстрокой query и ключ их ранжирования"""
+        docs = self._docs
+        scored = []
+        for doc_id in self._candidates(query):
+            doc = docs.get(doc_id)
+            if doc is None or query not in doc.text or (kinds and doc.kind not in kinds):
+                continue
+            best_score, best_length = 0, 0
+            for field in doc.fields:
+                score = match_score(query, field)
+                if score > best_score or (score == best_score and len(field) < best_length):
+                    best_score, best_length = score, len(field)
+            scored.append(((best_score, -best_length, -KINDS.index(doc.kind), -doc_id), doc))
+        return scored
+
+    def search(self, query: str, kinds: Optional[Set[str]] = None, limit: int = 50) -> Tuple[int, List[Dict]]:
+        """
+        Найти документы, в одном из полей которых есть подстрока query.
+        Возвращает: (общее число совпадений, лучшие limit результатов)
+        """
+        query = query.strip().lower()
+        if not query:
+            return 0, []
+        return _top_hits(self._matches(query, kinds), limit)
+
+    def get_stats(self) -> Dict:
+        """Размер индекса"""
+        by_kind: Dict[str, int] = {}
+        for doc in self._docs.values():
+            by_kind[doc.kind] = by_kind.get(doc.kind, 0) + 1
+        return {"documents": by_kind, "trigrams": len(self._postings), "dead_entries": self._dead}
+
+
+def _top_hits(matches: List[Tuple[Tuple[int, ...], _Document]], limit: int) -> Tuple[int, List[Dict]]:
+    """Лучшие limit совпадений: (общее число совпадений, результаты)"""
+    hits = []
+    for (score, *_rest), doc in heapq.nlargest(limit, matches, key=lambda match: match[0]):
+        payload = doc.payload
+        item = payload() if callable(payload) else payload
+        hits.append({"kind": doc.kind, "score": score, "item": item})
+    return len(matches), hits
+
+
+class DashboardSearch:
+    """
+    Поиск сразу по индексу снимка дашборда и индексу заметок.
+    dashboard подменяется целиком (set_dashboard), notes меняется на месте.
+    """
+
+    def __init__(self):
+        self.dashboard = SearchIndex()
+        self.notes = SearchIndex()
+
+    def set_dashboard(self, index: SearchIndex):
+        """Подменить индекс снимка (вызывается на event loop)"""
+        self.dashboard = index
+
+    def search(self, query: str, kinds: Optional[Set[str]] = None, limit: int = 50) -> Tuple[int, List[Dict]]:
+        """
+        Найти документы, в одном из полей которых есть подстрока query.
+        Возвращает: (общее число совпадений, лучшие limit результатов)
+        """
+        query = query.strip().lower()
+        if not query:
+            return 0, []
+        return _top_hits(self.dashboard._matches(query, kinds) + self.notes._matches(query, kinds), limit)
+
+    def get_stats(self) -> Dict:
+        """Размер индексов"""
+        dashboard, notes = self.dashboard.get_stats(), self.notes.get_stats()
+        return {
+            "documents": {**dashboard["documents"], **notes["documents"]},
+            "trigrams": dashboard["trigrams"] + notes["trigrams"],
+            "dead_entries": dashboard["dead_entries"] + notes["dead_entries"],
+        }
+
+
+search_index = DashboardSearch()
+
+
+def build_dashboard_index(table: AllocationTable, conflicts: Dict[str, List[IPConflict]]) -> SearchIndex:
+    """
+    Индекс аллокаций и конфликтов нового снимка: копия текущего индекса,
+    в которой переиндексированы только изменения. Текущий индекс не меняется,
+    поэтому функцию можно вызывать в рабочем потоке; результат подключается
+    через search_index.set_dashboard().
+    """
+    get = table.get
+    allocations = {}
+    for row in range(len(table)):
+        ip, org, entity, pool = (
+            table.ip_address(row), get("org_name", row), get("entity_name", row), get("pool_name", row)
+        )
+        allocations[(get("cloud_name", row), pool, ip, get("allocation_type", row), entity, org)] = (
+            (ip, org, entity, get("vapp_name", row), pool), partial(table.to_model, row)
+        )
+    conflict_documents = {
+        (ip, c.conflict_type, tuple(c.clouds), tuple(c.pools)): (
+            (ip, *c.organizations, *c.pools), c
+        )
+        for ip, ip_conflicts in conflicts.items()
+        for c in ip_conflicts
+    }
+    index = search_index.dashboard.copy()
+    allocations_changed, allocations_removed = index.sync("allocation", allocations)
+    conflicts_changed, conflicts_removed = index.sync("conflict", conflict_documents)
+    logger.info(
+        f"Search index updated: allocations +{allocations_changed}/-{allocations_removed}, "
+        f"conflicts +{conflicts_changed}/-{conflicts_removed}"
+    )
+    return index
+
+
+def index_note(note: Note):
+    """Проиндексировать созданную или изменённую заметку"""
+    search_index.notes.upsert("note", note.id, (note.title, note.content, note.ip_address, note.author), note)
+
+
+def remove_note(note_id: int):
+    """Убрать удалённую заметку из индекса"""
+    search_index.notes.remove("note", note_id)
@@ -0,0 +1,131 @@
+# backend/snapshot_poller.py
+"""
+Фоновое обновление снимка данных (stale-while-revalidate).
+API всегда отдаёт последний готовый снимок, а пересборка идёт в фоне
+по расписанию или по запросу.
+"""
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class SnapshotPoller:
+    """Периодически пересобирает снимок и хранит последний успешный результат"""
+
+    def __init__(self, name: str, build: Callable[[Dict], Awaitable[Any]], interval: float):
+        """
+        build — корутина, собирающая снимок. Ей передаётся словарь progress,
+        в который она может записывать ход сборки (stage, pools_done, ...).
+        """
+        self.name = name
+        self.build = build
+        self.interval = interval
+
+        self.snapshot: Optional[Any] = None
+        self.updated_at: Optional[float] = None
+        self.last_duration: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+        self.running = False
+        self.build_started_at: Optional[float] = None
+        self.progress: Dict = {}
+
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Запустить фоновый цикл обновления"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Snapshot poller '{self.name}' started (interval: {self.interval}s)")
+
+    async def stop(self):
+        """Остановить фоновый цикл"""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            logger.info(f"Snapshot poller '{self.name}' stopped")
+
+    def set_snapshot(self, snapshot: Any, updated_at: Optional[float] = None):
+        """Установить снимок (например, восстановленный из кеша)"""
+        self.snapshot = snapshot
+        self.updated_at = updated_at if updated_at is not None else time.time()
+
+    def age(self) -> Optional[float]:
+        """Возраст текущего снимка в секундах"""
+        if self.updated_at is None:
+            return None
+        return max(0.0, time.time() - self.updated_at)
+
+    def request_refresh(self) -> Dict:
+        """
+        Поставить пересборку в очередь и вернуть статус.
+        Повторные запросы во время сборки схлопываются в одну следующую сборку.
+        """
+        self._wakeup.set()
+        logger.info(f"Snapshot poller '{self.name}': refresh requested")
+        return self.get_status()
+
+    def get_status(self) -> Dict:
+        """Состояние снимка и текущей сборки"""
+        age = self.age()
+        status = {
+            "state": "running" if self.running else "idle",
+            "has_snapshot": self.snapshot is not None,
+            "snapshot_age_seconds": round(age, 1) if age is not None else None,
+            "updated_at": (
+                datetime.fromtimestamp(self.updated_at).isoformat()
+                if self.updated_at is not None else None
+            ),
+            "refresh_queued": self._wakeup.is_set(),
+            "interval_seconds": self.interval,
+            "last_duration_seconds": (
+                round(self.last_duration, 2) if self.last_duration is not None else None
+            ),
+            "last_error": self.last_error,
+        }
+        if self.running:
+            status["progress"] = {
+                **self.progress,
+                "elapsed_seconds": round(time.time() - self.build_started_at, 1),
+            }
+        return status
+
+    async def refresh_now(self):
+        """Выполнить одну пересборку снимка"""
+        self._wakeup.clear()
+        self.running = True
+        self.build_started_at = time.time()
+        self.progress = {"stage": "starting"}
+
+        try:
+            snapshot = await self.build(self.progress)
+            self.set_snapshot(snapshot)
+            self.last_error = None
+            logger.info(f"Snapshot '{self.name}' rebuilt in {time.time() - self.build_started_at:.2f}s")
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.last_error = str(e)
+            logger.error(f"Snapshot '{self.name}' rebuild failed, keeping previous snapshot: {e}")
+        finally:
+            self.last_duration = time.time() - self.build_started_at
+            self.running = False
+            self.progress = {}
+
+    async def _run(self):
+        """Цикл: сборка, затем ожидание интервала или запроса на обновление"""
+        while True:
+            await self.refresh_now()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,93 @@
+# backend/snapshot_store.py
+"""
+Локальное хранилище последних снимков (SQLite в data/, в docker-compose —
+volume, чтобы снимок переживал пересборку и redeploy контейнера).
+Снимок хранится в компактном виде (msgpack + zstd) и читается при старте,
+чтобы API отдавал последнее известное состояние, не дожидаясь обхода VCD
+и не завися от доступности Redis.
+"""
+import logging
+import os
+import sqlite3
+import time
+from pathlib import Path
+from typing import Any, Dict, Optional, Tuple
+
+from cache_codecs import CODECS, decode_value
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_DB_PATH = Path(os.getenv("SNAPSHOT_DB_PATH", str(Path(__file__).parent / "data" / "snapshots.db")))
+# Сколько последних снимков каждого вида хранить
+SNAPSHOT_KEEP = int(os.getenv("SNAPSHOT_KEEP", "3"))
+
+_codec = CODECS["msgpack-zstd"]
+
+
+class SnapshotStore:
+    """Последние снимки по имени (dashboard, ...) в SQLite"""
+
+    def __init__(self, path: Path, keep: int = SNAPSHOT_KEEP):
+        self.path = path
+        self.keep = keep
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = self._connect()
+        try:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS snapshots (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    name TEXT NOT NULL,
+                    created_at REAL NOT NULL,
+                    data BLOB NOT NULL
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_snapshots_name ON snapshots (name, id)")
+            conn.commit()
+        finally:
+            conn.close()
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(str(self.path))
+        # WAL: запись нового снимка не блокирует чтение при старте другого процесса
+        conn.execute("PRAGMA journal_mode=WAL")
+        return conn
+
+    def save(self, name: str, payload: Dict[str, Any], created_at: Optional[float] = None) -> int:
+        """
+        Сохранить снимок (словарь DashboardSnapshot.to_payload()) и удалить старые сверх keep.
+        Возвращает размер записанных данных в байтах.
+        """
+        data = _codec.encode(payload)
+        conn = self._connect()
+        try:
+            with conn:
+                conn.execute(
+                    "INSERT INTO snapshots (name, created_at, data) VALUES (?, ?, ?)",
+                    (name, created_at if created_at is not None else time.time(), data)
+                )
+                conn.execute(
+                    """DELETE FROM snapshots WHERE name = ? AND id NOT IN (
+                           SELECT id FROM snapshots WHERE name = ? ORDER BY id DESC LIMIT ?
+                       )""",
+                    (name, name, self.keep)
+                )
+        finally:
+            conn.close()
+        return len(data)
+
+    def load_latest(self, name: str) -> Optional[Tuple[Dict[str, Any], float]]:
+        """Последний снимок: (словарь, время сохранения) или None"""
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                "SELECT data, created_at FROM snapshots WHERE name = ? ORDER BY id DESC LIMIT 1",
+                (name,)
+            ).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return None
+        return decode_value(row[0]), row[1]
+
+
+snapshot_store = SnapshotStore(SNAPSHOT_DB_PATH)
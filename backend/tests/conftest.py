@@ -0,0 +1,6 @@
+# backend/tests/conftest.py
+"""Модули backend импортируются по имени (как в app.py), независимо от каталога запуска"""
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
@@ -0,0 +1,87 @@
+# backend/tests/test_allocation_index.py
+"""
+Курсорная пагинация /api/allocations: страницы по курсорам покрывают
+выборку ровно один раз, а курсор другой сортировки или подделанный
+курсор отклоняется как некорректный (400), а не падает в bisect.
+"""
+import base64
+import json
+
+import pytest
+
+from allocation_index import AllocationIndex, decode_cursor, encode_cursor
+from allocation_table import AllocationTable
+
+ORGS = ("beta", "Alpha", "gamma", None)
+
+
+def make_index() -> AllocationIndex:
+    table = AllocationTable()
+    for i in range(60):
+        table.append(
+            ip_address=f"10.0.{i % 3}.{i}" if i % 10 else "N/A",
+            org_name=ORGS[i % 3], cloud_name=f"vcd{i % 2}", pool_name="pool",
+            allocation_type="VM_ALLOCATED" if i % 4 else "NAT", entity_name=ORGS[i % 4],
+        )
+    return AllocationIndex(table)
+
+
+def pages(index, sort, descending, filters=None, limit=7):
+    rows, cursor = [], None
+    while True:
+        after = decode_cursor(cursor, sort, descending) if cursor else None
+        items, last_key = index.query(filters or {}, None, sort, descending, after, limit)
+        rows.extend(item.model_dump_json() for item in items)
+        if last_key is None:
+            return rows
+        cursor = encode_cursor(last_key, sort, descending)
+
+
+@pytest.mark.parametrize("sort", ["ip_address", "org_name", "entity_name"])
+@pytest.mark.parametrize("descending", [False, True])
+def test_pages_cover_selection_once(sort, descending):
+    index = make_index()
+    items, _ = index.query({"cloud_name": "vcd1"}, None, sort, descending, None, 1000)
+    expected = [item.model_dump_json() for item in items]
+    assert pages(index, sort, descending, {"cloud_name": "vcd1"}) == expected
+    assert len(expected) == index.count({"cloud_name": "vcd1"})
+
+
+@pytest.mark.parametrize("sort, descending", [
+    ("ip_address", False), ("org_name", False), ("org_name", True),
+])
+def test_cursor_from_other_sort_is_rejected(sort, descending):
+    index = make_index()
+    _, last_key = index.query({}, None, "org_name", True, None, 5)
+    cursor = encode_cursor(last_key, "org_name", True)
+    if (sort, descending) == ("org_name", True):
+        assert decode_cursor(cursor, sort, descending) == last_key
+    else:
+        with pytest.raises(ValueError):
+            decode_cursor(cursor, sort, descending)
+
+
+def forge(payload) -> str:
+    return base64.urlsafe_b64encode(json.dumps(payload).encode()).decode()
+
+
+@pytest.mark.parametrize("cursor", [
+    "not base64 at all",
+    forge([0, 0, "c", "p", "t", "e", "o", 1]),
+    forge({"sort": "ip_address", "desc": False, "key": ["x", 0, "c", "p", "t", "e", "o", 1]}),
+    forge({"sort": "ip_address", "desc": False, "key": [0, 0, "c", "p", "t", "e", "o"]}),
+    forge({"sort": "ip_address", "desc": False, "key": [0, 0, "c", "p", "t", "e", None, 1]}),
+    forge({"sort": "ip_address", "desc": False, "key": [True, 0, "c", "p", "t", "e", "o", 1]}),
+    forge({"sort": "ip_address", "desc": 0, "key": [0, 0, "c", "p", "t", "e", "o", 1]}),
+])
+def test_forged_cursor_is_rejected(cursor):
+    with pytest.raises(ValueError):
+        decode_cursor(cursor, "ip_address", False)
+
+
+def test_valid_forged_cursor_is_usable():
+    index = make_index()
+    after = decode_cursor(forge({"sort": "ip_address", "desc": False, "key": [-1, -1, "", "", "", "", "", 0]}),
+                          "ip_address", False)
+    items, _ = index.query({}, None, "ip_address", False, after, 1000)
+    assert len(items) == 60
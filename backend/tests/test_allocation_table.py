@@ -0,0 +1,133 @@
+# backend/tests/test_allocation_table.py
+"""
+Колоночная AllocationTable должна быть неотличима от списка IPAllocation:
+JSON строк, модели, круговой путь через to_columns/from_columns и кодеки
+кеша, а также select/concat, на которых держится слияние дельт VCD.
+"""
+import json
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import pytz
+
+from allocation_table import AllocationTable
+from cache_codecs import CODECS, decode_value
+from models import IPAllocation
+
+ALMATY = pytz.timezone("Asia/Almaty")
+
+ALLOCATIONS = [
+    IPAllocation(
+        ip_address="10.0.0.1", org_name="org", cloud_name="vcd", pool_name="pool",
+        allocation_type="FLOATING_IP",
+        allocation_date=datetime(2024, 3, 1, 12, 30, 15, 123457, tzinfo=timezone(timedelta(hours=5))),
+        deployed=True,
+    ),
+    # Строка вместо IP, дата без пояса и до 1970 года, спецсимволы в строках
+    IPAllocation(
+        ip_address="N/A", org_name='org "quoted" \\ ü', cloud_name="vcd", pool_name="pool",
+        allocation_type="NAT", allocation_date=datetime(1960, 1, 1, 0, 0, 0, 1), deployed=False,
+    ),
+    IPAllocation(
+        ip_address="2001:db8::1", org_name="other", org_id="urn:org:1", entity_name="vm-1",
+        cloud_name="vcd01", pool_name="pool", allocation_type="VM_ALLOCATED", vapp_name="vapp",
+    ),
+    # Неканоническая запись IPv4 сохраняется как есть
+    IPAllocation(
+        ip_address="010.0.0.1", org_name="other", cloud_name="vcd01", pool_name="ext",
+        allocation_type="EDGE", allocation_date=datetime(2024, 1, 1, tzinfo=timezone.utc),
+    ),
+    IPAllocation(
+        ip_address="255.255.255.255", org_name="org", cloud_name="vcd", pool_name="pool",
+        allocation_type="FLOATING_IP", allocation_date=ALMATY.localize(datetime(2024, 7, 1, 10, 0)),
+    ),
+]
+
+
+def make_table(allocations=ALLOCATIONS) -> AllocationTable:
+    table = AllocationTable()
+    for allocation in allocations:
+        table.append(**allocation.model_dump())
+    return table
+
+
+def test_models_round_trip():
+    assert make_table().to_models() == ALLOCATIONS
+
+
+def test_json_rows_match_pydantic():
+    table = make_table()
+    assert table.json_rows() == [a.model_dump_json() for a in ALLOCATIONS]
+    assert table.json_rows([3, 1]) == [ALLOCATIONS[3].model_dump_json(), ALLOCATIONS[1].model_dump_json()]
+
+
+def test_json_cache_reset_on_append():
+    table = make_table(ALLOCATIONS[:2])
+    table.json_rows()
+    table.append(**ALLOCATIONS[2].model_dump())
+    assert table.json_rows() == [a.model_dump_json() for a in ALLOCATIONS[:3]]
+
+
+def test_required_fields_are_checked():
+    with pytest.raises(TypeError):
+        AllocationTable().append(
+            ip_address="10.0.0.1", org_name=None, allocation_type="T", cloud_name="c", pool_name="p"
+        )
+
+
+@pytest.mark.parametrize("codec", sorted(CODECS))
+def test_columns_round_trip(codec):
+    table = make_table()
+    restored = AllocationTable.from_columns(decode_value(CODECS[codec].encode(table.to_columns())))
+    assert restored.to_models() == ALLOCATIONS
+    assert restored.json_rows() == table.json_rows()
+
+
+def test_columns_round_trip_through_json():
+    table = make_table()
+    restored = AllocationTable.from_columns(json.loads(json.dumps(table.to_columns())))
+    assert restored.json_rows() == table.json_rows()
+
+
+def test_from_columns_rejects_inconsistent_columns():
+    columns = make_table().to_columns()
+    with pytest.raises(ValueError):
+        AllocationTable.from_columns({**columns, "deployed": columns["deployed"][:-1]})
+    broken = json.loads(json.dumps(columns))
+    broken["columns"]["org_name"]["codes"][0] = 1000
+    with pytest.raises(ValueError):
+        AllocationTable.from_columns(broken)
+
+
+def test_from_dicts_accepts_legacy_payload():
+    table = AllocationTable.from_dicts(json.loads(json.dumps([a.model_dump(mode="json") for a in ALLOCATIONS])))
+    assert table.to_models() == ALLOCATIONS
+
+
+def test_select_keeps_rows_in_order():
+    table = make_table()
+    selected = table.select([4, 0, 3])
+    assert selected.to_models() == [ALLOCATIONS[4], ALLOCATIONS[0], ALLOCATIONS[3]]
+    assert selected.json_rows() == [ALLOCATIONS[i].model_dump_json() for i in (4, 0, 3)]
+    assert len(table.select([])) == 0
+    # Исходная таблица не меняется
+    assert table.to_models() == ALLOCATIONS
+
+
+def test_concat_and_extend_re_encode_dictionaries():
+    first, second = make_table(ALLOCATIONS[:2]), make_table(ALLOCATIONS[2:])
+    merged = AllocationTable.concat([first, second])
+    assert merged.to_models() == ALLOCATIONS
+    # Дописывание выборки в выборку — так сливаются дельты IP Space
+    delta = make_table(ALLOCATIONS[1:2])
+    result = merged.select([0, 2, 3, 4])
+    result.extend(delta)
+    assert result.to_models() == [ALLOCATIONS[i] for i in (0, 2, 3, 4, 1)]
+
+
+def test_rows_in_groups_by_cloud_and_pool():
+    table = make_table()
+    assert list(table.rows_in("vcd", "pool")) == [0, 1, 4]
+    assert list(table.rows_in("vcd01")) == [2, 3]
+    assert list(table.rows_in("vcd01", "ext")) == [3]
+    assert list(table.rows_in("missing")) == []
@@ -0,0 +1,52 @@
+# backend/tests/test_dashboard_snapshot.py
+"""
+Готовые ответы снимка: ETag зависит только от данных, а не от времени
+пересборки, иначе клиенты после каждого обновления получали бы тело целиком.
+"""
+from datetime import datetime, timedelta, timezone
+
+import pytz
+
+from dashboard_snapshot import PreparedJSON
+from models import DashboardSummary
+
+ALMATY = pytz.timezone("Asia/Almaty")
+
+
+def make_summary(last_update: datetime, used_ips: int = 10) -> DashboardSummary:
+    return DashboardSummary(
+        last_update=last_update, total_clouds=1, total_ips=100, used_ips=used_ips,
+        free_ips=100 - used_ips, usage_percentage=float(used_ips), total_allocations=used_ips,
+        total_conflicts=0, clouds=[],
+    )
+
+
+def test_etag_ignores_last_update():
+    first = ALMATY.localize(datetime(2026, 1, 1, 12, 0, 0, 123456))
+    second = first + timedelta(minutes=5)
+    # После восстановления из хранилища время приходит в UTC
+    restored = second.astimezone(timezone.utc)
+    etags = {
+        PreparedJSON(make_summary(when), when).etag
+        for when in (first, second, restored)
+    }
+    assert len(etags) == 1
+
+
+def test_etag_changes_with_data():
+    when = ALMATY.localize(datetime(2026, 1, 1, 12, 0))
+    assert PreparedJSON(make_summary(when), when).etag != PreparedJSON(make_summary(when, 11), when).etag
+
+
+def test_body_keeps_last_update():
+    when = ALMATY.localize(datetime(2026, 1, 1, 12, 0))
+    prepared = PreparedJSON(make_summary(when), when)
+    assert DashboardSummary.model_validate_json(prepared.body).last_update == when
+    assert prepared.last_modified == when
+
+
+def test_representations_have_distinct_etags():
+    when = ALMATY.localize(datetime(2026, 1, 1, 12, 0))
+    prepared = PreparedJSON(make_summary(when), when)
+    assert prepared.gzip_etag != prepared.etag
+    assert prepared.gzip_etag == PreparedJSON(make_summary(when + timedelta(hours=1)), when + timedelta(hours=1)).gzip_etag
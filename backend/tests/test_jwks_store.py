@@ -0,0 +1,76 @@
+# backend/tests/test_jwks_store.py
+"""
+Кеш ключей подписи Keycloak: запрос JWKS один на всех, промах по kid во время
+загрузки ждёт её, а не получает отказ по интервалу повторных запросов.
+"""
+import asyncio
+import threading
+import time
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+from jose import jwk
+
+import keycloak_auth
+from keycloak_auth import JWKSKeyStore
+
+
+def make_public_jwk(kid: str) -> dict:
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    pem = private_key.private_bytes(
+        serialization.Encoding.PEM, serialization.PrivateFormat.PKCS8, serialization.NoEncryption()
+    ).decode()
+    public = jwk.construct(pem, "RS256").public_key().to_dict()
+    public.update(kid=kid, use="sig", alg="RS256")
+    return public
+
+
+class SlowKeycloak:
+    """certs() отвечает с задержкой и считает вызовы"""
+
+    def __init__(self, keys, delay=0.2):
+        self.keys = keys
+        self.delay = delay
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def certs(self):
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.delay)
+        return {"keys": self.keys}
+
+
+def test_lookup_during_startup_fetch_waits_for_it(monkeypatch):
+    keycloak = SlowKeycloak([make_public_jwk("k1")])
+    monkeypatch.setattr(keycloak_auth, "keycloak_openid", keycloak)
+
+    async def run():
+        store = JWKSKeyStore()
+        store.start()
+        await asyncio.sleep(0)
+        keys = await asyncio.gather(*(store.get_key("k1") for _ in range(10)))
+        await store.stop()
+        return store, keys
+
+    store, keys = asyncio.run(run())
+    assert all(key is not None for key in keys)
+    assert keycloak.calls == 1
+    assert store.stats["rate_limited"] == 0
+
+
+def test_unknown_kid_refetch_is_rate_limited(monkeypatch):
+    keycloak = SlowKeycloak([make_public_jwk("k1")], delay=0)
+    monkeypatch.setattr(keycloak_auth, "keycloak_openid", keycloak)
+
+    async def run():
+        store = JWKSKeyStore()
+        assert await store.get_key("k1") is not None
+        assert await store.get_key("unknown") is None
+        assert await store.get_key("unknown") is None
+        return store
+
+    store = asyncio.run(run())
+    # Первый промах загрузил ключи, второй kid отклонён по интервалу
+    assert keycloak.calls == 1
+    assert store.stats["rate_limited"] == 2
@@ -0,0 +1,167 @@
+# backend/tests/test_vcd_sync.py
+"""
+Инкрементальная синхронизация пулов VCD между полными сверками:
+External Network проверяется по первой и последней странице, IP Space
+дозагружается дельтой по allocationDate. Освобождения и смена владельца
+не должны теряться, а неизменный пул не должен загружаться целиком.
+"""
+import asyncio
+from datetime import datetime, timedelta, timezone
+
+import httpx
+
+from vcd_client import PAGE_SIZE, VCDClient
+
+NETWORK_SIZE = PAGE_SIZE * 3
+NOW = datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+
+def ip_key(ip):
+    return tuple(map(int, ip.split(".")))
+
+
+def make_network():
+    return {f"10.1.{i // 256}.{i % 256}": f"vm-{i}" for i in range(NETWORK_SIZE)}
+
+
+def make_ip_space():
+    return {f"10.2.0.{i}": (f"org-{i}", NOW - timedelta(days=30 - i)) for i in range(1, 21)}
+
+
+def parse_filter(fql):
+    """type==FLOATING_IP;allocationDate=ge=...;allocationDate=lt=... -> (ge, lt)"""
+    bounds = {}
+    for condition in fql.strip("()").split(";"):
+        if condition.startswith("allocationDate="):
+            _, op, value = condition.split("=", 2)
+            bounds[op] = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    return bounds.get("ge"), bounds.get("lt")
+
+
+def make_client(network=None, ip_space=None):
+    requests = []
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        if "oauth" in request.url.path:
+            return httpx.Response(200, json={"access_token": "token", "expires_in": 3600})
+        requests.append(request.url)
+        page = int(request.url.params["page"])
+        size = int(request.url.params["pageSize"])
+        if "externalNetworks" in request.url.path:
+            rows = [
+                {"ipAddress": ip, "allocationType": "VM_ALLOCATED", "entityName": vm, "orgRef": {"name": "org"}}
+                for ip, vm in sorted(network.items(), key=lambda item: ip_key(item[0]))
+            ]
+        else:
+            since, before = parse_filter(request.url.params["filter"])
+            rows = [
+                {"value": ip, "type": "FLOATING_IP", "orgRef": {"name": org},
+                 "allocationDate": date.isoformat()}
+                for ip, (org, date) in sorted(ip_space.items(), key=lambda item: ip_key(item[0]))
+                if (since is None or date >= since) and (before is None or date < before)
+            ]
+        return httpx.Response(200, json={
+            "resultTotal": len(rows),
+            "pageCount": -(-len(rows) // size),
+            "values": rows[(page - 1) * size:page * size],
+        })
+
+    client = VCDClient("https://vcd.example/api", "37.0", "refresh-token", "vcd01", rate_limit=0)
+    client.session = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client, requests
+
+
+def load_network(client):
+    client.cache.clear()
+    table = asyncio.run(client.fetch_external_network_used_ips("net", "ext"))
+    return {table.ip_address(row): table.get("entity_name", row) for row in range(len(table))}
+
+
+def load_ip_space(client):
+    client.cache.clear()
+    table = asyncio.run(client.fetch_ip_space_allocations("space", "ipspace"))
+    return {table.ip_address(row): table.get("org_name", row) for row in range(len(table))}
+
+
+def expire_full_sync(client):
+    for state in client._sync_state.values():
+        state["full_at"] = 0
+
+
+def test_unchanged_network_is_probed_not_reloaded():
+    network = make_network()
+    client, requests = make_client(network)
+    first = load_network(client)
+    assert first == network
+
+    requests.clear()
+    assert load_network(client) == first
+    # Только первая и последняя страницы
+    assert len(requests) == 2
+    assert client.get_stats()["unchanged_pools"] == 1
+
+
+def test_first_or_last_page_change_is_detected_by_probe():
+    network = make_network()
+    client, _requests = make_client(network)
+    load_network(client)
+
+    network["10.1.0.5"] = "vm-renamed"
+    assert load_network(client) == network
+    # Разобрана заново только изменившаяся первая страница
+    assert client.get_stats()["pages_reused"] == 2
+
+    network["10.9.0.1"] = "vm-tail"
+    assert load_network(client) == network
+
+
+def test_release_and_allocate_on_middle_page_is_detected_by_total():
+    network = make_network()
+    client, _requests = make_client(network)
+    load_network(client)
+
+    del network["10.1.0.150"]
+    network["10.1.0.151"] = "vm-new"
+    del network["10.1.0.140"]
+    assert load_network(client) == network
+
+
+def test_middle_page_change_is_detected_by_full_sync():
+    network = make_network()
+    client, _requests = make_client(network)
+    original = dict(network)
+    load_network(client)
+
+    # Адрес на второй странице перешёл к другой VM, число адресов то же:
+    # проба этого не видит, видит очередная полная сверка
+    network["10.1.0.200"] = "vm-moved"
+    assert load_network(client) == original
+    expire_full_sync(client)
+    assert load_network(client) == network
+
+
+def test_ip_space_release_and_allocate_with_same_count():
+    ip_space = make_ip_space()
+    client, _requests = make_client(ip_space=ip_space)
+    assert load_ip_space(client) == {ip: org for ip, (org, _date) in ip_space.items()}
+    assert client.get_stats()["full_syncs"] == 1
+
+    # Освобождён давний адрес, выделен новый — общее число не изменилось
+    del ip_space["10.2.0.1"]
+    ip_space["10.2.0.100"] = ("org-new", NOW + timedelta(minutes=1))
+    assert load_ip_space(client) == {ip: org for ip, (org, _date) in ip_space.items()}
+    # Число аллокаций до окна дельты не сошлось — пул загружен целиком
+    assert client.get_stats()["full_syncs"] == 2
+
+
+def test_ip_space_release_inside_delta_window():
+    ip_space = make_ip_space()
+    client, _requests = make_client(ip_space=ip_space)
+    load_ip_space(client)
+
+    # Освобождён адрес из окна дельты, вместо него выделен другой
+    del ip_space["10.2.0.20"]
+    ip_space["10.2.0.101"] = ("org-new", NOW + timedelta(minutes=1))
+    assert load_ip_space(client) == {ip: org for ip, (org, _date) in ip_space.items()}
+    assert client.get_stats()["delta_syncs"] == 1
+    assert client.get_stats()["full_syncs"] == 1
@@ -0,0 +1,32 @@
+# backend/tests/test_vcd_token.py
+"""
+Фоновое обновление bearer токена: токен с нулевым сроком жизни
+не должен превращать цикл обновления в поток запросов к OAuth.
+"""
+import asyncio
+
+import httpx
+
+import vcd_client
+from vcd_client import VCDClient
+
+
+def test_renewal_loop_is_throttled_for_zero_lifetime(monkeypatch):
+    monkeypatch.setattr(vcd_client, "VCD_TOKEN_MIN_RENEW_INTERVAL", 0.05)
+    oauth_calls = 0
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        nonlocal oauth_calls
+        oauth_calls += 1
+        return httpx.Response(200, json={"access_token": f"token-{oauth_calls}", "expires_in": 0})
+
+    async def run():
+        client = VCDClient("https://vcd.example/api", "37.0", "refresh-token", "vcd01", rate_limit=0)
+        client.session = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+        client.start()
+        await asyncio.sleep(0.3)
+        await client.aclose()
+
+    asyncio.run(run())
+    # Одно обновление за минимальный интервал, а не тысячи
+    assert 1 <= oauth_calls <= 8
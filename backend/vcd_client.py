@@ -1,20 +1,61 @@
 import os
+import json
 import time
-import requests
-from typing import List, Dict, Optional, Set
-from urllib.parse import urlparse
-import urllib3
+import math
+import asyncio
+import hashlib
+import httpx
+from typing import List, Dict, Optional, Any, Callable, Awaitable, Tuple
+from urllib.parse import urlparse, quote
 from cachetools import TTLCache
-from threading import Lock
 import logging
-from datetime import datetime
-from models import IPAllocation
-
-# Отключаем предупреждения SSL (self-signed сертификаты в VCD)
-urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+from allocation_table import AllocationTable
+from rate_control import AdaptiveConcurrency, TokenBucket
 
 logger = logging.getLogger(__name__)
 
+# Параметры пагинации VCD cloudapi
+PAGE_SIZE = 128
+MAX_TOTAL_ENTRIES = 10000
+MAX_PAGES = min(100, MAX_TOTAL_ENTRIES // PAGE_SIZE + 1)
+
+# Максимум одновременных запросов к одному облаку; фактический лимит
+# подбирается по ответам VCD (AIMD) и стартует с половины максимума
+VCD_MAX_CONCURRENCY = int(os.getenv("VCD_MAX_CONCURRENCY", "16"))
+# Ответ медленнее этого (секунды) считается признаком нагрузки на VCD
+VCD_LATENCY_TARGET = float(os.getenv("VCD_LATENCY_TARGET", "2.0"))
+# Частота запросов к одному облаку (в секунду, 0 — без ограничения) и допустимый всплеск
+VCD_RATE_LIMIT = float(os.getenv("VCD_RATE_LIMIT", "20"))
+VCD_RATE_BURST = float(os.getenv("VCD_RATE_BURST", "20"))
+# Повторы при 429/502/503/504 и сетевых ошибках: число попыток и предел паузы (секунды)
+VCD_MAX_ATTEMPTS = int(os.getenv("VCD_MAX_ATTEMPTS", "4"))
+VCD_BACKOFF_MAX = float(os.getenv("VCD_BACKOFF_MAX", "30"))
+RETRY_STATUSES = {429, 502, 503, 504}
+
+# Bearer токен обновляется в фоне заранее, за столько секунд до истечения
+# (но не раньше середины срока жизни токена); после ошибки — повтор через интервал.
+# Между фоновыми обновлениями не меньше VCD_TOKEN_MIN_RENEW_INTERVAL: токен с нулевым
+# или очень коротким expires_in не должен превращать цикл в непрерывные запросы к OAuth
+VCD_TOKEN_RENEW_AHEAD = float(os.getenv("VCD_TOKEN_RENEW_AHEAD", "300"))
+VCD_TOKEN_RETRY_INTERVAL = float(os.getenv("VCD_TOKEN_RETRY_INTERVAL", "30"))
+VCD_TOKEN_MIN_RENEW_INTERVAL = float(os.getenv("VCD_TOKEN_MIN_RENEW_INTERVAL", "30"))
+# Запас, при котором токен обновляется прямо в запросе (фоновое обновление не успело);
+# для короткоживущих токенов — не больше четверти срока жизни
+TOKEN_EXPIRY_MARGIN = 30
+
+# Инкрементальная синхронизация между полными сверками. IP Space: загружаются
+# только аллокации с новой allocationDate. External Network: проверяются первая
+# и последняя страницы. Изменения, которые так не видны (usedByRef и организация
+# в IP Space, смена владельца адреса в середине списка External Network), видны
+# не позже чем через этот интервал — по умолчанию три цикла обновления дашборда
+# (0 — всегда полная загрузка)
+VCD_FULL_SYNC_INTERVAL = float(os.getenv("VCD_FULL_SYNC_INTERVAL", "900"))
+# Перекрытие окна по allocationDate: записи, зафиксированные в VCD с опозданием
+VCD_SYNC_OVERLAP = float(os.getenv("VCD_SYNC_OVERLAP", "300"))
+
 
 def _parse_allocation_date(raw_date: Optional[str]) -> Optional[datetime]:
     """Безопасно парсит дату аллокации из VCD API."""
@@ -29,243 +70,657 @@ def _parse_allocation_date(raw_date: Optional[str]) -> Optional[datetime]:
         return None
 
 
+def _fql_datetime(value: datetime) -> str:
+    """Дата для FQL фильтра: UTC с миллисекундами (без '+', который ломает query string)"""
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+
+
+def _page_fingerprint(items: List[Dict]) -> str:
+    """Отпечаток содержимого страницы коллекции"""
+    return hashlib.sha1(json.dumps(items, sort_keys=True, default=str).encode()).hexdigest()
+
+
+class RetryableResponse(Exception):
+    """Ответ VCD, после которого запрос стоит повторить (429, 502-504)"""
+
+    def __init__(self, response: httpx.Response):
+        super().__init__(f"HTTP {response.status_code}")
+        self.response = response
+
+
+_jittered_backoff = wait_random_exponential(multiplier=0.5, max=VCD_BACKOFF_MAX)
+
+
+def _retry_wait(retry_state) -> float:
+    """Пауза перед повтором: экспонента с джиттером, но не меньше Retry-After"""
+    delay = _jittered_backoff(retry_state)
+    error = retry_state.outcome.exception()
+    if isinstance(error, RetryableResponse):
+        retry_after = error.response.headers.get('Retry-After', '')
+        if retry_after.isdigit():
+            delay = max(delay, min(float(retry_after), VCD_BACKOFF_MAX))
+    return delay
+
+
 class VCDClient:
-    """Клиент для работы с VMware vCloud Director API"""
+    """Асинхронный клиент для работы с VMware vCloud Director API"""
 
-    def __init__(self, base_url: str, api_version: str, api_token: str, cloud_name: str):
+    def __init__(self, base_url: str, api_version: str, api_token: str, cloud_name: str,
+                 max_concurrency: int = VCD_MAX_CONCURRENCY, rate_limit: float = VCD_RATE_LIMIT):
         self.base_url = base_url
         self.api_version = api_version
         self.api_token = api_token
         self.cloud_name = cloud_name
-        self.token_cache = {'token': None, 'expires_at': 0}
-        self.token_lock = Lock()
-
-        # Настройка сессии
-        self.session = requests.Session()
-        self.session.verify = False
-
-        import http.client
-        http.client._MAXHEADERS = 1000
-
-        adapter = requests.adapters.HTTPAdapter(
-            pool_connections=10,
-            pool_maxsize=10,
-            max_retries=3
+        # Токен и срок его действия заменяются одним присваиванием словаря,
+        # поэтому читаются без блокировок
+        self.token_cache = {'token': None, 'issued_at': 0, 'expires_at': 0}
+        self._token_refresh: Optional[asyncio.Task] = None
+        self._token_renewal: Optional[asyncio.Task] = None
+
+        # Нагрузка на это облако: частота запросов и адаптивный лимит параллельных
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = TokenBucket(rate_limit, VCD_RATE_BURST)
+        self.concurrency = AdaptiveConcurrency(max_concurrency, latency_target=VCD_LATENCY_TARGET)
+
+        # Настройка HTTP-клиента (self-signed сертификаты в VCD).
+        # Повторы — в make_request, с backoff; транспорт сам не повторяет
+        self.session = httpx.AsyncClient(
+            verify=False,
+            timeout=httpx.Timeout(30.0, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=max_concurrency,
+                max_keepalive_connections=max_concurrency
+            ),
+            transport=httpx.AsyncHTTPTransport(verify=False)
         )
-        self.session.mount('http://', adapter)
-        self.session.mount('https://', adapter)
 
         # Кэш для данных (5 минут)
         self.cache = TTLCache(maxsize=100, ttl=300)
 
-    def get_bearer_token(self, force_refresh: bool = False) -> str:
-        """Получить или обновить Bearer токен"""
-        with self.token_lock:
+        # Single-flight: ключ кэша -> выполняющаяся загрузка пула
+        self._inflight: Dict[str, asyncio.Task] = {}
+        self.fetch_stats = {
+            'fetches': 0, 'cache_hits': 0, 'deduplicated': 0,
+            'requests': 0, 'full_syncs': 0, 'delta_syncs': 0, 'unchanged_pools': 0, 'pages_reused': 0,
+            'retries': 0, 'throttled': 0, 'server_errors': 0, 'timeouts': 0,
+            'token_refreshes': 0, 'token_rejected': 0,
+        }
+
+        # Состояние инкрементальной синхронизации: ключ кэша -> данные последней загрузки
+        self._sync_state: Dict[str, Dict[str, Any]] = {}
+
+    def reset(self):
+        """Забыть загруженные данные пулов: следующая загрузка каждого пула — полная"""
+        self.cache.clear()
+        self._sync_state.clear()
+
+    def start(self):
+        """Запустить фоновое обновление bearer токена"""
+        if self._token_renewal is None or self._token_renewal.done():
+            self._token_renewal = asyncio.create_task(self._renew_token_loop())
+
+    async def aclose(self):
+        """Остановить обновление токена и закрыть HTTP-соединения клиента"""
+        if self._token_renewal is not None:
+            self._token_renewal.cancel()
+            try:
+                await self._token_renewal
+            except asyncio.CancelledError:
+                pass
+            self._token_renewal = None
+        await self.session.aclose()
+
+    def get_stats(self) -> Dict:
+        """Статистика загрузок пулов (для /api/health)"""
+        return {
+            **self.fetch_stats,
+            'in_flight': len(self._inflight),
+            'cached_pools': len(self.cache),
+            'concurrency': self.concurrency.get_stats(),
+            'rate_limiter': self.rate_limiter.get_stats(),
+        }
+
+    async def _single_flight(self, cache_key: str,
+                             loader: Callable[[], Awaitable[AllocationTable]]) -> AllocationTable:
+        """
+        Загрузить данные пула не более одного раза одновременно.
+        Параллельные запросы того же ключа ждут уже идущую загрузку,
+        повторные в пределах TTL получают результат из кэша.
+        """
+        if cache_key in self.cache:
+            self.fetch_stats['cache_hits'] += 1
+            return self.cache[cache_key]
+
+        task = self._inflight.get(cache_key)
+        if task is not None:
+            self.fetch_stats['deduplicated'] += 1
+            logger.debug(f"{self.cloud_name}: joined in-flight fetch {cache_key}")
+        else:
+            self.fetch_stats['fetches'] += 1
+            task = asyncio.create_task(self._run_fetch(cache_key, loader))
+            self._inflight[cache_key] = task
+
+        # shield: дедлайн одного ожидающего не отменяет загрузку для остальных
+        return await asyncio.shield(task)
+
+    async def _run_fetch(self, cache_key: str,
+                         loader: Callable[[], Awaitable[AllocationTable]]) -> AllocationTable:
+        """Выполнить загрузку, положить результат в кэш и снять её с учёта"""
+        try:
+            allocations = await loader()
+            self.cache[cache_key] = allocations
+            return allocations
+        finally:
+            self._inflight.pop(cache_key, None)
+
+    async def get_bearer_token(self, force_refresh: bool = False) -> str:
+        """
+        Получить Bearer токен. Действующий токен читается без блокировок;
+        если его нет или он истекает (или force_refresh), запрашивается новый —
+        одним общим запросом на все параллельные вызовы.
+        """
+        token_cache = self.token_cache
+        lifetime = token_cache['expires_at'] - token_cache['issued_at']
+        margin = min(TOKEN_EXPIRY_MARGIN, lifetime / 4)
+        if (not force_refresh and token_cache['token'] is not None
+                and time.time() < token_cache['expires_at'] - margin):
+            return token_cache['token']
+        return await self._refresh_token()
+
+    async def _refresh_token(self, rejected_token: Optional[str] = None) -> str:
+        """
+        Обновить токен. Если обновление уже идёт, вызов ждёт его результата.
+        rejected_token — токен, на который VCD ответил 401: если его уже
+        сменили, новый токен не запрашивается.
+        """
+        current = self.token_cache['token']
+        if rejected_token is not None and current is not None and current != rejected_token:
+            return current
+
+        task = self._token_refresh
+        if task is None or task.done():
+            task = self._token_refresh = asyncio.create_task(self._request_token())
+        # shield: отмена одного ожидающего не прерывает обновление для остальных
+        return await asyncio.shield(task)
+
+    async def _request_token(self) -> str:
+        """Запросить новый токен в VCD по refresh token"""
+        parts = urlparse(self.base_url)
+        token_url = f"{parts.scheme}://{parts.netloc}/oauth/provider/token"
+
+        try:
             now = time.time()
-            if (force_refresh or
-                    self.token_cache['token'] is None or
-                    now >= self.token_cache['expires_at'] - 300):
-                parts = urlparse(self.base_url)
-                token_url = f"{parts.scheme}://{parts.netloc}/oauth/provider/token"
-
-                try:
-                    r = self.session.post(
-                        token_url,
-                        params={'grant_type': 'refresh_token', 'refresh_token': self.api_token},
-                        headers={'Accept': 'application/json'},
-                        timeout=(5, 10)
-                    )
-                    r.raise_for_status()
-                    data = r.json()
-                    self.token_cache['token'] = data['access_token']
-                    self.token_cache['expires_at'] = now + int(data.get('expires_in', 3600))
-                    logger.info(f"Got new bearer token for {self.cloud_name}")
-                except Exception as e:
-                    logger.error(f"Failed to get bearer token for {self.cloud_name}: {e}")
-                    raise
-
-            return self.token_cache['token']
-
-    def get_headers(self) -> Dict:
+            r = await self.session.post(
+                token_url,
+                params={'grant_type': 'refresh_token', 'refresh_token': self.api_token},
+                headers={'Accept': 'application/json'},
+                timeout=httpx.Timeout(10.0, connect=5.0)
+            )
+            r.raise_for_status()
+            data = r.json()
+            self.token_cache = {
+                'token': data['access_token'],
+                'issued_at': now,
+                'expires_at': now + int(data.get('expires_in', 3600)),
+            }
+            self.fetch_stats['token_refreshes'] += 1
+            logger.info(f"Got new bearer token for {self.cloud_name}")
+            return data['access_token']
+        except Exception as e:
+            logger.error(f"Failed to get bearer token for {self.cloud_name}: {e}")
+            raise
+
+    async def _renew_token_loop(self):
+        """Обновлять токен в фоне до истечения, чтобы запросы не ждали OAuth"""
+        while True:
+            token_cache = self.token_cache
+            lifetime = token_cache['expires_at'] - token_cache['issued_at']
+            renew_at = token_cache['expires_at'] - min(VCD_TOKEN_RENEW_AHEAD, lifetime / 2)
+            delay = renew_at - time.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+                continue
+            try:
+                await self._refresh_token()
+            except Exception:
+                # Ошибка уже в логе; пока токен действует, запросы идут со старым
+                await asyncio.sleep(VCD_TOKEN_RETRY_INTERVAL)
+                continue
+            # Следующее обновление — не раньше минимального интервала, каким бы
+            # коротким ни был срок жизни нового токена
+            await asyncio.sleep(VCD_TOKEN_MIN_RENEW_INTERVAL)
+
+    async def get_headers(self) -> Dict:
         """Получить заголовки для запросов"""
         return {
             'Accept': f'application/json;version={self.api_version}',
-            'Authorization': f'Bearer {self.get_bearer_token()}'
+            'Authorization': f'Bearer {await self.get_bearer_token()}'
         }
 
-    def make_request(self, url: str, retry_on_401: bool = True) -> Optional[requests.Response]:
+    async def _send(self, url: str) -> httpx.Response:
+        """
+        Один GET к VCD в пределах лимитов облака. Время ответа и признаки
+        перегрузки (429, 5xx, таймаут) подстраивают лимит параллельных запросов.
+        """
+        headers = await self.get_headers()
+        await self.rate_limiter.acquire()
+        async with self.concurrency:
+            self.fetch_stats['requests'] += 1
+            started = time.monotonic()
+            try:
+                response = await self.session.get(url, headers=headers)
+            except httpx.TimeoutException:
+                self.fetch_stats['timeouts'] += 1
+                self.concurrency.on_overload()
+                raise
+
+        if response.status_code == 429 or response.status_code >= 500:
+            self.fetch_stats['throttled' if response.status_code == 429 else 'server_errors'] += 1
+            self.concurrency.on_overload()
+        else:
+            self.concurrency.on_success(time.monotonic() - started)
+        if response.status_code in RETRY_STATUSES:
+            raise RetryableResponse(response)
+        return response
+
+    def _before_retry(self, retry_state):
+        self.fetch_stats['retries'] += 1
+        logger.warning(
+            f"{self.cloud_name}: retrying request after {retry_state.outcome.exception()} "
+            f"(attempt {retry_state.attempt_number}, sleep {retry_state.next_action.sleep:.1f}s)"
+        )
+
+    async def _get_with_retries(self, url: str) -> httpx.Response:
+        """GET с повторами при 429/502-504 и сетевых ошибках (экспонента с джиттером)"""
+        retrying = AsyncRetrying(
+            stop=stop_after_attempt(VCD_MAX_ATTEMPTS),
+            wait=_retry_wait,
+            retry=retry_if_exception_type((RetryableResponse, httpx.TransportError)),
+            before_sleep=self._before_retry,
+            reraise=True
+        )
+        try:
+            async for attempt in retrying:
+                with attempt:
+                    return await self._send(url)
+        except RetryableResponse as e:
+            # Попытки исчерпаны — вызывающий код увидит статус ответа
+            return e.response
+
+    async def make_request(self, url: str, retry_on_401: bool = True) -> Optional[httpx.Response]:
         """Выполнить запрос с обработкой 401 ошибки"""
         try:
-            response = self.session.get(url, headers=self.get_headers(), timeout=(10, 30))
+            response = await self._get_with_retries(url)
 
             if response.status_code == 401 and retry_on_401:
+                # Все запросы, получившие 401 с одним и тем же токеном, ждут одно обновление
+                self.fetch_stats['token_rejected'] += 1
+                rejected = response.request.headers.get('Authorization', '').removeprefix('Bearer ')
                 logger.warning(f"Got 401 for {self.cloud_name}, refreshing token...")
-                self.get_bearer_token(force_refresh=True)
-                return self.make_request(url, retry_on_401=False)
+                await self._refresh_token(rejected_token=rejected)
+                return await self.make_request(url, retry_on_401=False)
 
             return response
         except Exception as e:
             logger.error(f"Request failed for {url}: {e}")
             return None
 
-    def fetch_ip_space_allocations(self, ip_space_id: str, pool_name: str) -> List[IPAllocation]:
-        """Получить занятые IP из IP Space (для vcd v38)"""
-        cache_key = f"ipspace_{ip_space_id}"
-        if cache_key in self.cache:
-            return self.cache[cache_key]
-
-        allocations = []
-        page = 1
-        page_size = 128
-        max_total_entries = 10000
+    async def _fetch_page(self, base_url: str, page: int, pool_name: str,
+                          page_size: int = PAGE_SIZE) -> Optional[Any]:
+        """Получить одну страницу коллекции cloudapi (разобранный JSON или None)"""
+        separator = '&' if '?' in base_url else '?'
+        url = f"{base_url}{separator}pageSize={page_size}&page={page}"
 
-        logger.info(f"Fetching allocations for {pool_name} ({ip_space_id})")
+        response = await self.make_request(url)
+        if not response or response.status_code != 200:
+            if response:
+                logger.warning(f"Error fetching page {page} for {pool_name}: {response.status_code}")
+            return None
 
-        while True:
-            url = (
-                f"{self.base_url}/cloudapi/1.0.0/ipSpaces/{ip_space_id}/allocations"
-                f"?filter=(type==FLOATING_IP)&pageSize={page_size}&page={page}"
-            )
+        try:
+            return response.json()
+        except ValueError as e:
+            logger.error(f"Invalid JSON response for {pool_name} page {page}: {e}")
+            return None
 
-            response = self.make_request(url)
-            if not response or response.status_code != 200:
-                if response:
-                    logger.warning(f"Error response for {pool_name}: {response.status_code}")
-                break
+    @staticmethod
+    def _extract_items(data: Any, pool_name: str) -> List[Dict]:
+        """Достать элементы страницы: данные могут быть как list так и dict с values"""
+        if isinstance(data, dict):
+            items = data.get('values', [])
+            if not items and 'values' not in data:
+                logger.warning(
+                    f"Unexpected response structure for {pool_name}: "
+                    f"keys={list(data.keys())}"
+                )
+            return items or []
+        if isinstance(data, list):
+            return data
+        if data is not None:
+            logger.warning(f"Unexpected response type for {pool_name}: {type(data)}")
+        return []
+
+    @staticmethod
+    def _get_result_total(data: Any) -> Optional[int]:
+        """Общее число элементов коллекции по resultTotal"""
+        if isinstance(data, dict) and data.get('resultTotal') is not None:
+            return int(data['resultTotal'])
+        return None
 
-            try:
-                data = response.json()
-            except ValueError as e:
-                logger.error(f"Invalid JSON response for {pool_name}: {e}")
-                break
-
-            values = data.get('values', [])
-            if not values:
-                break
-
-            for alloc in values:
-                if alloc.get('type') == 'FLOATING_IP':
-                    allocations.append(IPAllocation(
-                        ip_address=alloc.get('value', 'N/A'),
-                        org_name=alloc.get('orgRef', {}).get('name', 'unknown'),
-                        org_id=alloc.get('orgRef', {}).get('id'),
-                        entity_name=(
-                            alloc.get('usedByRef', {}).get('name')
-                            if alloc.get('usedByRef') else None
-                        ),
-                        allocation_type='FLOATING_IP',
-                        cloud_name=self.cloud_name,
-                        pool_name=pool_name,
-                        allocation_date=_parse_allocation_date(alloc.get('allocationDate'))
-                    ))
-
-            if len(values) < page_size:
-                break
-
-            page += 1
-
-            if page > 100 or len(allocations) > max_total_entries:
-                logger.warning(f"Reached limit for {pool_name}: page={page}, entries={len(allocations)}")
-                break
+    @staticmethod
+    def _get_page_count(data: Any) -> Optional[int]:
+        """Количество страниц по pageCount/resultTotal первой страницы"""
+        if not isinstance(data, dict):
+            return None
+        if data.get('pageCount') is not None:
+            return int(data['pageCount'])
+        if data.get('resultTotal') is not None:
+            return math.ceil(int(data['resultTotal']) / PAGE_SIZE)
+        return None
 
-        logger.info(f"{self.cloud_name}: Found {len(allocations)} IPs in {pool_name}")
-        self.cache[cache_key] = allocations
-        return allocations
+    async def _fetch_pages(self, base_url: str, pool_name: str,
+                           first_page: Optional[Any] = None) -> List[List[Dict]]:
+        """
+        Получить все страницы коллекции (элементы каждой страницы отдельно).
+        Первая страница запрашивается отдельно, чтобы узнать pageCount/resultTotal,
+        остальные — параллельно (в пределах лимитов облака).
+        first_page — уже полученная первая страница, если есть.
+        """
+        if first_page is None:
+            first_page = await self._fetch_page(base_url, 1, pool_name)
+        items = self._extract_items(first_page, pool_name)
+        if not items:
+            return []
+        pages = [items]
+
+        page_count = self._get_page_count(first_page)
+
+        if page_count is None:
+            # Нет метаданных пагинации — идём по страницам последовательно
+            page = 1
+            while len(pages[-1]) >= PAGE_SIZE:
+                page += 1
+                if page > MAX_PAGES:
+                    logger.warning(f"Reached limit for {pool_name}: page={page}, entries={sum(map(len, pages))}")
+                    break
+                page_items = self._extract_items(
+                    await self._fetch_page(base_url, page, pool_name), pool_name
+                )
+                if not page_items:
+                    break
+                pages.append(page_items)
+            return pages
+
+        if page_count > MAX_PAGES:
+            logger.warning(f"Reached limit for {pool_name}: pages={page_count}, fetching first {MAX_PAGES}")
+            page_count = MAX_PAGES
+
+        if page_count > 1:
+            responses = await asyncio.gather(*(
+                self._fetch_page(base_url, page, pool_name)
+                for page in range(2, page_count + 1)
+            ))
+            pages.extend(self._extract_items(data, pool_name) for data in responses)
+
+        return pages
+
+    async def _fetch_all_pages(self, base_url: str, pool_name: str,
+                               first_page: Optional[Any] = None) -> List[Dict]:
+        """Получить все элементы коллекции (см. _fetch_pages)"""
+        return [item for page in await self._fetch_pages(base_url, pool_name, first_page) for item in page]
+
+    def _needs_full_sync(self, state: Optional[Dict[str, Any]], pool_name: str) -> bool:
+        """Нужна ли полная загрузка пула вместо инкрементальной"""
+        return (
+            state is None
+            or state['pool_name'] != pool_name
+            or VCD_FULL_SYNC_INTERVAL <= 0
+            or time.time() - state['full_at'] >= VCD_FULL_SYNC_INTERVAL
+        )
 
-    def fetch_external_network_used_ips(self, network_id: str, pool_name: str) -> List[IPAllocation]:
-        """Получить занятые IP из External Network (для vcd01/vcd02 v37)"""
-        cache_key = f"extnet_{network_id}"
-        if cache_key in self.cache:
-            return self.cache[cache_key]
+    async def fetch_ip_space_allocations(self, ip_space_id: str, pool_name: str) -> AllocationTable:
+        """Получить занятые IP из IP Space (для vcd v38)"""
+        return await self._single_flight(
+            f"ipspace_{ip_space_id}",
+            lambda: self._load_ip_space_allocations(ip_space_id, pool_name)
+        )
 
-        allocations = []
-        page = 1
-        page_size = 128
-        max_total_entries = 10000
+    def _ip_space_url(self, ip_space_id: str, since: Optional[datetime] = None,
+                      before: Optional[datetime] = None) -> str:
+        """
+        URL плавающих IP IP Space; since — только выделенные не раньше этой даты,
+        before — только выделенные раньше неё
+        """
+        fql = "type==FLOATING_IP"
+        if since is not None:
+            fql += f";allocationDate=ge={quote(_fql_datetime(since), safe='')}"
+        if before is not None:
+            fql += f";allocationDate=lt={quote(_fql_datetime(before), safe='')}"
+        return f"{self.base_url}/cloudapi/1.0.0/ipSpaces/{ip_space_id}/allocations?filter=({fql})"
+
+    def _ip_space_table(self, values: List[Dict],
+                        pool_name: str) -> Tuple[AllocationTable, Optional[datetime]]:
+        """Таблица аллокаций IP Space и самая поздняя дата выделения среди них"""
+        allocations = AllocationTable()
+        latest: Optional[datetime] = None
+        for alloc in values:
+            if alloc.get('type') == 'FLOATING_IP':
+                allocation_date = _parse_allocation_date(alloc.get('allocationDate'))
+                allocations.append(
+                    ip_address=alloc.get('value', 'N/A'),
+                    org_name=alloc.get('orgRef', {}).get('name', 'unknown'),
+                    org_id=alloc.get('orgRef', {}).get('id'),
+                    entity_name=(
+                        alloc.get('usedByRef', {}).get('name')
+                        if alloc.get('usedByRef') else None
+                    ),
+                    allocation_type='FLOATING_IP',
+                    cloud_name=self.cloud_name,
+                    pool_name=pool_name,
+                    allocation_date=allocation_date
+                )
+                if allocation_date is not None and allocation_date.tzinfo is not None:
+                    latest = allocation_date if latest is None else max(latest, allocation_date)
+        return allocations, latest
+
+    async def _load_ip_space_allocations(self, ip_space_id: str, pool_name: str) -> AllocationTable:
+        """Загрузить аллокации IP Space из VCD (без кэша): дельтой, если можно, иначе целиком"""
+        cache_key = f"ipspace_{ip_space_id}"
+        state = self._sync_state.get(cache_key)
+        if not self._needs_full_sync(state, pool_name) and state['watermark'] is not None:
+            allocations = await self._sync_ip_space_delta(ip_space_id, pool_name, state)
+            if allocations is not None:
+                return allocations
 
-        logger.info(f"Fetching used IPs for {pool_name} ({network_id})")
+        logger.info(f"Fetching allocations for {pool_name} ({ip_space_id})")
+        self.fetch_stats['full_syncs'] += 1
+        values = await self._fetch_all_pages(self._ip_space_url(ip_space_id), pool_name)
+        allocations, latest = self._ip_space_table(values, pool_name)
+        self._sync_state[cache_key] = {
+            'table': allocations, 'pool_name': pool_name, 'watermark': latest, 'full_at': time.time()
+        }
 
-        while True:
-            url = (
-                f"{self.base_url}/cloudapi/1.0.0/externalNetworks/{network_id}"
-                f"/usedIpAddresses?pageSize={page_size}&page={page}"
-            )
+        logger.info(f"{self.cloud_name}: Found {len(allocations)} IPs in {pool_name}")
+        return allocations
 
-            response = self.make_request(url)
-            if not response or response.status_code != 200:
-                if response:
-                    logger.warning(f"Error fetching page {page} for {pool_name}: {response.status_code}")
-                break
+    async def _sync_ip_space_delta(self, ip_space_id: str, pool_name: str,
+                                   state: Dict[str, Any]) -> Optional[AllocationTable]:
+        """
+        Дозагрузить аллокации, выделенные после прошлой синхронизации, и слить
+        их с прежней таблицей. В окне дельты (allocationDate не раньше since)
+        VCD отдаёт все действующие аллокации, поэтому прежние строки из окна,
+        которых нет в дельте, считаются освобождёнными. Освобождения более старых
+        адресов видны по числу аллокаций до since: оно и общее число запрашиваются
+        страницей из одного элемента. Если после слияния числа не сходятся,
+        возвращается None и пул загружается целиком.
+        """
+        since = state['watermark'] - timedelta(seconds=VCD_SYNC_OVERLAP)
+        delta_url = self._ip_space_url(ip_space_id, since)
+        first_page, count_page, older_page = await asyncio.gather(
+            self._fetch_page(delta_url, 1, pool_name),
+            self._fetch_page(self._ip_space_url(ip_space_id), 1, pool_name, page_size=1),
+            self._fetch_page(self._ip_space_url(ip_space_id, before=since), 1, pool_name, page_size=1)
+        )
+        total = self._get_result_total(count_page)
+        older_total = self._get_result_total(older_page)
+        if first_page is None or total is None or older_total is None:
+            return None
 
-            try:
-                data = response.json()
-            except ValueError as e:
-                logger.error(f"Invalid JSON response for {pool_name} page {page}: {e}")
-                break
-
-            # Данные могут быть как list так и dict с values
-            if isinstance(data, dict):
-                items = data.get('values', [])
-                if not items and 'values' not in data:
-                    logger.warning(
-                        f"Unexpected response structure for {pool_name}: "
-                        f"keys={list(data.keys())}"
-                    )
-            elif isinstance(data, list):
-                items = data
-            else:
-                logger.warning(f"Unexpected response type for {pool_name}: {type(data)}")
-                break
-
-            if not items:
-                break
-
-            for item in items:
-                allocation_type = item.get('allocationType', 'UNKNOWN')
-                entity_name = None
-
-                if allocation_type == 'VM_ALLOCATED':
-                    entity_name = item.get('entityName') or item.get('vappName')
-                elif allocation_type == 'NAT':
-                    entity_name = f"NAT on {item.get('entityName', 'Unknown')}"
-                else:
-                    entity_name = item.get('entityName')
-
-                allocations.append(IPAllocation(
-                    ip_address=item.get('ipAddress', 'N/A'),
-                    org_name=item.get('orgRef', {}).get('name', 'unknown'),
-                    org_id=item.get('orgRef', {}).get('id'),
-                    entity_name=entity_name,
-                    allocation_type=allocation_type,
-                    cloud_name=self.cloud_name,
-                    pool_name=pool_name,
-                    allocation_date=None,
-                    vapp_name=item.get('vappName') or item.get('vAppName'),
-                    deployed=item.get('deployed')
-                ))
+        values = await self._fetch_all_pages(delta_url, pool_name, first_page=first_page)
+        delta, latest = self._ip_space_table(values, pool_name)
+        previous: AllocationTable = state['table']
+        changed = set(delta.ip_addresses())
+        kept: List[int] = []
+        older = 0
+        for row in range(len(previous)):
+            if previous.ip_address(row) in changed:
+                continue
+            allocation_date = previous.allocation_date(row)
+            if allocation_date is None:
+                kept.append(row)
+                continue
+            if allocation_date.tzinfo is None:
+                allocation_date = allocation_date.replace(tzinfo=timezone.utc)
+            if allocation_date < since:
+                kept.append(row)
+                older += 1
+        allocations = previous.select(kept)
+        allocations.extend(delta)
+
+        if len(allocations) != total or older != older_total:
+            logger.info(
+                f"{self.cloud_name}: {pool_name} delta does not add up "
+                f"({len(allocations)} != {total} or {older} != {older_total} before {since}), running full sync"
+            )
+            return None
 
-            if len(items) < page_size:
-                break
+        self.fetch_stats['delta_syncs'] += 1
+        state['table'] = allocations
+        if latest is not None:
+            state['watermark'] = max(state['watermark'], latest)
+        logger.info(f"{self.cloud_name}: {pool_name} synced incrementally: {len(delta)} changed, {total} total")
+        return allocations
 
-            page += 1
+    async def fetch_external_network_used_ips(self, network_id: str, pool_name: str) -> AllocationTable:
+        """Получить занятые IP из External Network (для vcd01/vcd02 v37)"""
+        return await self._single_flight(
+            f"extnet_{network_id}",
+            lambda: self._load_external_network_used_ips(network_id, pool_name)
+        )
 
-            if page > 100 or len(allocations) > max_total_entries:
-                logger.warning(f"Reached limit for {pool_name}: page={page}, entries={len(allocations)}")
-                break
+    def _external_network_table(self, items: List[Dict], pool_name: str) -> AllocationTable:
+        """Таблица занятых IP по элементам usedIpAddresses"""
+        allocations = AllocationTable()
+        for item in items:
+            allocation_type = item.get('allocationType', 'UNKNOWN')
+            entity_name = None
+
+            if allocation_type == 'VM_ALLOCATED':
+                entity_name = item.get('entityName') or item.get('vappName')
+            elif allocation_type == 'NAT':
+                entity_name = f"NAT on {item.get('entityName', 'Unknown')}"
+            else:
+                entity_name = item.get('entityName')
+
+            allocations.append(
+                ip_address=item.get('ipAddress', 'N/A'),
+                org_name=item.get('orgRef', {}).get('name', 'unknown'),
+                org_id=item.get('orgRef', {}).get('id'),
+                entity_name=entity_name,
+                allocation_type=allocation_type,
+                cloud_name=self.cloud_name,
+                pool_name=pool_name,
+                allocation_date=None,
+                vapp_name=item.get('vappName') or item.get('vAppName'),
+                deployed=item.get('deployed')
+            )
+        return allocations
 
-        # Подсчитываем типы аллокаций
-        type_counts: Dict[str, int] = {}
-        for alloc in allocations:
-            type_counts[alloc.allocation_type] = type_counts.get(alloc.allocation_type, 0) + 1
+    async def _external_network_unchanged(self, base_url: str, pool_name: str, state: Dict[str, Any],
+                                          first_page: Any) -> bool:
+        """
+        Дешёвая проверка, что пул не изменился с прошлой полной загрузки:
+        совпадают resultTotal, число страниц и отпечатки первой и последней
+        страницы (дозапрашивается только последняя). Изменения в середине
+        списка при том же числе адресов видны после очередной полной загрузки.
+        """
+        page_count = self._get_page_count(first_page)
+        fingerprints = state['fingerprints']
+        if (page_count is None or min(page_count, MAX_PAGES) != len(fingerprints)
+                or self._get_result_total(first_page) != state['total']
+                or _page_fingerprint(self._extract_items(first_page, pool_name)) != fingerprints[0]):
+            return False
+        if len(fingerprints) == 1:
+            return True
+        last_page = await self._fetch_page(base_url, len(fingerprints), pool_name)
+        return last_page is not None and _page_fingerprint(self._extract_items(last_page, pool_name)) == fingerprints[-1]
+
+    async def _load_external_network_used_ips(self, network_id: str, pool_name: str) -> AllocationTable:
+        """
+        Загрузить занятые IP External Network из VCD (без кэша).
+        У usedIpAddresses нет ни фильтра по времени изменения, ни ETag страниц.
+        Между полными загрузками (не реже VCD_FULL_SYNC_INTERVAL) запрашиваются
+        только первая и последняя страницы: если они и resultTotal не изменились,
+        возвращается прежняя таблица. Иначе запрашиваются все страницы (адреса
+        отсортированы — страницы стабильны), а разбираются только те, отпечаток
+        которых изменился.
+        """
+        cache_key = f"extnet_{network_id}"
+        state = self._sync_state.get(cache_key)
+        if state is not None and state['pool_name'] != pool_name:
+            state = None
+        base_url = f"{self.base_url}/cloudapi/1.0.0/externalNetworks/{network_id}/usedIpAddresses?sortAsc=ipAddress"
 
-        logger.info(f"{self.cloud_name}: Found {len(allocations)} total IPs in {pool_name}")
+        logger.info(f"Fetching used IPs for {pool_name} ({network_id})")
+        first_page = await self._fetch_page(base_url, 1, pool_name)
+        if (state is not None and first_page is not None and not self._needs_full_sync(state, pool_name)
+                and await self._external_network_unchanged(base_url, pool_name, state, first_page)):
+            self.fetch_stats['unchanged_pools'] += 1
+            logger.info(f"{self.cloud_name}: {pool_name} unchanged, {len(state['table'])} IPs")
+            return state['table']
+
+        self.fetch_stats['full_syncs'] += 1
+        pages = await self._fetch_pages(base_url, pool_name, first_page=first_page)
+        fingerprints = [_page_fingerprint(items) for items in pages]
+
+        # Отпечаток -> разобранная страница прошлой загрузки
+        previous: Dict[str, AllocationTable] = state['pages'] if state is not None else {}
+        page_tables: Dict[str, AllocationTable] = {}
+        parsed = 0
+        for fingerprint, items in zip(fingerprints, pages):
+            if fingerprint not in page_tables:
+                table = previous.get(fingerprint)
+                if table is None:
+                    table = self._external_network_table(items, pool_name)
+                    parsed += 1
+                page_tables[fingerprint] = table
+        self.fetch_stats['pages_reused'] += len(pages) - parsed
+
+        allocations = AllocationTable.concat(page_tables[fingerprint] for fingerprint in fingerprints)
+        if fingerprints:
+            self._sync_state[cache_key] = {
+                'table': allocations,
+                'pool_name': pool_name,
+                'total': self._get_result_total(first_page),
+                'fingerprints': fingerprints,
+                'pages': page_tables,
+                'full_at': time.time(),
+            }
+
+        type_column = allocations.columns['allocation_type']
+        type_counts = Counter(type_column.take(type_column.values))
+        logger.info(
+            f"{self.cloud_name}: Found {len(allocations)} total IPs in {pool_name} "
+            f"({parsed} of {len(pages)} pages changed)"
+        )
         if type_counts:
             logger.info(f"  Breakdown: {', '.join(f'{k}: {v}' for k, v in type_counts.items())}")
 
-        self.cache[cache_key] = allocations
         return allocations
 
-    def get_pool_used_ips(self, pool: Dict) -> List[IPAllocation]:
+    async def get_pool_used_ips(self, pool: Dict) -> AllocationTable:
         """Получить занятые IP для конкретного пула"""
         pool_id = pool['id']
         pool_name = pool['name']
@@ -273,33 +728,49 @@ class VCDClient:
 
         try:
             if pool_type == 'ipSpace':
-                return self.fetch_ip_space_allocations(pool_id, pool_name)
+                return await self.fetch_ip_space_allocations(pool_id, pool_name)
             else:
-                return self.fetch_external_network_used_ips(pool_id, pool_name)
+                return await self.fetch_external_network_used_ips(pool_id, pool_name)
         except Exception as e:
             logger.error(f"Error getting used IPs for pool {pool_name}: {e}")
-            return []
-
-    def get_all_used_ips(self, pools: List[Dict]) -> List[IPAllocation]:
-        """Получить все занятые IP для списка пулов"""
-        all_allocations = []
-
+            return AllocationTable()
+
+    async def get_all_used_ips(self, pools: List[Dict], timeout: Optional[float] = None,
+                               on_pool_done: Optional[Callable[[], None]] = None) -> AllocationTable:
+        """
+        Получить все занятые IP для списка пулов.
+        Пулы запрашиваются параллельно; по истечении timeout незавершённые
+        пулы отменяются, а уже собранные данные возвращаются.
+        on_pool_done вызывается по завершении загрузки каждого пула.
+        """
         for pool in pools:
-            pool_name = pool['name']
-            pool_type = pool['type']
-
-            logger.info(f"Processing pool: {pool_name} (type: {pool_type})")
+            logger.info(f"Processing pool: {pool['name']} (type: {pool['type']})")
+
+        tasks = [asyncio.create_task(self.get_pool_used_ips(pool)) for pool in pools]
+        if not tasks:
+            return AllocationTable()
+
+        if on_pool_done is not None:
+            for task in tasks:
+                task.add_done_callback(lambda _: on_pool_done())
+
+        done, pending = await asyncio.wait(tasks, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logger.error(
+                f"{self.cloud_name}: deadline {timeout}s exceeded, "
+                f"skipped {len(pending)} of {len(tasks)} pools"
+            )
 
+        all_allocations = AllocationTable()
+        for pool, task in zip(pools, tasks):
+            if task not in done:
+                continue
             try:
-                if pool_type == 'ipSpace':
-                    allocations = self.fetch_ip_space_allocations(pool['id'], pool_name)
-                else:
-                    allocations = self.fetch_external_network_used_ips(pool['id'], pool_name)
-
-                all_allocations.extend(allocations)
+                all_allocations.extend(task.result())
             except Exception as e:
-                logger.error(f"Error processing pool {pool_name}: {e}")
-                continue
+                logger.error(f"Error processing pool {pool['name']}: {e}")
 
         logger.info(f"{self.cloud_name}: Total {len(all_allocations)} IPs across all pools")
         return all_allocations